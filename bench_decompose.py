@@ -0,0 +1,156 @@
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+from utils.decompose import DECOMPOSER_VERSION, DEFAULT_TAGS, decompose_job, decompose_resume, find_ul_tags
+from utils.inference import build_prompt
+from utils.synthetic import synthetic_details, synthetic_job, synthetic_resume
+
+RESULTS_FILE = "bench_results.json"
+# a case is a regression when it is this much slower (or bigger) than the baseline
+DEFAULT_THRESHOLD = 0.25
+
+# (name, entries/items scale, nesting depth, share of non-breaking spaces)
+SIZES = [
+    ("small", 1, 0, 0.05),
+    ("medium", 2, 1, 0.1),
+    ("large", 4, 2, 0.2),
+    ("xlarge", 8, 3, 0.3),
+]
+QUICK_SIZES = SIZES[:2]
+
+def measure(function, repeat: int) -> dict:
+    """
+    Time a function and record its peak memory
+        The best of repeat runs is the time, a separate run under
+        tracemalloc gives the peak so tracing doesn't slow the timed runs.
+    @param function: called without arguments
+    @param repeat: the number of timed runs
+    @return: the measurement
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times), "peak_bytes": peak}
+
+def cases(scale: int, depth: int, nbsp: float) -> dict:
+    """
+    Build the functions to benchmark for one corpus size
+    @param scale: multiplies the number of entries and bullets
+    @param depth: the ul nesting depth
+    @param nbsp: the share of non-breaking spaces
+    @return: name -> (input bytes, function)
+    """
+    resume = synthetic_resume(entries=2 * scale, items=4 * scale, depth=depth, skills=4 * scale, nbsp=nbsp, seed=scale)
+    job = synthetic_job(items=3 * scale, depth=depth, nbsp=nbsp, seed=scale)
+    body = BeautifulSoup(resume.strip().replace("\n", ""), "html.parser").find("body")
+    resume_json = decompose_resume(resume)
+    job_json = decompose_job(job)
+    details = synthetic_details(scale)
+    resume_bytes = len(resume.encode("utf-8"))
+    return {
+        "decompose_job": (len(job.encode("utf-8")), lambda: decompose_job(job)),
+        "decompose_job[soup]": (len(job.encode("utf-8")), lambda: decompose_job(job, engine="soup")),
+        "decompose_resume": (resume_bytes, lambda: decompose_resume(resume)),
+        "decompose_resume[soup]": (resume_bytes, lambda: decompose_resume(resume, engine="soup")),
+        "find_ul_tags": (resume_bytes, lambda: find_ul_tags(body, DEFAULT_TAGS)),
+        "build_prompt": (len(resume_json) + len(job_json), lambda: build_prompt(job_json, resume_json, details)),
+    }
+
+def scaling(points: list) -> float:
+    """
+    Fit the exponent of time against input size on a log-log scale
+        1.0 is linear, 2.0 quadratic
+    @param points: (bytes, seconds) pairs
+    @return: the slope, None with fewer than two points
+    """
+    points = [(math.log(x), math.log(y)) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+def run(sizes: list, repeat: int, log=print) -> dict:
+    """
+    Run every case at every size
+    @param sizes: the corpus sizes
+    @param repeat: the number of timed runs per case
+    @param log: called with a line per case
+    @return: the results
+    """
+    results = {}
+    for size, scale, depth, nbsp in sizes:
+        for name, (size_bytes, function) in cases(scale, depth, nbsp).items():
+            result = measure(function, repeat)
+            result["bytes"] = size_bytes
+            result["bytes_per_second"] = size_bytes / result["seconds"] if result["seconds"] else None
+            results.setdefault(name, {})[size] = result
+            log(f"{name:24} {size:7} {size_bytes:>10} B {result['seconds'] * 1000:10.2f} ms {result['peak_bytes'] / 1024:10.1f} KiB")
+    report = {
+        "decomposer_version": DECOMPOSER_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+        "scaling": {name: scaling([(r["bytes"], r["seconds"]) for r in by_size.values()]) for name, by_size in results.items()},
+    }
+    return report
+
+def compare(report: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """
+    Find the cases that got slower or use more memory than the baseline
+    @param report: the new results
+    @param baseline: the stored results
+    @param threshold: the allowed relative increase
+    @return: a line per regression
+    """
+    regressions = []
+    for name, by_size in report["results"].items():
+        for size, result in by_size.items():
+            old = baseline.get("results", {}).get(name, {}).get(size)
+            if old is None:
+                continue
+            for metric in ["seconds", "peak_bytes"]:
+                if old[metric] and result[metric] > old[metric] * (1 + threshold):
+                    regressions.append(f"{name} {size} {metric}: {old[metric]:.6g} -> {result[metric]:.6g} (+{100 * (result[metric] / old[metric] - 1):.0f}%)")
+    return regressions
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark the decomposers on synthetic Google Docs HTML")
+    parser.add_argument("--output", type=str, default=RESULTS_FILE, help="The JSON file to write the results to")
+    parser.add_argument("--compare", type=str, default=None, help="A baseline results file, exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="The allowed relative slowdown before a case counts as a regression")
+    parser.add_argument("--repeat", type=int, default=5, help="The number of timed runs per case")
+    parser.add_argument("--quick", action="store_true", help="Only run the small sizes")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    report = run(QUICK_SIZES if args.quick else SIZES, args.repeat)
+    for name, slope in report["scaling"].items():
+        if slope is not None:
+            print(f"{name:24} scales as n^{slope:.2f}")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
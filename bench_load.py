@@ -0,0 +1,210 @@
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.backends import load_backend
+from utils.backends.fake import DECODE_TPS, JITTER, PREFILL_TPS
+from utils.budget import fit_prompt
+from utils.cache import DecomposeCache
+from utils.inference import Inference, load_config
+from utils.result_cache import CachedInference, ResultCache
+from utils.scheduler import MicroBatcher
+from utils.synthetic import synthetic_details, synthetic_job, synthetic_resume
+
+RESULTS_FILE = "load_results.json"
+OUTPUT_PATH = "output/load/"
+STAGES = ["decompose", "prompt", "generate", "write"]
+PERCENTILES = [50, 95, 99]
+
+def percentile(values: list, q: float) -> float:
+    """
+    Get a percentile by the nearest rank
+    @param values: the values
+    @param q: the percentile, 0 to 100
+    @return: the value, None without values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def distribution(values: list) -> dict:
+    """
+    Summarize latencies
+    @param values: the latencies in seconds
+    @return: the percentiles, mean and max
+    """
+    summary = {f"p{q}": round(percentile(values, q), 4) if values else None for q in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 4) if values else None
+    summary["max"] = round(max(values), 4) if values else None
+    return summary
+
+def workload(requests: int, jobs: int, resumes: int, rate: float, seed: int = 0) -> list:
+    """
+    Plan the requests of a run
+        Every request picks one of jobs postings and resumes resumes, so
+        the decompose and result caches see repeats like in real use.
+        Requests arrive as a Poisson process of rate per second, or all at
+        once when rate is 0.
+    @param requests: the number of requests
+    @param jobs: the number of distinct job postings
+    @param resumes: the number of distinct resumes
+    @param rate: the mean arrivals per second, 0 for a closed loop
+    @param seed: the random seed
+    @return: (arrival offset in seconds, job seed, resume seed) per request
+    """
+    rng = random.Random(seed)
+    plan = []
+    arrival = 0.0
+    for _ in range(requests):
+        if rate:
+            arrival += rng.expovariate(rate)
+        plan.append((arrival, rng.randrange(jobs), rng.randrange(resumes)))
+    return plan
+
+def run(inference: Inference, requests: int = 20, concurrency: int = 4, rate: float = 0.0, jobs: int = 5, resumes: int = 2, batch_size: int = 1,
+        output_path: str = OUTPUT_PATH, seed: int = 0, log=print) -> dict:
+    """
+    Drive the whole pipeline with simulated users
+        Each request decomposes a synthetic job and resume, fits the prompt,
+        generates the letter and writes it, the way the menu does. Up to
+        concurrency requests are in flight, the rest wait from their
+        arrival, and that wait is part of their latency.
+    @param inference: the inference object, usually the fake backend
+    @param requests: the number of requests
+    @param concurrency: the most requests in flight
+    @param rate: the mean arrivals per second, 0 sends them all at once
+    @param jobs: the number of distinct job postings
+    @param resumes: the number of distinct resumes
+    @param batch_size: with more than 1, generate goes through a MicroBatcher
+    @param output_path: where the letters and the decompose cache go
+    @param seed: the random seed of the workload
+    @param log: called with a line per finished request, None for quiet
+    @return: the report
+    """
+    os.makedirs(output_path, exist_ok=True)
+    decompose_cache = DecomposeCache(os.path.join(output_path, "decompose"))
+    config = inference.get_config()
+    batcher = MicroBatcher(inference, batch_size) if batch_size > 1 else None
+    generate = batcher.generate if batcher is not None else inference.generate
+    plan = workload(requests, jobs, resumes, rate, seed)
+    lock = threading.Lock()
+    results = []
+    failed = []
+
+    def serve(index: int, arrival: float, job_seed: int, resume_seed: int) -> None:
+        started = time.perf_counter()
+        stages = {}
+        try:
+            stage = time.perf_counter()
+            job = decompose_cache.decompose_job(synthetic_job(seed=job_seed), config.job.headers)
+            resume = decompose_cache.decompose_resume(synthetic_resume(seed=resume_seed), config.resume.tags)
+            stages["decompose"] = time.perf_counter() - stage
+            stage = time.perf_counter()
+            prompt, _ = fit_prompt(job, resume, synthetic_details(job_seed), inference)
+            stages["prompt"] = time.perf_counter() - stage
+            stage = time.perf_counter()
+            letter = generate(prompt)
+            stages["generate"] = time.perf_counter() - stage
+            stage = time.perf_counter()
+            with open(os.path.join(output_path, f"letter-{index}.md"), "w") as f:
+                f.write(letter)
+            stages["write"] = time.perf_counter() - stage
+        except Exception as e:
+            with lock:
+                failed.append((index, str(e)))
+            if log is not None:
+                log(f"Request {index} failed: {e}")
+            return
+        finished = time.perf_counter()
+        with lock:
+            results.append({"wait": started - (start + arrival), "latency": finished - (start + arrival), "stages": stages, "chars": len(letter)})
+        if log is not None:
+            log(f"Request {index}: {finished - (start + arrival):.2f}s, job {job_seed}, resume {resume_seed}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, (arrival, job_seed, resume_seed) in enumerate(plan):
+            delay = start + arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(serve, index, arrival, job_seed, resume_seed)
+    seconds = time.perf_counter() - start
+    if batcher is not None:
+        batcher.close()
+    report = {
+        "requests": requests,
+        "completed": len(results),
+        "failed": failed,
+        "concurrency": concurrency,
+        "rate": rate,
+        "jobs": jobs,
+        "resumes": resumes,
+        "batch_size": batch_size,
+        "seconds": round(seconds, 3),
+        "letters_per_minute": round(60 * len(results) / seconds, 3) if seconds else 0.0,
+        "chars_per_second": round(sum(result["chars"] for result in results) / seconds, 3) if seconds else 0.0,
+        "latency": distribution([result["latency"] for result in results]),
+        "wait": distribution([result["wait"] for result in results]),
+        "stages": {name: distribution([result["stages"][name] for result in results]) for name in STAGES},
+        "decompose_cache": {"hits": decompose_cache.hits, "misses": decompose_cache.misses},
+    }
+    backend = getattr(inference, "inference", inference)
+    if hasattr(backend, "stats"):
+        report["backend"] = backend.stats()
+    return report
+
+def format_report(report: dict) -> list:
+    """
+    Format a report for the terminal
+    @param report: the report
+    @return: the lines
+    """
+    lines = [f"Completed {report['completed']}/{report['requests']} requests in {report['seconds']}s: {report['letters_per_minute']} letters/min, {report['chars_per_second']} chars/s"]
+    for name in ["latency", "wait"]:
+        values = report[name]
+        lines.append(f"  {name:9} " + "  ".join(f"{key} {value}s" for key, value in values.items() if value is not None))
+    for name, values in report["stages"].items():
+        lines.append(f"  {name:9} " + "  ".join(f"{key} {value}s" for key, value in values.items() if value is not None))
+    if "backend" in report:
+        lines.append("  backend   " + "  ".join(f"{key} {value}" for key, value in report["backend"].items()))
+    return lines
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Load test the decompose, prompt, generate and write pipeline with a simulated model")
+    parser.add_argument("--requests", type=int, default=20, help="The number of requests to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="The most requests in flight")
+    parser.add_argument("--rate", type=float, default=0.0, help="The mean requests per second, 0 sends them all at once")
+    parser.add_argument("--jobs", type=int, default=5, help="The number of distinct job postings")
+    parser.add_argument("--resumes", type=int, default=2, help="The number of distinct resumes")
+    parser.add_argument("--batch_size", type=int, default=1, help="Group up to this many generations per generate_batch call")
+    parser.add_argument("--backend", type=str, default="fake", help="The backend to load, fake needs no model")
+    parser.add_argument("--config", type=str, default=None, help="The config profile in assets/configs/ to load the backend with")
+    parser.add_argument("--prefill_tps", type=float, default=PREFILL_TPS, help="The simulated prompt tokens evaluated per second")
+    parser.add_argument("--decode_tps", type=float, default=DECODE_TPS, help="The simulated tokens decoded per second")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="The spread of the simulated token latency")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Divide every simulated delay by this")
+    parser.add_argument("--result_cache", action="store_true", help="Store and reuse letters like the menu does")
+    parser.add_argument("--seed", type=int, default=0, help="Seeds the workload and the simulated model")
+    parser.add_argument("--letters", type=str, default=OUTPUT_PATH, help="The directory to write the letters and caches to")
+    parser.add_argument("--output", type=str, default=RESULTS_FILE, help="The JSON file to write the report to")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = get_args()
+    config = load_config(args.config) if args.config else None
+    if args.backend == "fake":
+        inference = load_backend("fake", None, config=config, prefill_tps=args.prefill_tps, decode_tps=args.decode_tps, jitter=args.jitter, speedup=args.speedup, seed=args.seed)
+    else:
+        # ggml takes its GPU layers first, autogptq its max memory
+        inference = load_backend(args.backend, 0 if args.backend == "ggml" else None, config=config)
+    if args.result_cache:
+        inference = CachedInference(inference, ResultCache(os.path.join(args.letters, "results.sqlite")))
+    report = run(inference, args.requests, args.concurrency, args.rate, args.jobs, args.resumes, args.batch_size, args.letters, args.seed)
+    print("\n".join(format_report(report)))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
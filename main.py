@@ -1,6 +1,9 @@
 import os
 import curses
-from utils.inference import Inference
+from utils.backends import BACKENDS, load_backend
+from utils.inference import Inference, default_config, load_config
+from utils.metrics import MetricsLog
+from utils.result_cache import CachedInference
 from utils.screen import render_menu
 import argparse
 
@@ -8,25 +11,115 @@ def get_args():
     parser = argparse.ArgumentParser(description="Cover Letter Generator")
     parser.add_argument("--ggml", action="store_true", help="Use GGML")
     parser.add_argument("--autogptq", action="store_true", help="Use AutoGPTQ")
+    parser.add_argument("--backend", type=str, default=None, choices=list(BACKENDS), help="The inference backend to use, overrides --ggml and --autogptq")
     # comma separated list of RAM with the assumption they are in GB
     parser.add_argument("--max_memory", type=str, default="8", help="The max memory to use: 12,12,12 = \{ 0:\"12GB\", 1:\"12GB\", 2:\"12GB\" \}")
     parser.add_argument("--gpu_layers", type=int, default=0, help="The number of layers to use on the GPU")
+    # model server, keeps one backend loaded for the TUI and batch runs to attach to
+    parser.add_argument("--serve", action="store_true", help="Load the model and serve it until interrupted")
+    parser.add_argument("--connect", action="store_true", help="Use the model of a running --serve instead of loading one")
+    parser.add_argument("--address", type=str, default="assets/server.sock", help="The server UNIX socket path or host:port")
+    parser.add_argument("--seed", type=int, default=None, help="Seed the sampling so the same prompt and settings give the same letter")
+    parser.add_argument("--draft_file", type=str, default=None, help="Small GGML model to draft tokens for speculative decoding with --ggml")
+    parser.add_argument("--draft_k", type=int, default=None, help="The number of tokens the draft model proposes at a time")
+    parser.add_argument("--candidates", type=int, default=None, help="Generate this many letters per prompt and show them best first")
+    parser.add_argument("--deadline", type=float, default=None, help="The most seconds a generation may take, the letter so far is kept")
+    parser.add_argument("--duplicate_threshold", type=float, default=None, help="Reuse the letter of a job at least this similar (0-1) that has one for the same resume")
+    parser.add_argument("--bypass_cache", action="store_true", help="Generate again instead of reusing a stored letter, the new letter is still stored")
+    parser.add_argument("--metrics", type=str, default="output/metrics.jsonl", help="The JSON lines file every generation's timings are appended to")
+    parser.add_argument("--prometheus", type=str, default=None, help="Also write the last generation's timings to this file in the Prometheus text format")
+    parser.add_argument("--config", type=str, default=None, help="The config profile in assets/configs/ to load the model with")
+    parser.add_argument("--tune", action="store_true", help="Benchmark the GGML runtime settings on this host and save the fastest as a config profile")
+    parser.add_argument("--profile", type=str, default="tuned", help="The profile name --tune writes, load it with --config")
+    parser.add_argument("--decompose_all", action="store_true", help="Decompose every job and resume that changed since the last run, then exit")
+    # batch mode, skips the TUI when --jobs is given
+    parser.add_argument("--jobs", type=str, default=None, help="Directory of job HTML files to generate cover letters for without the TUI")
+    parser.add_argument("--resumes", type=str, nargs="+", default=None, help="The resume HTML files to use in batch mode")
+    parser.add_argument("--details", type=str, default=None, help="JSON file with your details for batch mode")
+    parser.add_argument("--output", type=str, default="output/", help="The directory to write batch cover letters to")
+    parser.add_argument("--batch_size", type=int, default=1, help="The number of prompts to generate together in batch mode")
+    parser.add_argument("--queue", type=str, default=None, help="SQLite file that keeps batch progress, a rerun skips finished letters and continues interrupted ones")
+    parser.add_argument("--workers", type=int, default=None, help="The number of decompose processes in batch mode")
     return parser.parse_args()
 
-def main(stdscr):
+def load_inference(args) -> Inference:
+    """
+    Load the inference backend selected by the arguments
+    @param args: the parsed arguments
+    @return: the inference object
+    """
+    if args.connect:
+        from utils.server import RemoteInference
+        return RemoteInference(args.address)
     mode = "ggml"
-    args = get_args()
     max_memory = None
     if args.ggml:
         mode = "ggml"
     elif args.autogptq:
         mode = "autogptq"
+    if args.backend:
+        mode = args.backend
     if args.max_memory and mode=="autogptq":
         max_memory = {}
         for i, memory in enumerate(args.max_memory.split(",")):
             max_memory[i] = memory+"GB"
     if args.gpu_layers and mode=="ggml":
         max_memory = args.gpu_layers
+
+    # only the selected backend's dependencies are imported
+    inference = load_backend(mode, max_memory, config=load_config(args.config) if args.config else None)
+    if args.seed is not None or args.draft_file or args.draft_k or args.candidates or args.deadline or args.duplicate_threshold:
+        config = inference.get_config()
+        if args.deadline:
+            config.settings.deadline = args.deadline
+        if args.duplicate_threshold:
+            config.settings.duplicate_threshold = args.duplicate_threshold
+        if args.candidates:
+            config.settings.candidates = args.candidates
+        if args.seed is not None:
+            config.settings.seed = args.seed
+        if args.draft_file:
+            config.speculative.draft_file = args.draft_file
+        if args.draft_k:
+            config.speculative.k = args.draft_k
+        inference.set_config(config)
+    return CachedInference(inference, bypass=args.bypass_cache)
+
+def batch(args):
+    from utils.batch import run_batch
+    if not args.resumes or not args.details:
+        raise Exception("Batch mode requires --resumes and --details")
+    inference = load_inference(args)
+    duplicates = None
+    threshold = inference.get_config().settings.duplicate_threshold
+    if threshold is not None:
+        from utils.dedupe import DuplicateIndex
+        duplicates = DuplicateIndex(threshold=threshold)
+    summary = run_batch(inference, args.jobs, args.resumes, args.details, args.output, args.workers, batch_size=args.batch_size, queue_path=args.queue, duplicates=duplicates)
+    print(summary)
+
+def tune_host(args):
+    from utils.backends.ggml import MODEL_FILE, MODEL_ID
+    from utils.tuner import available_files, load_ggml, tune, write_profile
+    files = available_files(MODEL_ID) or [MODEL_FILE]
+    print(f"Tuning {', '.join(files)}")
+    results = tune(files, log=print, load=lambda model_file: load_ggml(model_file, args.gpu_layers))
+    path = write_profile(results[0], args.profile, load_config(args.config) if args.config else None, args.gpu_layers, results)
+    print(f"Fastest: {results[0]}\nSaved as {path}, use it with --config {args.profile}")
+
+def serve(args):
+    from utils.server import ModelServer
+    server = ModelServer(load_inference(args), args.address)
+    print(f"Serving the model on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+def main(stdscr):
+    args = get_args()
     # Initialize curses
     curses.curs_set(0)  # Hide the cursor
     stdscr.clear()
@@ -41,18 +134,23 @@ def main(stdscr):
     if not os.path.exists("output/"):
         os.mkdir("output/")
 
-    inference: Inference = None
-
-    if mode == "ggml":
-        from utils.inference import InferenceGGML
-        inference = InferenceGGML(max_memory)
-    elif mode == "autogptq":
-        from utils.inference import InferenceGPTQ
-        inference = InferenceGPTQ(max_memory)
-    if inference is None:
-        raise Exception("Invalid mode")
-    
-    render_menu(stdscr, inference)
-    
+    inference = load_inference(args)
+
+    render_menu(stdscr, inference, MetricsLog(args.metrics, args.prometheus))
+
 if __name__ == "__main__":
-    curses.wrapper(main)
\ No newline at end of file
+    args = get_args()
+    if args.decompose_all:
+        from utils.bulk import decompose_all
+        from utils.dedupe import DuplicateIndex
+        # the menu's headers and tags, or the manifest would see every file as changed
+        config = load_config(args.config) if args.config else default_config()
+        print(decompose_all(config.job.headers, config.resume.tags, workers=args.workers, log=print, duplicates=DuplicateIndex()))
+    elif args.tune:
+        tune_host(args)
+    elif args.serve:
+        serve(args)
+    elif args.jobs is not None:
+        batch(args)
+    else:
+        curses.wrapper(main)
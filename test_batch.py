@@ -0,0 +1,35 @@
+import json
+from test_budget import WordInference
+from test_bulk import JOB as JOB_HTML
+from utils.batch import run_batch
+from utils.cache import DecomposeCache
+
+RESUME_HTML = "<html><body><p>Skills:</p><ul><li>Python</li></ul></body></html>"
+
+class NamedLetters(WordInference):
+    def __init__(self) -> None:
+        super().__init__(100000)
+    def generate(self, prompt: str) -> str:
+        company = prompt.split("I am applying to ")[1].split(" as a ")[0]
+        return f"Dear {company}, I want to work with you."
+
+def test_run_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.cache.decompose_cache", DecomposeCache(str(tmp_path / "decompose")))
+    jobs = tmp_path / "jobs"
+    jobs.mkdir()
+    (jobs / "acme.html").write_text(JOB_HTML)
+    (jobs / "initech.html").write_text(JOB_HTML)
+    # no header to find, nothing to decompose
+    (jobs / "broken.html").write_text("<html><body><p>Nothing here</p></body></html>")
+    resumes = [str(tmp_path / "short.html"), str(tmp_path / "long.html")]
+    for path in resumes:
+        with open(path, "w") as f:
+            f.write(RESUME_HTML)
+    (tmp_path / "details.json").write_text(json.dumps({"company": "Acme", "jobs": {"initech": {"company": "Initech"}}}))
+    out = tmp_path / "out"
+    summary = run_batch(NamedLetters(), str(jobs), resumes, str(tmp_path / "details.json"), str(out), 1, log=lambda line: None)
+    assert (summary.pairs, summary.generated, summary.skipped, summary.reused) == (6, 4, 0, 0)
+    assert sorted(path.name for path in out.iterdir()) == ["acme__long.md", "acme__short.md", "initech__long.md", "initech__short.md"]
+    assert (out / "initech__short.md").read_text() == "Dear Initech, I want to work with you."
+    assert sorted(summary.failed) == [(str(jobs / "broken.html"), path, "could not decompose job description") for path in sorted(resumes)]
+    assert summary.output_chars == sum(len(path.read_text()) for path in out.iterdir())
@@ -0,0 +1,40 @@
+import json
+import pytest
+from utils.budget import fit_prompt
+from utils.encoding import encode
+from utils.inference import Inference, build_prompt, default_config
+
+JOB = json.dumps({"Requirements": ["Python", "Docker"], "Responsibilities": ["Write code", "Review code"], "Optional Requirements": ["Rust"]}, indent=4)
+RESUME = json.dumps({"Skills": ["python"], "Experience/Activities": [{"title": "Engineer", "description": ["Built things"]}], "Projects": [{"title": "https://example.com", "description": ["A project"]}]}, indent=4)
+DETAILS = {key: "x" for key in ["name", "phone_number", "email", "address", "company", "company_address_1", "company_address_2", "job_title"]}
+
+class WordInference(Inference):
+    """
+    Counts whitespace separated words as tokens
+    """
+    def __init__(self, context_length: int) -> None:
+        self.config = default_config()
+        self.config.settings.max_new_tokens = 10
+        self.config.settings.context_length = context_length
+    def get_config(self):
+        return self.config
+    def count_tokens(self, text: str) -> int:
+        return len(text.split())
+
+def test_encodings_are_smaller():
+    sizes = [len(build_prompt(JOB, RESUME, DETAILS, encoding)) for encoding in ["json", "minified", "lines"]]
+    assert sizes[0] > sizes[1] and sizes[0] > sizes[2]
+    assert json.loads(encode(JOB, "minified")) == json.loads(JOB)
+    assert "  * Built things" in encode(RESUME, "lines")
+
+def test_fit_prompt_trims_lowest_priority_first():
+    full = WordInference(10000).count_tokens(build_prompt(JOB, RESUME, DETAILS))
+    prompt, trimmed = fit_prompt(JOB, RESUME, DETAILS, WordInference(full + 10 - 1))
+    assert trimmed == ["job Optional Requirements: Rust"]
+    assert "Rust" not in prompt
+    prompt, trimmed = fit_prompt(JOB, RESUME, DETAILS, WordInference(full + 10))
+    assert trimmed == []
+
+def test_fit_prompt_raises_when_nothing_fits():
+    with pytest.raises(Exception, match="even after trimming"):
+        fit_prompt(JOB, RESUME, DETAILS, WordInference(50))
@@ -0,0 +1,22 @@
+import os
+from utils.bulk import decompose_all
+
+JOB = "<html><body><p>Requirements:</p><ul><li>Python</li><li>Docker</li></ul></body></html>"
+
+def test_decompose_all_is_incremental(tmp_path):
+    jobs = tmp_path / "jobs"
+    jobs.mkdir()
+    (jobs / "a.html").write_text(JOB)
+    (jobs / "b.html").write_text(JOB.replace("Python", "Rust"))
+    (jobs / "broken.html").write_text("<p>no body</p>")
+    paths = {"job_path": str(jobs), "resume_path": str(tmp_path / "resumes"), "manifest_path": str(tmp_path / "manifest.json"), "workers": 1}
+    summary = decompose_all(**paths)
+    assert summary.decomposed == 2
+    assert [os.path.basename(path) for path, _ in summary.failed] == ["broken.html"]
+    assert "Rust" in (jobs / "b.json").read_text()
+    summary = decompose_all(**paths)
+    assert (summary.decomposed, summary.skipped) == (0, 2)
+    (jobs / "b.html").write_text(JOB.replace("Python", "Go"))
+    summary = decompose_all(**paths)
+    assert (summary.decomposed, summary.skipped) == (1, 1)
+    assert "Go" in (jobs / "b.json").read_text()
@@ -0,0 +1,27 @@
+from utils.cache import DecomposeCache, cache_key
+
+JOB = "<html><body><p>Requirements:</p><ul><li>Python</li><li>Docker</li></ul></body></html>"
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = DecomposeCache(str(tmp_path))
+    first = cache.decompose_job(JOB)
+    second = cache.decompose_job(JOB)
+    assert first == second
+    assert cache.hits == 1
+    assert cache.misses == 1
+    # a new instance reads the results left on disk
+    assert DecomposeCache(str(tmp_path)).decompose_job(JOB) == first
+
+def test_cache_key_covers_patterns():
+    assert cache_key("job", JOB) != cache_key("job", JOB, ["requirements:"])
+    assert cache_key("job", JOB) != cache_key("resume", JOB)
+
+def test_cache_lru_eviction(tmp_path):
+    cache = DecomposeCache(str(tmp_path), max_bytes=10)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    cache.get("a")
+    cache.put("c", "12345")
+    assert cache.evictions == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
@@ -1,4 +1,6 @@
-from utils.decompose import decompose_job, decompose_resume, find_ul_tags
+from utils.decompose import decompose_job, decompose_resume, find_ul_tags, get_text, get_texts
+from utils.text import ITEM_TABLE
+from bs4 import BeautifulSoup
 import os
 
 def test_decompose_job():
@@ -23,6 +25,14 @@ def test_decompose_resume():
             assert resume != '{}'
             print(resume)
 
+def test_get_text():
+    depth = 5000
+    soup = BeautifulSoup("<p>" + "<span>a\xa0" * depth + "“b”" + "</span>" * depth + "<!--c--></p>", "html.parser")
+    text = get_text(soup.p)
+    assert text == "a " * depth + "“b”"
+    assert get_text(soup.p, ITEM_TABLE).endswith('"b"')
+    assert get_texts([soup.p.span, None], strip=True) == [text.strip(), ""]
+
 if __name__ == "__main__":
     test_decompose_job()
     test_decompose_resume()
\ No newline at end of file
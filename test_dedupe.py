@@ -0,0 +1,74 @@
+import json
+import os
+from test_budget import WordInference
+from test_bulk import JOB as JOB_HTML
+from utils.batch import run_batch
+from utils.bulk import decompose_all
+from utils.cache import DecomposeCache
+from utils.dedupe import DuplicateIndex, signature, similarity
+
+JOB = json.dumps({
+    "Requirements": ["Years of Python and Django experience building web services", "Strong SQL skills with PostgreSQL and Redis"],
+    "Responsibilities": ["Build REST APIs for our payments platform", "Mentor junior engineers and review code", "Work with product on the roadmap"],
+})
+REPOST = JOB.replace("Strong", "Solid")
+OTHER = json.dumps({"Requirements": ["Registered nurse license", "Two years of ICU experience"], "Responsibilities": ["Care for patients on night shifts"]})
+RESUME = json.dumps({"Skills": ["python"]})
+
+def test_signature():
+    assert similarity(signature(JOB), signature(JOB)) == 1.0
+    assert similarity(signature(JOB), signature(REPOST)) > 0.7
+    assert similarity(signature(JOB), signature(OTHER)) < 0.1
+
+def test_find_letter(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "dedupe.sqlite"), threshold=0.7)
+    assert index.add("a.html", JOB) and not index.add("a.html", JOB)
+    index.add("other.html", OTHER)
+    assert [key for key, _ in index.duplicates(REPOST)] == [os.path.abspath("a.html")]
+    # the same file spelled another way
+    assert index.duplicates(JOB, exclude="./a.html") == [] and "./a.html" in index
+    assert index.find_letter(REPOST, RESUME) is None
+    index.save_letter("a.html", RESUME, {"company": "Acme", "job_title": "Engineer"}, "Dear Acme, I want to be your Engineer.")
+    duplicate = index.find_letter(REPOST, RESUME)
+    assert duplicate.job == os.path.abspath("a.html")
+    assert duplicate.adapt({"company": "Initech", "job_title": ""}) == "Dear Initech, I want to be your Engineer."
+    assert index.find_letter(REPOST, json.dumps({"Skills": ["rust"]})) is None
+    # a changed job is hashed again and loses its letters
+    assert index.add("a.html", OTHER)
+    assert index.find_letter(REPOST, RESUME) is None
+
+def test_decompose_all_indexes(tmp_path):
+    jobs = tmp_path / "jobs"
+    jobs.mkdir()
+    (jobs / "a.html").write_text(JOB_HTML)
+    (jobs / "b.html").write_text(JOB_HTML)
+    paths = {"job_path": str(jobs), "resume_path": str(tmp_path / "resumes"), "manifest_path": str(tmp_path / "manifest.json"), "workers": 1}
+    index = DuplicateIndex(str(tmp_path / "dedupe.sqlite"))
+    decompose_all(**paths, duplicates=index)
+    job = (jobs / "a.json").read_text()
+    assert [key for key, _ in index.duplicates(job, exclude=str(jobs / "a.html"))] == [str(jobs / "b.html")]
+    (jobs / "b.html").unlink()
+    decompose_all(**paths, duplicates=index)
+    assert str(jobs / "b.html") not in index
+
+class Letters(WordInference):
+    def __init__(self) -> None:
+        super().__init__(100000)
+        self.prompts = []
+    def generate(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return "Dear Acme, I want to work with you."
+
+def test_batch_reuses_reposts(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.cache.decompose_cache", DecomposeCache(str(tmp_path / "decompose")))
+    jobs = tmp_path / "jobs"
+    jobs.mkdir()
+    for name in ["a", "b", "c"]:
+        (jobs / f"{name}.html").write_text(JOB_HTML)
+    (tmp_path / "resume.html").write_text("<html><body><p>Skills:</p><ul><li>Python</li></ul></body></html>")
+    (tmp_path / "details.json").write_text(json.dumps({"company": "Acme", "jobs": {"b": {"company": "Initech"}}}))
+    inference = Letters()
+    summary = run_batch(inference, str(jobs), [str(tmp_path / "resume.html")], str(tmp_path / "details.json"), str(tmp_path / "out"), 1, log=lambda line: None,
+                        batch_size=2, duplicates=DuplicateIndex(str(tmp_path / "dedupe.sqlite")))
+    assert (summary.generated, summary.reused, len(inference.prompts)) == (1, 2, 1)
+    assert (tmp_path / "out" / "b__resume.md").read_text() == "Dear Initech, I want to work with you."
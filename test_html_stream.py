@@ -0,0 +1,37 @@
+from utils.decompose import decompose_job, decompose_resume, find_sections
+from utils.synthetic import synthetic_job, synthetic_resume
+
+RESUME = """<html><head><style>.c1{color:red}</style></head><body class="c5">
+<p class="c2"><span>Skills: Python, Docker, C/C++ and JSON</span></p>
+<p class="c2"><span>Cover Gen – https://github.com/example/cover-gen</span></p>
+<ul class="c3"><li><span>Parses Google&nbsp;Docs exports</span></li><li><span>Streams “tokens”</span>
+<ul><li><span>Nested don’t</span></li></ul></li></ul>
+<p><span>Teaching Assistant • 2021</span></p>
+<ul><ul><li>direct child list</li><li>&#8217;quoted&#8217;</li></ul><li>after</li></ul>
+<!-- comment --><ul><li>after a comment</li></ul>
+</body></html>"""
+
+JOB = """<html><body><div><p><b>Responsibilities:</b></p><ul><li>Write Rust</li><li>Review &amp; ship</li></ul>
+<p>Nice to have</p> <ul><li>Go</li></ul><p>What you have</p><ul><li><br>Python</li></ul></div></body></html>"""
+
+def test_stream_matches_soup_sections():
+    for html in [RESUME, JOB, "<html><body></body></html>", "<body><ul><li>unclosed"]:
+        for tags in [None, ["python", "docker", "c/c++", "json", "rust"]]:
+            assert find_sections(html, tags, "stream") == find_sections(html, tags, "soup")
+
+def test_stream_matches_soup_json():
+    assert decompose_resume(RESUME) == decompose_resume(RESUME, engine="soup")
+    assert decompose_job(JOB) == decompose_job(JOB, engine="soup")
+    assert decompose_job(JOB) != "{}"
+
+def test_stream_without_body():
+    assert decompose_job("<p>Requirements:</p><ul><li>x</li></ul>") == "{}"
+    assert decompose_job("<p>Requirements:</p><ul><li>x</li></ul>", engine="soup") == "{}"
+    assert decompose_resume("<p>Skills:</p><ul><li>Python</li></ul>", engine="soup") == decompose_resume("<p>Skills:</p><ul><li>Python</li></ul>")
+
+def test_stream_matches_soup_synthetic():
+    for depth in range(3):
+        resume = synthetic_resume(entries=2, items=3, depth=depth, nbsp=0.3, seed=depth)
+        job = synthetic_job(items=3, depth=depth, nbsp=0.3, seed=depth)
+        assert decompose_resume(resume) == decompose_resume(resume, engine="soup")
+        assert decompose_job(job) == decompose_job(job, engine="soup")
@@ -0,0 +1,30 @@
+import json
+import subprocess
+import sys
+import pytest
+
+# modules only the GPU backend needs
+HEAVY_MODULES = ["torch", "transformers", "auto_gptq", "ctransformers"]
+# seconds, generous so a loaded CI box doesn't flake
+IMPORT_BUDGET = 2.0
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main, utils.screen, utils.batch, utils.decompose, utils.inference
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [name for name in %r if name in sys.modules]}))
+""" % HEAVY_MODULES
+
+def test_import_budget():
+    # a fresh interpreter, the test session may already have imported anything
+    result = subprocess.run([sys.executable, "-c", SCRIPT], capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout)
+    assert report["loaded"] == []
+    assert report["elapsed"] < IMPORT_BUDGET
+
+def test_backend_registry():
+    from utils.backends import BACKENDS, backend_class
+    assert set(BACKENDS) >= {"ggml", "autogptq"}
+    with pytest.raises(Exception, match="missing"):
+        backend_class("missing")
@@ -0,0 +1,135 @@
+import json
+import socket
+from test_bulk import JOB as JOB_HTML
+from utils.batch import run_batch
+from utils.cache import DecomposeCache
+from utils.inference import Inference, default_config
+from utils.job_queue import MAX_ATTEMPTS, JobQueue, run_queue
+
+JOB = json.dumps({"Requirements": ["Python"]})
+RESUME = json.dumps({"Skills": ["Python"]})
+DETAILS = {"name": "Jane Doe", "address": "Austin, TX", "phone_number": "555", "email": "jane@example.com", "company": "Acme",
+           "company_address_1": "1 Main St", "company_address_2": "Austin, TX", "job_title": "Engineer"}
+# a process id that can't exist
+DEAD_WORKER = f"{socket.gethostname()}:99999999"
+
+class LetterInference(Inference):
+    """
+    Writes the same letter for every prompt, continuing a prompt that already holds part of it
+    """
+    LETTER = "I would love to join Acme.\n\nSincerely,\nJane Doe"
+    def __init__(self) -> None:
+        self.config = default_config()
+        self.prompts = []
+        self.limits = []
+    def get_config(self):
+        return self.config
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        self.config.settings.max_new_tokens = max_new_tokens
+    def stream(self, prompt: str):
+        self.prompts.append(str(prompt))
+        self.limits.append(self.config.settings.max_new_tokens)
+        written = next((i for i in range(len(self.LETTER), 0, -1) if str(prompt).endswith(self.LETTER[:i])), 0)
+        for word in self.LETTER[written:].split(" "):
+            yield word + " "
+
+class DeadlineInference(LetterInference):
+    """
+    The first letter runs into the deadline after two words
+    """
+    def stream(self, prompt: str):
+        stopper = self.stopper(prompt)
+        for i, chunk in enumerate(super().stream(prompt)):
+            if len(self.prompts) == 1 and i == 2:
+                stopper.timed_out = True
+                return
+            yield chunk
+
+def test_queue_skips_done_letters(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    output = str(tmp_path / "a.md")
+    assert job_queue.add("a.md", JOB, RESUME, DETAILS, output)
+    inference = LetterInference()
+    assert run_queue(inference, job_queue, log=lambda line: None) == [output]
+    assert open(output).read() == LetterInference.LETTER
+    assert not job_queue.add("a.md", JOB, RESUME, DETAILS, output)
+    assert job_queue.counts()["done"] == 1
+    # changed inputs generate it again
+    assert job_queue.add("a.md", JOB, json.dumps({"Skills": ["Rust"]}), DETAILS, output)
+    assert job_queue.counts()["pending"] == 1
+
+def test_queue_continues_from_checkpoint(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    output = str(tmp_path / "a.md")
+    crashed = JobQueue(path)
+    crashed.add("a.md", JOB, RESUME, DETAILS, output)
+    crashed.claim(DEAD_WORKER)
+    assert crashed.checkpoint("a.md", DEAD_WORKER, "I would love to join")
+    crashed.close()
+
+    job_queue = JobQueue(path)
+    inference = LetterInference()
+    assert run_queue(inference, job_queue, log=lambda line: None) == [output]
+    assert inference.prompts[0].endswith("Dear hiring manager,\nI would love to join")
+    assert open(output).read() == LetterInference.LETTER
+    # the saved words count against max_new_tokens
+    assert inference.limits[0] < inference.config.settings.max_new_tokens
+
+def test_queue_saved_letter_at_limit(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    output = str(tmp_path / "a.md")
+    job_queue.add("a.md", JOB, RESUME, DETAILS, output)
+    job_queue.claim(DEAD_WORKER)
+    job_queue.checkpoint("a.md", DEAD_WORKER, "I would love to join")
+    inference = LetterInference()
+    inference.config.settings.max_new_tokens = 3
+    assert run_queue(inference, job_queue, log=lambda line: None) == [output]
+    assert inference.prompts == [] and open(output).read() == "I would love to join"
+    assert inference.config.settings.max_new_tokens == 3
+
+def test_queue_lease(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.sqlite"), lease_seconds=60)
+    job_queue.add("a.md", JOB, RESUME, DETAILS, str(tmp_path / "a.md"))
+    assert job_queue.claim("otherhost:1").key == "a.md"
+    # still leased to a worker that may be alive
+    assert job_queue.claim("otherhost:2") is None
+    job_queue.lease_seconds = -1
+    assert job_queue.checkpoint("a.md", "otherhost:1", "text")
+    job = job_queue.claim("otherhost:2")
+    assert job.partial == "text" and job.attempts == 2
+    assert not job_queue.checkpoint("a.md", "otherhost:1", "more")
+
+def test_queue_deadline_keeps_job(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    output = str(tmp_path / "a.md")
+    job_queue.add("a.md", JOB, RESUME, DETAILS, output)
+    inference = DeadlineInference()
+    assert run_queue(inference, job_queue, log=lambda line: None) == [output]
+    # the first attempt was cut, the second continued its text
+    assert inference.prompts[1].endswith("Dear hiring manager,\nI would ")
+    assert open(output).read() == LetterInference.LETTER
+
+def test_queue_lost_jobs_fail(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "queue.sqlite"))
+    job_queue.add("a.md", JOB, RESUME, DETAILS, str(tmp_path / "a.md"))
+    for _ in range(MAX_ATTEMPTS):
+        assert job_queue.claim(DEAD_WORKER).key == "a.md"
+    assert job_queue.claim(DEAD_WORKER) is None
+    assert job_queue.counts()["failed"] == 1
+
+class FailingInference(LetterInference):
+    def stream(self, prompt: str):
+        raise Exception("out of memory")
+
+def test_batch_reports_queue_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.cache.decompose_cache", DecomposeCache(str(tmp_path / "decompose")))
+    jobs = tmp_path / "jobs"
+    jobs.mkdir()
+    (jobs / "a.html").write_text(JOB_HTML)
+    resume = str(tmp_path / "resume.html")
+    (tmp_path / "resume.html").write_text("<html><body><p>Skills:</p><ul><li>Python</li></ul></body></html>")
+    (tmp_path / "details.json").write_text(json.dumps(DETAILS))
+    summary = run_batch(FailingInference(), str(jobs), [resume], str(tmp_path / "details.json"), str(tmp_path / "out"), 1, log=lambda line: None,
+                        queue_path=str(tmp_path / "queue.sqlite"))
+    assert summary.generated == 0
+    assert summary.failed == [(str(jobs / "a.html"), resume, "out of memory")]
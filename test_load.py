@@ -0,0 +1,41 @@
+from bench_load import percentile, run, workload
+from utils.backends import load_backend
+from utils.inference import Prompt
+
+PROMPT = Prompt("x" * 400 + "[/INST]", "x" * 400, "Ada Lovelace")
+
+def test_fake_backend():
+    fake = load_backend("fake", None, speedup=1000)
+    letter = fake.generate(PROMPT)
+    assert letter.startswith("Dear Hiring Manager,") and letter.endswith("Sincerely,\nAda Lovelace")
+    assert fake.generate(PROMPT) == letter
+    # the second prompt continues from the first one's context
+    assert fake.stats()["reused_tokens"] == fake.count_tokens(PROMPT) - 1
+    fake.config.settings.seed = 1
+    assert fake.generate(PROMPT) != letter
+    fake.config.settings.stop_at_signoff = False
+    fake.config.settings.max_new_tokens = 20
+    requests = fake.stats()["decoded_tokens"]
+    assert len(fake.generate(PROMPT)) > 0 and fake.stats()["decoded_tokens"] - requests == 20
+    fake.config.settings.stop = ["."]
+    assert "." not in fake.generate(PROMPT)
+
+def test_fake_batch():
+    fake = load_backend("fake", None, speedup=1000)
+    letters = fake.generate_batch([PROMPT, Prompt(PROMPT + "y", "", "Grace Hopper")])
+    assert letters[0] == fake.generate(PROMPT) and letters[1].endswith("Grace Hopper")
+
+def test_workload():
+    plan = workload(50, 3, 2, rate=10.0, seed=1)
+    assert plan == workload(50, 3, 2, rate=10.0, seed=1)
+    assert all(a[0] <= b[0] for a, b in zip(plan, plan[1:]))
+    assert {job for _, job, _ in plan} == {0, 1, 2}
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([3, 1, 2, 4], 99) == 4
+
+def test_run(tmp_path):
+    fake = load_backend("fake", None, speedup=1000)
+    report = run(fake, requests=6, concurrency=3, jobs=2, resumes=1, output_path=str(tmp_path), log=None)
+    assert report["completed"] == 6 and not report["failed"]
+    assert report["latency"]["p50"] <= report["latency"]["p95"] <= report["latency"]["p99"]
+    assert report["backend"]["requests"] == 6
+    assert len(list(tmp_path.glob("letter-*.md"))) == 6
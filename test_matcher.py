@@ -0,0 +1,23 @@
+from utils.decompose import decompose_job
+from utils.matcher import Matcher, compile_matcher
+
+def test_matcher_finds_every_pattern():
+    matcher = Matcher(["rust", "c/c++", "rust", "go", "golang", ""])
+    assert matcher.matches("golang and rust") == [0, 2, 3, 4, 5]
+    assert matcher.first("golang") == 3
+    assert Matcher(["x"]).first("abc") is None
+
+def test_matcher_scanner_across_chunks():
+    scanner = Matcher(["pytorch", "torch"]).scanner()
+    scanner.feed("py")
+    scanner.feed("tor")
+    scanner.feed("ch")
+    assert scanner.matches() == [0, 1]
+
+def test_compile_matcher_is_shared():
+    assert compile_matcher(["a", "b"]) is compile_matcher(["a", "b"])
+
+def test_config_headers():
+    html = "<html><body><p>Responsibilities:</p><ul><li>Write code</li></ul><p>Perks</p><ul><li>Lunch</li></ul></body></html>"
+    assert decompose_job(html, ["Responsibilities:", "Perks"]) == decompose_job(html, ["responsibilities:", "perks"])
+    assert '"Perks"' in decompose_job(html, ["Responsibilities:", "Perks"])
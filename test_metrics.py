@@ -0,0 +1,26 @@
+import json
+from utils.metrics import MetricsLog, RunMetrics
+
+def test_run_metrics(tmp_path):
+    metrics = RunMetrics()
+    metrics.labels = {"backend": "test"}
+    with metrics.stage("read_job"):
+        pass
+    metrics.request()
+    metrics.prefill()
+    # fixed timestamps so the latencies are known
+    metrics.token_times = [1.0, 1.004, 1.104, 1.404]
+    metrics.finish()
+    summary = metrics.to_dict()
+    assert summary["tokens"] == 4
+    assert summary["tokens_per_second"] == round(3 / 0.404, 3)
+    assert dict((str(bound), count) for bound, count in summary["decode_histogram"])["0.005"] == 1
+    assert 'covergen_decode_token_seconds_bucket{backend="test",le="+Inf"} 3' in metrics.prometheus()
+    log = MetricsLog(str(tmp_path / "metrics.jsonl"), str(tmp_path / "metrics.prom"))
+    log.write(metrics)
+    log.write(metrics)
+    with open(tmp_path / "metrics.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2
+    assert "read_job" in lines[0]["stages"]
+    assert (tmp_path / "metrics.prom").read_text() == metrics.prometheus()
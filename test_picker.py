@@ -0,0 +1,14 @@
+from utils.picker import FileIndex
+
+def test_file_index_search(tmp_path):
+    for name in ["backend-engineer.html", "Data-Engineer.html", "frontend.html", "notes.txt"]:
+        (tmp_path / name).write_text("<html></html>")
+    index = FileIndex(str(tmp_path))
+    names = lambda query: [entry.name for entry in index.search(query)]
+    assert names("") == ["backend-engineer.html", "Data-Engineer.html", "frontend.html"]
+    # prefix first, then substring, then characters in order
+    assert names("d") == ["Data-Engineer.html", "backend-engineer.html", "frontend.html"]
+    assert names("eng") == ["backend-engineer.html", "Data-Engineer.html"]
+    assert names("bkend") == ["backend-engineer.html"]
+    assert names("bkendx") == []
+    assert names("bken") == ["backend-engineer.html"]
@@ -0,0 +1,16 @@
+from utils.prefix_cache import PrefixCache, common_prefix
+
+def test_common_prefix():
+    assert common_prefix([1, 2, 3], [1, 2, 4]) == 2
+    assert common_prefix([], [1]) == 0
+
+def test_prefix_cache_lookup():
+    cache = PrefixCache(max_entries=1)
+    cache.store([1, 2, 3], "state")
+    assert cache.lookup([1, 2, 3, 4]) == (3, "state")
+    # one token always has to be left to evaluate
+    assert cache.lookup([1, 2, 3]) == (0, None)
+    assert cache.lookup([1, 2, 5, 6]) == (0, None)
+    cache.store([7, 8], "other")
+    assert cache.lookup([1, 2, 3, 4]) == (0, None)
+    assert cache.stats()["hits"] == 1
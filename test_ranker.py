@@ -0,0 +1,31 @@
+import json
+from utils.inference import BasicSettings, Inference, default_config
+from utils.ranker import rank_letters, requirement_terms
+
+JOB = json.dumps({"Requirements": ["3+ years of Python and PostgreSQL"], "Qualifications": ["Experience with Docker and Kubernetes"], "Responsibilities": ["Write Rust services"]})
+
+def test_requirement_terms():
+    assert requirement_terms(JOB) == {"python", "postgresql", "docker", "kubernetes"}
+
+def test_rank_letters():
+    padding = " I enjoy building things." * 60
+    covered = "I have used Python, PostgreSQL, Docker and Kubernetes." + padding
+    partial = "I have used Python and Rust." + padding
+    short = "Python, PostgreSQL, Docker and Kubernetes."
+    ranked = rank_letters([partial, short, covered], JOB)
+    assert [letter for letter, _, _, _ in ranked] == [covered, short, partial]
+    assert ranked[0][2] == 1.0
+
+class SeedEcho(Inference):
+    def __init__(self) -> None:
+        self.config = default_config()
+        self.config.settings = BasicSettings(10, 1.0, seed=7)
+    def get_config(self):
+        return self.config
+    def generate(self, prompt: str) -> str:
+        return f"{prompt} {self.config.settings.seed}"
+
+def test_generate_candidates_seeds():
+    inference = SeedEcho()
+    assert inference.generate_candidates("letter", 3) == ["letter 7", "letter 8", "letter 9"]
+    assert inference.config.settings.seed == 7
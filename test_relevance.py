@@ -0,0 +1,46 @@
+import json
+from test_budget import DETAILS, WordInference
+from utils.budget import fit_prompt
+from utils.relevance import prune_resume, resume_index
+
+JOB = json.dumps({"Requirements": ["Python and PostgreSQL"], "Qualifications": ["Docker"], "Responsibilities": ["Build data pipelines"]})
+RESUME = json.dumps({
+    "Skills": ["python", "docker"],
+    "Experience/Activities": [
+        {"title": "Barista", "description": ["Made coffee for customers"]},
+        {"title": "Data Engineer", "description": ["Built data pipelines in Python on PostgreSQL"]},
+        {"title": "Tutor", "description": ["Taught Python"]},
+    ],
+    "Projects": [
+        {"title": "Game", "description": ["A platformer in Lua"]},
+        {"title": "Deployer", "description": ["Docker images for a Python service"]},
+    ],
+}, indent=4)
+
+def test_scores():
+    index = resume_index(RESUME)
+    scores = index.scores(json.loads(JOB))
+    ranked = [index.entries[row] for row in scores.argsort()[::-1]]
+    assert ranked[0] == ("Experience/Activities", 1)
+    assert scores[index.entries.index(("Experience/Activities", 0))] == 0
+    assert resume_index(RESUME) is index
+
+def test_prune_resume():
+    pruned, dropped = prune_resume(RESUME, JOB, top_k=1)
+    data = json.loads(pruned)
+    assert [entry["title"] for entry in data["Experience/Activities"]] == ["Data Engineer"]
+    assert [entry["title"] for entry in data["Projects"]] == ["Deployer"]
+    assert data["Skills"] == ["python", "docker"]
+    assert sorted(dropped) == ["Barista", "Game", "Tutor"]
+    # kept entries stay in order, every section keeps its best entry
+    pruned, dropped = prune_resume(RESUME, JOB, threshold=0.01)
+    assert [entry["title"] for entry in json.loads(pruned)["Experience/Activities"]] == ["Data Engineer", "Tutor"]
+    assert json.loads(prune_resume(RESUME, JOB, threshold=1.0)[0])["Projects"] == [json.loads(RESUME)["Projects"][1]]
+    assert prune_resume(RESUME, JOB) == (RESUME, [])
+
+def test_fit_prompt_prunes():
+    inference = WordInference(10000)
+    full, _ = fit_prompt(JOB, RESUME, DETAILS, inference)
+    inference.config.settings.relevance_top_k = 1
+    pruned, trimmed = fit_prompt(JOB, RESUME, DETAILS, inference)
+    assert "resume (not relevant): Barista" in trimmed and "Barista" in full and "Barista" not in pruned and "Data Engineer" in pruned
@@ -0,0 +1,93 @@
+import time
+from utils.backends import load_backend
+from utils.inference import Inference, Prompt, default_config
+from utils.result_cache import CachedInference, ResultCache
+
+PROMPT = Prompt("x" * 400 + "[/INST]", "x" * 400, "Ada Lovelace")
+
+class CountingInference(Inference):
+    def __init__(self) -> None:
+        self.config = default_config()
+        self.calls = 0
+    def get_config(self):
+        return self.config
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        return f"letter {self.calls} for {prompt}"
+    def stream(self, prompt: str):
+        yield self.generate(prompt)
+
+def test_cached_generate(tmp_path):
+    inner = CountingInference()
+    inference = CachedInference(inner, ResultCache(str(tmp_path / "results.sqlite")))
+    first = inference.generate("prompt")
+    assert inference.generate("prompt") == first
+    assert "".join(inference.stream("prompt")) == first
+    assert inner.calls == 1
+    # the settings are part of the key
+    inner.config.settings.seed = 1
+    assert inference.generate("prompt") != first
+    assert inner.calls == 2
+    # results survive a restart
+    inner.config.settings.seed = None
+    assert CachedInference(inner, ResultCache(str(tmp_path / "results.sqlite"))).generate("prompt") == first
+
+def test_bypass_still_stores(tmp_path):
+    inner = CountingInference()
+    cache = ResultCache(str(tmp_path / "results.sqlite"))
+    CachedInference(inner, cache).generate("prompt")
+    regenerated = CachedInference(inner, cache, bypass=True).generate("prompt")
+    assert inner.calls == 2
+    assert CachedInference(inner, cache).generate("prompt") == regenerated
+
+def test_result_cache_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / "results.sqlite"), max_bytes=10)
+    cache.put("a", "12345")
+    cache.put("b", "12345")
+    cache.get("a")
+    cache.put("c", "12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == "12345"
+    assert cache.stats()["evictions"] == 1
+
+def test_deadline_letters_not_stored(tmp_path):
+    inner = load_backend("fake", None, speedup=1000)
+    inference = CachedInference(inner, ResultCache(str(tmp_path / "results.sqlite")))
+    inner.config.settings.deadline = 0.002
+    cut = inference.generate(PROMPT)
+    assert "".join(inference.stream(PROMPT)).startswith("Dear")
+    assert inference.cache.stats()["entries"] == 0
+    inner.config.settings.deadline = None
+    letter = inference.generate(PROMPT)
+    assert inference.cache.stats()["entries"] == 1 and letter.startswith(cut) and letter != cut
+
+class ExpiringInference(CountingInference):
+    """
+    Stops at the deadline on its own like the GPTQ backend's LetterEnd, the stoppers only cut the text
+    """
+    def words(self, stopper):
+        while not stopper.expired():
+            time.sleep(0.001)
+            yield "word "
+    def generate(self, prompt: str) -> str:
+        stopper = self.stopper(prompt)
+        return stopper.trim("".join(self.words(stopper)))
+    def generate_batch(self, prompts: list) -> list:
+        stoppers = [self.stopper(prompt) for prompt in prompts]
+        return [stopper.trim("".join(self.words(stopper))) for stopper in stoppers]
+    def stream(self, prompt: str):
+        stopper = self.stopper(prompt)
+        for word in self.words(stopper):
+            yield stopper.feed(word)
+            if stopper.expired():
+                break
+        yield stopper.flush()
+
+def test_backend_deadline_not_stored(tmp_path):
+    inner = ExpiringInference()
+    inner.config.settings.deadline = 0.01
+    inference = CachedInference(inner, ResultCache(str(tmp_path / "results.sqlite")))
+    assert inference.generate("prompt").startswith("word")
+    assert inference.generate_batch(["a", "b"])[0].startswith("word")
+    assert "".join(inference.stream("prompt")).startswith("word")
+    assert inference.cache.stats()["entries"] == 0
@@ -0,0 +1,38 @@
+import threading
+import pytest
+from utils.inference import Inference
+from utils.scheduler import MicroBatcher
+
+class UpperInference(Inference):
+    def __init__(self) -> None:
+        self.batches = []
+    def generate_batch(self, prompts: list) -> list:
+        self.batches.append(len(prompts))
+        return [prompt.upper() for prompt in prompts]
+
+def test_micro_batcher_groups_requests():
+    inference = UpperInference()
+    batcher = MicroBatcher(inference, max_batch=4, window=0.5)
+    results = {}
+    def run(i):
+        results[i] = batcher.generate(f"prompt {i}")
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+    assert results == {i: f"PROMPT {i}" for i in range(6)}
+    assert sum(inference.batches) == 6
+    assert max(inference.batches) <= 4
+    assert len(inference.batches) < 6
+
+def test_micro_batcher_reports_errors():
+    class Broken(Inference):
+        def generate_batch(self, prompts: list) -> list:
+            raise RuntimeError("out of memory")
+    batcher = MicroBatcher(Broken(), window=0)
+    future = batcher.submit("prompt")
+    batcher.close()
+    with pytest.raises(RuntimeError, match="out of memory"):
+        future.result()
@@ -0,0 +1,67 @@
+import threading
+from utils.inference import Inference, Prompt, default_config
+from utils.server import ModelServer, RemoteInference
+
+class EchoInference(Inference):
+    """
+    Stands in for a loaded model, echoes the prompt back word by word
+    """
+    def __init__(self) -> None:
+        self.config = default_config()
+        self.prefixes = []
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        self.config.settings.max_new_tokens = max_new_tokens
+    def set_config(self, config) -> None:
+        self.config = config
+    def get_config(self):
+        return self.config
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+    def stream(self, prompt: str):
+        self.prefixes.append(getattr(prompt, "prefix", ""))
+        for word in prompt.split(" ")[:self.config.settings.max_new_tokens]:
+            yield word + " "
+
+def start_server(tmp_path):
+    server = ModelServer(EchoInference(), str(tmp_path / "model.sock"))
+    server.start()
+    return server, RemoteInference(server.address, timeout=10)
+
+def test_remote_generate_and_stream(tmp_path):
+    server, client = start_server(tmp_path)
+    try:
+        assert client.generate("one two three") == "one two three "
+        assert list(client.stream("one two")) == ["one ", "two "]
+        client.generate(Prompt("shared rest", "shared "))
+        assert server.inference.prefixes[-1] == "shared "
+    finally:
+        server.shutdown()
+
+def test_remote_config(tmp_path):
+    server, client = start_server(tmp_path)
+    try:
+        client.set_max_new_tokens(2)
+        assert client.get_config().settings.max_new_tokens == 2
+        assert client.generate("a b c d") == "a b "
+        config = client.get_config()
+        config.settings.max_new_tokens = 3
+        client.set_config(config)
+        assert server.inference.get_config().settings.max_new_tokens == 3
+    finally:
+        server.shutdown()
+
+def test_concurrent_clients(tmp_path):
+    server, client = start_server(tmp_path)
+    results = {}
+    def run(i):
+        results[i] = RemoteInference(server.address, timeout=10).generate(f"client {i}")
+    try:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == {i: f"client {i} " for i in range(8)}
+        assert client.stats()["served"] == 8
+    finally:
+        server.shutdown()
@@ -0,0 +1,96 @@
+import numpy as np
+from utils.speculative import LlamaCppModel, SpeculativeDecoder, SpeculativeStats, pick
+
+VOCAB = 16
+EOS = 0
+
+class FakeModel:
+    """
+    Model whose next token only depends on the context, given as one hot logits
+    """
+    def __init__(self, next_token) -> None:
+        self.next_token = next_token
+        self.calls = 0
+    def evaluate(self, tokens: list, count: int) -> list:
+        self.calls += 1
+        rows = []
+        for end in range(len(tokens) - count + 1, len(tokens) + 1):
+            logits = [0.0] * VOCAB
+            logits[self.next_token(tokens[:end])] = 1.0
+            rows.append(logits)
+        return rows
+
+def target_token(context: list) -> int:
+    return context[-1] % (VOCAB - 1) + 1
+
+def greedy(model: FakeModel, input_ids: list, max_new_tokens: int) -> list:
+    context = list(input_ids)
+    for _ in range(max_new_tokens):
+        context.append(pick(model.evaluate(context, 1)[0], context))
+        if context[-1] == EOS:
+            break
+    return context[len(input_ids):]
+
+def test_perfect_draft():
+    target = FakeModel(target_token)
+    stats = SpeculativeStats()
+    tokens = list(SpeculativeDecoder(target, FakeModel(target_token), k=4).generate([1], 10, EOS, stats))
+    assert tokens == greedy(FakeModel(target_token), [1], 10)
+    # 5 tokens per pass of the main model
+    assert target.calls == 2
+    assert stats.to_dict()["draft_acceptance_rate"] == 1.0
+
+def test_draft_mistakes_keep_the_target_output():
+    # the draft gets every third position wrong
+    draft = FakeModel(lambda context: 7 if len(context) % 3 == 0 else target_token(context))
+    target = FakeModel(target_token)
+    stats = SpeculativeStats()
+    tokens = list(SpeculativeDecoder(target, draft, k=4).generate([1], 20, EOS, stats))
+    assert tokens == greedy(FakeModel(target_token), [1], 20)
+    assert stats.tokens == 20
+    assert 0 < stats.accepted < stats.proposed
+    assert target.calls == stats.rounds < 20
+
+def test_stops_at_eos():
+    model = lambda context: EOS if len(context) == 4 else target_token(context)
+    tokens = list(SpeculativeDecoder(FakeModel(model), FakeModel(target_token), k=4).generate([1], 10, EOS))
+    assert tokens == [2, 3, 4, EOS]
+
+def test_repetition_penalty():
+    assert pick([1.0, 0.9], [0]) == 0
+    assert pick([1.0, 0.9], [0], repetition_penalty=1.2) == 1
+
+class Llama078:
+    """
+    The parts of llama-cpp-python 0.1.78's Llama that LlamaCppModel uses, logits as FakeModel's
+    """
+    def __init__(self, next_token, n_ctx: int = 64) -> None:
+        self.next_token = next_token
+        self.n_tokens = 0
+        self.input_ids = np.zeros(n_ctx, dtype=np.intc)
+        self.scores = np.zeros((n_ctx, VOCAB), dtype=np.single)
+        self.evaluated = 0
+    def n_vocab(self) -> int:
+        return VOCAB
+    def eval(self, tokens: list) -> None:
+        self.evaluated += len(tokens)
+        for token in tokens:
+            self.input_ids[self.n_tokens] = token
+            self.scores[self.n_tokens] = 0.0
+            self.scores[self.n_tokens, self.next_token(self.input_ids[:self.n_tokens + 1].tolist())] = 1.0
+            self.n_tokens += 1
+
+def llama_model(next_token) -> LlamaCppModel:
+    model = LlamaCppModel.__new__(LlamaCppModel)
+    model.llm = Llama078(next_token)
+    return model
+
+def test_llama_cpp_model_rolls_back():
+    draft = llama_model(lambda context: 7 if len(context) % 3 == 0 else target_token(context))
+    target = llama_model(target_token)
+    tokens = list(SpeculativeDecoder(target, draft, k=4).generate([1], 20, EOS))
+    assert tokens == greedy(FakeModel(target_token), [1], 20)
+    # rejected tokens are evaluated again, the shared prefix isn't
+    assert target.llm.evaluated < 40
+    rows = target.evaluate([1, 2, 3], 2)
+    assert target.llm.n_tokens == 3 and [int(row.argmax()) for row in rows] == [3, 4]
@@ -0,0 +1,45 @@
+from utils.inference import BasicSettings, Inference, build_prompt, default_config
+from utils.stopping import Stopper
+
+LETTER = "I am excited to apply.\n\nSincerely,\n**Jane Doe**\n\nNote: this letter was written for"
+
+def feed_all(stopper: Stopper, text: str, size: int = 3) -> str:
+    out = ""
+    for i in range(0, len(text), size):
+        out += stopper.feed(text[i:i + size])
+        if stopper.stopped:
+            return out
+    return out + stopper.flush()
+
+def test_signoff():
+    stopper = Stopper(signer="Jane Doe")
+    assert feed_all(stopper, LETTER) == "I am excited to apply.\n\nSincerely,\n**Jane Doe**"
+    assert stopper.stopped
+    assert Stopper(signer="Jane Doe").trim(LETTER) == "I am excited to apply.\n\nSincerely,\n**Jane Doe**"
+    # someone else's name doesn't end the letter
+    assert Stopper(signer="John Roe").trim(LETTER) == LETTER
+
+def test_stop_sequences():
+    stopper = Stopper(stop=["Note:", "\n---"])
+    assert feed_all(stopper, LETTER, size=1) == "I am excited to apply.\n\nSincerely,\n**Jane Doe**\n\n"
+    # text that could start a stop sequence is held back until it can't
+    stopper = Stopper(stop=["Note:"])
+    assert stopper.feed("a No") == "a "
+    assert stopper.feed("t") == ""
+    assert stopper.feed("hing") == "Nothing"
+    assert feed_all(Stopper(), LETTER) == LETTER
+
+class Echo(Inference):
+    def __init__(self) -> None:
+        self.config = default_config()
+    def get_config(self):
+        return self.config
+
+def test_stopper_from_settings():
+    details = {"name": "Jane Doe", "address": "Austin, TX", "phone_number": "555", "email": "jane@example.com", "company": "Acme",
+               "company_address_1": "1 Main St", "company_address_2": "Austin, TX", "job_title": "Engineer"}
+    prompt = build_prompt('{"Requirements": []}', '{"Skills": []}', details)
+    inference = Echo()
+    assert inference.stopper(prompt).trim(LETTER).endswith("**Jane Doe**")
+    inference.config.settings = BasicSettings(10, 1.0, stop_at_signoff=False)
+    assert inference.stopper(prompt).trim(LETTER) == LETTER
@@ -0,0 +1,39 @@
+import json
+import time
+from utils.inference import load_config
+from utils.tuner import TuneResult, thread_counts, tune, write_profile
+import utils.inference
+import utils.tuner
+
+class FakeModel:
+    """
+    Model that is fastest with 4 threads and big batches
+    """
+    def tokenize(self, text: str) -> list:
+        return list(range(64))
+    def generate(self, tokens: list, threads: int, batch_size: int, reset: bool):
+        # wide margins, the sleeps overshoot on a loaded machine
+        time.sleep(0.004 * abs(threads - 4) + 0.002 * 64 / batch_size)
+        while True:
+            time.sleep(0.001 * abs(threads - 4) + 0.0001)
+            yield 1
+
+def test_thread_counts():
+    assert thread_counts(12) == [1, 2, 4, 6, 8, 12]
+    assert thread_counts(1) == [1]
+
+def test_tune(tmp_path, monkeypatch):
+    results = tune(["a.bin"], threads=[1, 4, 8], batch_sizes=[8, 512], load=lambda model_file: FakeModel(), decode_tokens=4)
+    assert len(results) == 4
+    best = results[0]
+    assert (best.model_file, best.threads, best.batch_size) == ("a.bin", 4, 512)
+    monkeypatch.setattr(utils.tuner, "CONFIG_PATH", str(tmp_path))
+    monkeypatch.setattr(utils.inference, "CONFIG_PATH", str(tmp_path))
+    path = write_profile(best, "host", results=results)
+    assert len(json.load(open(path))["tuning"]["results"]) == 4
+    runtime = load_config("host").runtime
+    assert (runtime.model_file, runtime.threads, runtime.batch_size, runtime.context_length) == ("a.bin", 4, 512, 4096)
+
+def test_letter_seconds():
+    assert TuneResult("a.bin", 4, 512, 100.0, 2.0).letter_seconds(1000, 100) == 60.0
+    assert TuneResult("a.bin", 4, 512, 100.0, 0.0).letter_seconds() == float("inf")
@@ -0,0 +1,69 @@
+import time
+from utils.inference import BasicSettings, Inference, default_config
+from utils.worker import GenerationWorker
+
+class SlowInference(Inference):
+    def __init__(self, chunks: int, delay: float) -> None:
+        self.config = default_config()
+        self.chunks = chunks
+        self.delay = delay
+        self.generated = 0
+    def get_config(self):
+        return self.config
+    def stream(self, prompt: str):
+        for i in range(self.chunks):
+            time.sleep(self.delay)
+            self.generated += 1
+            yield f"{i} "
+
+def run(worker: GenerationWorker, cancel_after: int = None) -> GenerationWorker:
+    worker.start()
+    while not worker.finished():
+        worker.take()
+        if cancel_after is not None and len(worker.parts) >= cancel_after:
+            worker.cancel()
+    worker.thread.join()
+    worker.take()
+    return worker
+
+def test_worker_done():
+    worker = run(GenerationWorker(SlowInference(5, 0.001), "prompt"))
+    assert worker.status == "done"
+    assert worker.text() == "0 1 2 3 4 "
+
+def test_worker_cancel_keeps_partial_text():
+    inference = SlowInference(1000, 0.002)
+    worker = run(GenerationWorker(inference, "prompt"), cancel_after=3)
+    assert worker.status == "cancelled"
+    assert worker.text().startswith("0 1 2 ")
+    # stopped at the next chunk, not at the end
+    assert inference.generated < 10
+
+def test_worker_deadline():
+    worker = run(GenerationWorker(SlowInference(1000, 0.005), "prompt", deadline=0.05))
+    assert worker.status == "timeout"
+    assert 0 < len(worker.parts) < 1000
+
+def test_stopper_deadline():
+    inference = SlowInference(0, 0)
+    inference.config.settings = BasicSettings(10, 1.0, deadline=0.01)
+    stopper = inference.stopper("prompt")
+    assert stopper.feed("Dear") == "Dear"
+    time.sleep(0.02)
+    assert stopper.feed(" hiring") == " hiring"
+    assert stopper.stopped and stopper.timed_out
+
+class StoppedInference(SlowInference):
+    def stream(self, prompt: str):
+        stopper = self.stopper(prompt)
+        for chunk in super().stream(prompt):
+            yield stopper.feed(chunk)
+            if stopper.stopped:
+                break
+
+def test_worker_reports_stopper_deadline():
+    inference = StoppedInference(1000, 0.005)
+    inference.config.settings = BasicSettings(10, 1.0, deadline=0.03)
+    worker = run(GenerationWorker(inference, "prompt"))
+    assert worker.status == "timeout"
+    assert 0 < inference.generated < 1000
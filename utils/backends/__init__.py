@@ -0,0 +1,28 @@
+import importlib
+
+# backend name -> "module:class", a backend module is only imported when it is selected
+BACKENDS = {
+    "ggml": "utils.backends.ggml:InferenceGGML",
+    "autogptq": "utils.backends.gptq:InferenceGPTQ",
+    # simulates the latency of a model without one, see bench_load.py
+    "fake": "utils.backends.fake:InferenceFake",
+}
+
+def backend_class(name: str) -> type:
+    """
+    Import the inference class of a backend
+    @param name: the backend name
+    @return: the inference class
+    """
+    if name not in BACKENDS:
+        raise Exception(f"Unknown backend {name}, expected one of {', '.join(BACKENDS)}")
+    module_name, class_name = BACKENDS[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+def load_backend(name: str, *args, **kwargs):
+    """
+    Import and create a backend
+    @param name: the backend name
+    @return: the inference object
+    """
+    return backend_class(name)(*args, **kwargs)
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from typing import Iterator
+from utils.inference import BasicConfig, Inference, default_config
+from utils.metrics import timed
+from utils.synthetic import WORDS
+
+MODEL_ID = "fake"
+# Llama 2 13B q4_0 on a desktop CPU, the GGML backend's ballpark
+PREFILL_TPS = 60.0
+DECODE_TPS = 6.0
+# spread of the per token latency, the sigma of a lognormal around the mean
+JITTER = 0.15
+# decode step cost of every extra row of generate_batch, relative to one row
+BATCH_STEP_COST = 0.1
+# the estimate Inference.count_tokens uses
+CHARS_PER_TOKEN = 4
+PARAGRAPHS = 3
+SIGNOFF = "Sincerely,"
+
+class InferenceFake(Inference):
+    """
+    Stand-in backend that takes as long as a model without loading one
+        Prefill costs 1/prefill_tps per prompt token not shared with the
+        previous prompt, the way the GGML backend continues its context,
+        and every decoded token 1/decode_tps with some jitter. The letter
+        is filler text signed with the user's name, followed by more text
+        like Llama 2 writes, so max_new_tokens, the stop settings and the
+        deadline work as with a real model. One generation runs at a time,
+        concurrent callers wait for the model as they do for a real one.
+        The same seed, settings and prompt give the same letter and
+        latencies. speedup divides every delay.
+    """
+    def __init__(self, max_memory=None, config: BasicConfig = None, prefill_tps: float = PREFILL_TPS, decode_tps: float = DECODE_TPS, jitter: float = JITTER,
+                 speedup: float = 1.0, seed: int = 0) -> None:
+        self.config = default_config() if config is None else config
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.jitter = jitter
+        self.speedup = speedup
+        self.seed = seed
+        self.lock = threading.Lock()
+        # the last prompt and letter, the part a new prompt shares with it is already evaluated
+        self.context = ""
+        self.counts = {"requests": 0, "prefill_tokens": 0, "reused_tokens": 0, "decoded_tokens": 0, "busy_seconds": 0.0}
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        """
+        Set the max new tokens for the model
+        @param max_new_tokens: the max new tokens
+        """
+        self.config.settings.max_new_tokens = max_new_tokens
+    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        """
+        Set the repetition penalty for the model
+        @param repetition_penalty: the repetition penalty
+        """
+        self.config.settings.repetition_penalty = repetition_penalty
+    def set_config(self, config: BasicConfig) -> None:
+        """
+        Set the config for the model
+        @param config: the config
+        """
+        self.config = config
+    def get_config(self) -> BasicConfig:
+        """
+        Get the config for the model
+        @return: the config
+        """
+        return self.config
+    def model_id(self) -> str:
+        """
+        Identify the simulated model, letters of different seeds differ
+        @return: the model id
+        """
+        return f"{MODEL_ID}/{self.seed}"
+    def stats(self) -> dict:
+        """
+        Get what the simulated model did
+        @return: the counters
+        """
+        return dict(self.counts, busy_seconds=round(self.counts["busy_seconds"], 3))
+    def rng(self, text: str) -> random.Random:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return random.Random(f"{self.seed}:{self.config.settings.seed}:{digest}")
+    def sleep(self, seconds: float) -> None:
+        seconds /= self.speedup
+        self.counts["busy_seconds"] += seconds
+        time.sleep(seconds)
+    def token_seconds(self, rng: random.Random) -> float:
+        return rng.lognormvariate(0.0, self.jitter) / self.decode_tps if self.jitter else 1.0 / self.decode_tps
+    def prefill(self, prompt: str, reuse: bool = True) -> None:
+        """
+        Take as long as evaluating the prompt, the caller holds the lock
+        @param prompt: the prompt
+        @param reuse: continue from the part of the context the prompt shares
+        """
+        count = self.count_tokens(prompt)
+        if count > self.context_length():
+            raise Exception(f"The prompt has {count} tokens but the context only fits {self.context_length()}")
+        # at least one token is always evaluated for the next token logits
+        reused = min(len(os.path.commonprefix([self.context, prompt])) // CHARS_PER_TOKEN, count - 1) if reuse else 0
+        self.counts["prefill_tokens"] += count - reused
+        self.counts["reused_tokens"] += reused
+        self.sleep((count - reused) / self.prefill_tps)
+    def letter(self, rng: random.Random, signer: str) -> Iterator[str]:
+        """
+        Make up the tokens of a letter, they don't end on their own
+        @param rng: decides the words
+        @param signer: the name the letter is signed with
+        @return: an endless iterator over the tokens
+        """
+        yield "Dear"
+        yield " Hiring"
+        yield " Manager,"
+        for _ in range(PARAGRAPHS):
+            yield "\n\n"
+            for sentence in range(rng.randint(3, 5)):
+                for i in range(rng.randint(8, 16)):
+                    word = rng.choice(WORDS)
+                    yield (" " if i or sentence else "") + (word.capitalize() if i == 0 else word)
+                yield "."
+        yield "\n\n"
+        yield SIGNOFF
+        yield "\n"
+        for i, part in enumerate((signer or "Jane Doe").split(" ")):
+            yield (" " if i else "") + part
+        yield "\n\n"
+        # Llama 2 likes to explain the letter it just wrote
+        while True:
+            yield " " + rng.choice(WORDS)
+    def generate(self, prompt: str) -> str:
+        """
+        Generate the cover letter
+        @param prompt: the prompt for the model
+        @return: the generated cover letter
+        """
+        return "".join(self.stream(prompt))
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Generate the cover letter token by token
+        @param prompt: the prompt for the model
+        @return: an iterator over the decoded text
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.request()
+        settings = self.config.settings
+        with timed(metrics, "tokenize"):
+            self.count_tokens(prompt)
+        rng = self.rng(prompt)
+        # the latencies don't change the letter, a batch writes the same one
+        latency = self.rng("latency\0" + prompt)
+        stopper = self.stopper(prompt)
+        with self.lock:
+            self.counts["requests"] += 1
+            if metrics is not None:
+                metrics.prefill()
+            self.prefill(prompt)
+            self.context = str(prompt)
+            for count, token in enumerate(self.letter(rng, getattr(prompt, "signer", "")), 1):
+                self.sleep(self.token_seconds(latency))
+                self.counts["decoded_tokens"] += 1
+                self.context += token
+                if metrics is not None:
+                    metrics.token()
+                text = stopper.feed(token)
+                if text:
+                    yield text
+                if stopper.stopped or count >= settings.max_new_tokens:
+                    break
+        text = stopper.flush()
+        if text:
+            yield text
+    def generate_batch(self, prompts: list) -> list:
+        """
+        Generate a cover letter for each prompt in one simulated batch
+            Every prompt is evaluated in full, and each decode step costs
+            BATCH_STEP_COST more per extra row until the last letter ends
+        @param prompts: the prompts for the model
+        @return: the generated cover letters, in prompt order
+        """
+        if len(prompts) == 1:
+            return [self.generate(prompts[0])]
+        rows = [self.letter(self.rng(prompt), getattr(prompt, "signer", "")) for prompt in prompts]
+        stoppers = [self.stopper(prompt) for prompt in prompts]
+        texts = ["" for _ in prompts]
+        latency = self.rng("latency\0" + "\0".join(prompts))
+        step_cost = 1 + BATCH_STEP_COST * (len(prompts) - 1)
+        with self.lock:
+            self.counts["requests"] += len(prompts)
+            for prompt in prompts:
+                self.prefill(prompt, reuse=False)
+            # the batch replaced the context
+            self.context = ""
+            for _ in range(self.config.settings.max_new_tokens):
+                if all(stopper.stopped for stopper in stoppers):
+                    break
+                self.sleep(self.token_seconds(latency) * step_cost)
+                self.counts["decoded_tokens"] += len(prompts)
+                for i, stopper in enumerate(stoppers):
+                    if not stopper.stopped:
+                        texts[i] += stopper.feed(next(rows[i]))
+        return [text + stopper.flush() for text, stopper in zip(texts, stoppers)]
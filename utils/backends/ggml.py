@@ -0,0 +1,197 @@
+import codecs
+from typing import Iterator
+from ctransformers import AutoModelForCausalLM
+from utils.inference import BasicConfig, Inference, RuntimeConfig, default_config
+from utils.metrics import timed
+from utils.prefix_cache import PrefixCache, common_prefix
+from utils.speculative import LlamaCppModel, SpeculativeDecoder, SpeculativeStats
+from utils.stopping import Stopper
+
+MODEL_ID = 'TheBloke/Llama-2-13B-chat-GGML'
+MODEL_FILE = 'llama-2-13b-chat.ggmlv3.q6_K.bin'
+
+def runtime_kwargs(runtime: RuntimeConfig) -> dict:
+    """
+    Turn a runtime config into ctransformers from_pretrained arguments
+    @param runtime: the runtime config
+    @return: the arguments that are set, unset ones keep the ctransformers default
+    """
+    kwargs = {"mmap": runtime.mmap, "mlock": runtime.mlock}
+    for name in ["threads", "batch_size", "context_length"]:
+        if getattr(runtime, name) is not None:
+            kwargs[name] = getattr(runtime, name)
+    return kwargs
+
+class InferenceGGML(Inference):
+    """
+    Inference class for generating cover letters using GGML
+    """
+    def __init__(self, gpu_layers: int = 0, config: BasicConfig = None) -> None:
+        self.config = default_config() if config is None else config
+        # the runtime config only applies here, changing it later needs a reload
+        runtime = self.config.runtime
+        self.model_file = runtime.model_file or MODEL_FILE
+        self.gpu_layers = runtime.gpu_layers if runtime.gpu_layers is not None else gpu_layers
+        self.model = AutoModelForCausalLM.from_pretrained(MODEL_ID, model_file=self.model_file, model_type="llama", gpu_layers=self.gpu_layers, **runtime_kwargs(runtime))
+        self.model.config.max_new_tokens = 1200
+        # ctransformers keeps the context of the last generation, so only one prefix is resident
+        self.prefix_cache = PrefixCache(max_entries=1)
+        # loaded on the first generation with a draft_file configured
+        self.target = None
+        self.drafts = {}
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        """
+        Set the max new tokens for the model
+        @param max_new_tokens: the max new tokens
+        """
+        self.model.config.max_new_tokens = max_new_tokens
+        self.config.settings.max_new_tokens = max_new_tokens
+    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        """
+        Set the repetition penalty for the model
+        @param repetition_penalty: the repetition penalty
+        """
+        self.model.config.repetition_penalty = repetition_penalty
+        self.config.settings.repetition_penalty = repetition_penalty
+    def set_config(self, config: BasicConfig) -> None:
+        """
+        Set the config for the model
+        @param config: the config
+        """
+        self.config = config
+        self.set_max_new_tokens(config.settings.max_new_tokens)
+        self.set_repetition_penalty(config.settings.repetition_penalty)
+    def get_config(self) -> BasicConfig:
+        """
+        Get the config for the model
+        @return: the config
+        """
+        return self.config
+    def model_id(self) -> str:
+        """
+        Identify the loaded model weights
+        @return: the model id
+        """
+        # speculative decoding is greedy, its letters differ from sampled ones
+        return f"{MODEL_ID}/{self.model_file}" + (":greedy" if self.config.speculative.draft_file else "")
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of the text with the model's tokenizer
+        @param text: the text
+        @return: the number of tokens
+        """
+        return len(self.model.tokenize(text))
+    def context_length(self) -> int:
+        """
+        Get the context length, the config can lower it
+        @return: the context length
+        """
+        return self.config.settings.context_length or self.model.context_length
+    def generate(self, prompt: str) -> str:
+        """
+        Generate the cover letter
+        @param prompt: the prompt for the model
+        @return: the generated cover letter
+        """
+        return "".join(self.stream(prompt))
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Generate the cover letter token by token
+        @param prompt: the prompt for the model
+        @return: an iterator over the decoded text
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.request()
+        with timed(metrics, "tokenize"):
+            input_ids = self.model.tokenize(prompt)
+        self.track_prefix(prompt, input_ids)
+        if metrics is not None:
+            metrics.prefill()
+        stats = None
+        if self.config.speculative.draft_file:
+            stats = SpeculativeStats()
+            tokens = self.speculative_decoder().generate(input_ids, self.config.settings.max_new_tokens, self.model.eos_token_id, stats)
+        else:
+            kwargs = {} if self.config.settings.seed is None else {"seed": self.config.settings.seed}
+            tokens = self.model.generate(input_ids, **kwargs)
+        yield from self.decode(tokens, metrics, self.stopper(prompt))
+        if stats is not None and metrics is not None:
+            metrics.counters.update(stats.to_dict())
+    def decode(self, tokens: Iterator[int], metrics=None, stopper: Stopper = None) -> Iterator[str]:
+        """
+        Turn generated tokens into text, stopping at max_new_tokens or where the stopper ends the letter
+        @param tokens: the generated tokens
+        @param metrics: the run metrics to record the tokens in, or None
+        @param stopper: the stopper, or None to only stop at max_new_tokens
+        @return: an iterator over the decoded text
+        """
+        stopper = Stopper() if stopper is None else stopper
+        # a character can be split over several tokens
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        for count, token in enumerate(tokens, 1):
+            if metrics is not None:
+                metrics.token()
+            text = stopper.feed(decoder.decode(self.model.detokenize([token], decode=False)))
+            if text:
+                yield text
+            # leaving the generator stops ctransformers from decoding further
+            if stopper.stopped or count >= self.config.settings.max_new_tokens:
+                break
+        text = stopper.feed(decoder.decode(b"", final=True)) + stopper.flush()
+        if text:
+            yield text
+    def generate_candidates(self, prompt: str, n: int) -> list:
+        """
+        Generate several cover letters from one evaluation of the prompt
+            ctransformers keeps the evaluated prompt in its context and
+            only evaluates what follows the part that matches, so the
+            letters after the first start decoding right away. Candidates
+            are always sampled, also with a draft model configured.
+        @param prompt: the prompt for the model
+        @param n: the number of letters
+        @return: the generated cover letters
+        """
+        input_ids = self.model.tokenize(prompt)
+        self.track_prefix(prompt, input_ids)
+        seed = self.config.settings.seed
+        letters = []
+        for i in range(n):
+            kwargs = {} if seed is None else {"seed": seed + i}
+            letters.append("".join(self.decode(self.model.generate(input_ids, **kwargs), stopper=self.stopper(prompt))))
+        return letters
+    def speculative_decoder(self) -> SpeculativeDecoder:
+        """
+        Get the decoder for the configured draft model, loading the models on first use
+            The main model is opened a second time through llama.cpp, which
+            keeps the logits of every position. Both map the same file, so
+            the weights are only in memory once.
+        @return: the decoder
+        """
+        speculative = self.config.speculative
+        if self.target is None:
+            from huggingface_hub import hf_hub_download
+            self.target = LlamaCppModel(hf_hub_download(MODEL_ID, self.model_file), self.gpu_layers, self.model.context_length)
+        if speculative.draft_file not in self.drafts:
+            # one draft at a time, switching drafts frees the old one
+            self.drafts = {speculative.draft_file: LlamaCppModel(speculative.draft_file, self.gpu_layers, self.model.context_length)}
+        draft = self.drafts[speculative.draft_file]
+        if draft.vocab_size() != self.target.vocab_size():
+            raise Exception(f"The draft model {speculative.draft_file} has a different vocabulary than {self.model_file}")
+        return SpeculativeDecoder(self.target, draft, speculative.k, self.config.settings.repetition_penalty)
+    def track_prefix(self, prompt: str, input_ids: list) -> None:
+        """
+        Record the prompt prefix left in the model context
+            ctransformers only evaluates the tokens after the part of the
+            prompt that matches its current context, so a prompt for the
+            same resume continues from the resident prefix.
+        @param prompt: the prompt, a Prompt carries its prefix
+        @param input_ids: the prompt token ids
+        """
+        prefix = getattr(prompt, "prefix", "")
+        if not prefix:
+            return
+        self.prefix_cache.lookup(input_ids)
+        length = common_prefix(self.model.tokenize(prefix), input_ids)
+        if length:
+            self.prefix_cache.store(input_ids[:length], None)
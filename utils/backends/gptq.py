@@ -0,0 +1,267 @@
+from threading import Thread
+from typing import Iterator
+import torch
+from transformers import AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer, set_seed
+from auto_gptq import AutoGPTQForCausalLM
+from utils.inference import DEFAULT_CONTEXT_LENGTH, BasicConfig, Inference, default_config, letter_head
+from utils.metrics import timed
+from utils.prefix_cache import PrefixCache, common_prefix
+
+MODEL_ID = "TheBloke/Llama-2-13B-chat-GPTQ"
+MODEL_REVISION = "gptq-8bit-64g-actorder_True"
+MODEL_FILE = "model"
+# prompts per model.generate call, bounded by the KV cache that fits next to the weights
+MAX_BATCH_SIZE = 4
+# decode steps between checks for the end of the letters
+STOP_CHECK_STEPS = 8
+
+class TimedStreamer(TextIteratorStreamer):
+    """
+    TextIteratorStreamer that records when each new token arrives
+    """
+    def __init__(self, tokenizer, metrics, **kwargs) -> None:
+        super().__init__(tokenizer, **kwargs)
+        self.metrics = metrics
+    def put(self, value) -> None:
+        # the first put is the prompt when it is skipped
+        if self.metrics is not None and not (self.skip_prompt and self.next_tokens_are_prompt):
+            self.metrics.token()
+        super().put(value)
+
+class LetterEnd(StoppingCriteria):
+    """
+    Stops model.generate once every row's letter has ended
+        The new tokens are decoded every few steps and given to each row's
+        stopper. Rows that ended early keep generating until the last one
+        ends, their text is cut afterwards. A cancel or the deadline of the
+        stoppers stops at the next token.
+    """
+    def __init__(self, tokenizer, prompt_length: int, stoppers: list, steps: int = STOP_CHECK_STEPS) -> None:
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stoppers = stoppers
+        self.steps = steps
+        self.calls = 0
+        self.cancelled = False
+    def cancel(self) -> None:
+        self.cancelled = True
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.calls += 1
+        if self.cancelled or all(stopper.expired() for stopper in self.stoppers):
+            return True
+        if self.calls % self.steps:
+            return False
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return all(stopper.end(text) is not None for stopper, text in zip(self.stoppers, texts))
+
+def expand_state(state, n: int):
+    """
+    Repeat a KV cache of one sequence for a batch of n
+    @param state: the KV cache, a Cache or the legacy tuple of (key, value) per layer
+    @param n: the batch size
+    @return: the repeated KV cache
+    """
+    if hasattr(state, "batch_repeat_interleave"):
+        state.batch_repeat_interleave(n)
+        return state
+    return tuple(tuple(tensor.repeat_interleave(n, dim=0) for tensor in layer) for layer in state)
+
+class InferenceGPTQ(Inference):
+    """
+    Inference class for generating cover letters using AutoGPTQ
+    """
+    def __init__(self, max_memory: dict, config: BasicConfig = None) -> None:
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, use_fast=True)
+        self.model = AutoGPTQForCausalLM.from_quantized(MODEL_ID,
+                                                        model_basename=MODEL_FILE,
+                                                        use_safetensors=True,
+                                                        trust_remote_code=True,
+                                                        device_map="auto",
+                                                        max_memory=max_memory,
+                                                        use_triton=False,
+                                                        revision=MODEL_REVISION)
+        # each entry holds the KV cache of a prompt prefix on the GPU
+        self.prefix_cache = PrefixCache(max_entries=2)
+        self.config = default_config() if config is None else config
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        """
+        Set the max new tokens for the model
+        @param max_new_tokens: the max new tokens
+        """
+        self.config.settings.max_new_tokens = max_new_tokens
+    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        """
+        Set the repetition penalty for the model
+        @param repetition_penalty: the repetition penalty
+        """
+        self.config.settings.repetition_penalty = repetition_penalty
+    def set_config(self, config: BasicConfig) -> None:
+        """
+        Set the config for the model
+        @param config: the config
+        """
+        if config.max_memory is None:
+            config.max_memory = self.config.max_memory
+        self.config = config
+    def get_config(self) -> BasicConfig:
+        """
+        Get the config for the model
+        @return: the config
+        """
+        return self.config
+    def model_id(self) -> str:
+        """
+        Identify the loaded model weights
+        @return: the model id
+        """
+        return f"{MODEL_ID}/{MODEL_FILE}@{MODEL_REVISION}"
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of the text with the model's tokenizer
+        @param text: the text
+        @return: the number of tokens
+        """
+        return len(self.tokenizer(text).input_ids)
+    def context_length(self) -> int:
+        """
+        Get the context length, the config can lower it
+        @return: the context length
+        """
+        return self.config.settings.context_length or getattr(self.model.config, "max_position_embeddings", DEFAULT_CONTEXT_LENGTH)
+    def generate(self, prompt: str) -> str:
+        """
+        Generate the cover letter
+        @param prompt: the prompt for the model
+        @return: the generated cover letter
+        """
+        # remove trailing whitespace
+        return "".join(self.stream(prompt)).strip()
+    def generate_batch(self, prompts: list, batch_size: int = MAX_BATCH_SIZE) -> list:
+        """
+        Generate the cover letters for several prompts with one model.generate call per batch
+            Prompts are left padded so every row ends where its generated
+            tokens start, and the new tokens are cut at the padded input
+            length. Prompts of similar length are batched together to keep
+            the padding small.
+        @param prompts: the prompts for the model
+        @param batch_size: the most prompts per model.generate call
+        @return: the generated cover letters, in prompt order
+        """
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        lengths = [len(ids) for ids in self.tokenizer(list(prompts)).input_ids]
+        order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+        letters = [None] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            inputs = self.tokenizer([prompts[i] for i in indices], return_tensors="pt", padding=True).to('cuda')
+            stoppers = [self.stopper(prompts[i]) for i in indices]
+            if self.config.settings.seed is not None:
+                set_seed(self.config.settings.seed)
+            with torch.no_grad():
+                outputs = self.model.generate(input_ids=inputs.input_ids,
+                                              attention_mask=inputs.attention_mask,
+                                              pad_token_id=self.tokenizer.pad_token_id,
+                                              max_new_tokens=self.config.settings.max_new_tokens,
+                                              repetition_penalty=self.config.settings.repetition_penalty,
+                                              stopping_criteria=StoppingCriteriaList([LetterEnd(self.tokenizer, inputs.input_ids.shape[1], stoppers)]))
+            texts = self.tokenizer.batch_decode(outputs[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
+            for i, stopper, text in zip(indices, stoppers, texts):
+                letters[i] = (letter_head(prompts[i]) + stopper.trim(text)).strip()
+        return letters
+    def generate_candidates(self, prompt: str, n: int) -> list:
+        """
+        Generate several cover letters from one evaluation of the prompt
+            The prompt is evaluated once, its KV cache is repeated for
+            every candidate and the candidates are sampled as one batch, so
+            each of them only pays for its own decoding.
+        @param prompt: the prompt for the model
+        @param n: the number of letters
+        @return: the generated cover letters
+        """
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to('cuda')
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        with torch.no_grad():
+            # generate evaluates the last prompt token itself
+            state = self.model(input_ids=input_ids[:, :-1], use_cache=True).past_key_values
+            if self.config.settings.seed is not None:
+                set_seed(self.config.settings.seed)
+            stoppers = [self.stopper(prompt) for _ in range(n)]
+            outputs = self.model.generate(inputs=input_ids.repeat(n, 1),
+                                          past_key_values=expand_state(state, n),
+                                          do_sample=True,
+                                          pad_token_id=self.tokenizer.pad_token_id,
+                                          max_new_tokens=self.config.settings.max_new_tokens,
+                                          repetition_penalty=self.config.settings.repetition_penalty,
+                                          stopping_criteria=StoppingCriteriaList([LetterEnd(self.tokenizer, input_ids.shape[1], stoppers)]))
+        texts = self.tokenizer.batch_decode(outputs[:, input_ids.shape[1]:], skip_special_tokens=True)
+        return [(letter_head(prompt) + stopper.trim(text)).strip() for stopper, text in zip(stoppers, texts)]
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Generate the cover letter, yielding text as the streamer decodes it
+            The letter head the prompt puts after [/INST] comes first
+        @param prompt: the prompt for the model
+        @return: an iterator over the decoded text
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.request()
+        with timed(metrics, "tokenize"):
+            input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to('cuda')
+        streamer = TimedStreamer(self.tokenizer, metrics, skip_prompt=True, skip_special_tokens=True)
+        stopper = self.stopper(prompt)
+        # the streamer's text is cut by the stopper, the criterion ends the decoding
+        end = LetterEnd(self.tokenizer, input_ids.shape[1], [stopper])
+        kwargs = {"inputs": input_ids, "streamer": streamer, "max_new_tokens": self.config.settings.max_new_tokens, "repetition_penalty": self.config.settings.repetition_penalty,
+                  "stopping_criteria": StoppingCriteriaList([end])}
+        if metrics is not None:
+            metrics.prefill()
+        length, state = self.prefix_state(prompt, input_ids)
+        if state is not None:
+            kwargs["past_key_values"] = state
+        if self.config.settings.seed is not None:
+            set_seed(self.config.settings.seed)
+        thread = Thread(target=self.model.generate, kwargs=kwargs)
+        thread.start()
+        try:
+            head = letter_head(prompt)
+            if head:
+                yield head
+            for text in streamer:
+                text = stopper.feed(text)
+                if text:
+                    yield text
+            text = stopper.flush()
+            if text:
+                yield text
+        finally:
+            # the consumer may leave early, don't decode for nobody
+            end.cancel()
+            thread.join()
+            # generate appends to the cache in place, cut it back to the prefix
+            if state is not None and hasattr(state, "crop"):
+                state.crop(length)
+    def prefix_state(self, prompt: str, input_ids) -> tuple:
+        """
+        Get the KV cache for the stable prefix of the prompt, evaluating it on a miss
+        @param prompt: the prompt, a Prompt carries its prefix
+        @param input_ids: the prompt token ids
+        @return: (prefix length, KV cache), (0, None) without a prefix
+        """
+        prefix = getattr(prompt, "prefix", "")
+        if not prefix:
+            return 0, None
+        tokens = input_ids[0].tolist()
+        length, state = self.prefix_cache.lookup(tokens)
+        if state is not None:
+            return length, state
+        length = min(common_prefix(self.tokenizer(prefix).input_ids, tokens), len(tokens) - 1)
+        if length <= 0:
+            return 0, None
+        with torch.no_grad():
+            # a Cache, not the legacy tuple, generate then evaluates every prompt token after its length instead of only the last one
+            state = self.model(input_ids=input_ids[:, :length], past_key_values=DynamicCache(), use_cache=True).past_key_values
+        self.prefix_cache.store(tokens[:length], state)
+        return length, state
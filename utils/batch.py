@@ -0,0 +1,329 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.cache import get_decompose_cache
+from utils.budget import fit_prompt
+from utils.inference import Inference
+from utils.job_queue import MAX_ATTEMPTS, JobQueue, run_queue
+from utils.scheduler import MicroBatcher
+
+OUTPUT_PATH = "output/"
+DETAIL_KEYS = ["name", "phone_number", "email", "address", "company", "company_address_1", "company_address_2", "job_title"]
+
+def decompose_file(path: str, kind: str, patterns: list = None) -> str:
+    """
+    Read and decompose a single HTML file, run inside the process pool
+    @param path: the path to the HTML file
+    @param kind: "job" or "resume"
+    @param patterns: the headers (job) or tags (resume) to use
+    @return: the decomposed JSON
+    """
+    with open(path, "r") as f:
+        html_content = f.read()
+    return get_decompose_cache().decompose(kind, html_content, patterns)
+
+def load_details(path: str) -> dict:
+    """
+    Load the details file
+        The file is a JSON object with the same keys the TUI asks for.
+        Job specific keys (company, job_title, ...) can be given per job
+        file under "jobs", keyed by the job file name without extension.
+    @param path: the path to the details file
+    @return: the details
+    """
+    with open(path, "r") as f:
+        details = json.load(f)
+    if not isinstance(details, dict):
+        raise ValueError(f"Details file {path} must contain a JSON object")
+    details.setdefault("jobs", {})
+    return details
+
+def details_for_job(details: dict, job_name: str) -> dict:
+    """
+    Merge the shared details with the overrides for a job
+    @param details: the loaded details file
+    @param job_name: the job file name without extension
+    @return: the details to pass to fit_prompt
+    """
+    merged = {key: details.get(key, "") for key in DETAIL_KEYS}
+    merged.update(details["jobs"].get(job_name, {}))
+    return merged
+
+def list_html(path: str) -> list:
+    """
+    List the HTML files in a directory, or the path itself if it is a file
+    @param path: a directory or an HTML file
+    @return: the sorted HTML file paths
+    """
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".html"))
+
+def file_stem(path: str) -> str:
+    """
+    Get the file name of a path without the extension
+    @param path: the path
+    @return: the stem
+    """
+    return os.path.splitext(os.path.basename(path))[0]
+
+def output_name(job_file: str, resume_file: str) -> str:
+    """
+    Name the cover letter of a job and resume
+    @param job_file: the job HTML file
+    @param resume_file: the resume HTML file
+    @return: the file name
+    """
+    return f"{file_stem(job_file)}__{file_stem(resume_file)}.md"
+
+class BatchSummary:
+    """
+    Throughput summary for a batch run
+    """
+    def __init__(self) -> None:
+        self.pairs = 0
+        self.generated = 0
+        self.skipped = 0
+        self.reused = 0
+        self.failed = []
+        self.output_chars = 0
+        self.decompose_seconds = 0.0
+        self.generate_seconds = 0.0
+        self.total_seconds = 0.0
+    def to_dict(self) -> dict:
+        """
+        Convert the summary to a dict
+        @return: the dict
+        """
+        return {
+            "pairs": self.pairs,
+            "generated": self.generated,
+            "skipped": self.skipped,
+            "reused": self.reused,
+            "failed": self.failed,
+            "output_chars": self.output_chars,
+            "decompose_seconds": round(self.decompose_seconds, 3),
+            "generate_seconds": round(self.generate_seconds, 3),
+            "total_seconds": round(self.total_seconds, 3),
+            "letters_per_minute": round(60 * self.generated / self.total_seconds, 3) if self.total_seconds else 0.0,
+            "chars_per_second": round(self.output_chars / self.generate_seconds, 3) if self.generate_seconds else 0.0,
+        }
+    def __str__(self) -> str:
+        summary = self.to_dict()
+        lines = [
+            f"Generated {summary['generated']}/{summary['pairs']} cover letters in {summary['total_seconds']}s",
+            f"  decompose: {summary['decompose_seconds']}s, generate: {summary['generate_seconds']}s",
+            f"  throughput: {summary['letters_per_minute']} letters/min, {summary['chars_per_second']} chars/s",
+        ]
+        if summary["reused"]:
+            lines.append(f"  reused: {summary['reused']} letters of near-duplicate jobs")
+        for job_path, resume_path, error in self.failed:
+            lines.append(f"  failed: {job_path} x {resume_path}: {error}")
+        return "\n".join(lines)
+
+def run_batch(inference: Inference, job_path: str, resume_paths: list, details_path: str, output_path: str = OUTPUT_PATH, workers: int = None, log=print, batch_size: int = 1,
+              queue_path: str = None, duplicates=None) -> BatchSummary:
+    """
+    Generate a cover letter for every job x resume pair without the TUI
+        Every input is decomposed in a process pool while a single thread
+        keeps the loaded model busy from a work queue. Pairs are ordered
+        resume first so consecutive prompts share the same resume. With a
+        queue_path the pairs go through a JobQueue instead, letters done by
+        an earlier run are skipped and interrupted ones continue from their
+        last checkpoint. With a DuplicateIndex, a pair whose job is a
+        near-duplicate of one that has a letter for the same resume reuses
+        that letter, adapted to the job's details, instead of generating.
+    @param inference: the loaded inference object
+    @param job_path: a directory of job HTML files, or a single file
+    @param resume_paths: the resume HTML files
+    @param details_path: the details JSON file
+    @param output_path: the directory to write the cover letters to
+    @param workers: the number of decompose processes, defaults to the CPU count
+    @param log: called with a progress line for every pair
+    @param batch_size: the most prompts per generate_batch call, 1 keeps one prompt per call, not used with a queue
+    @param queue_path: the JobQueue database, None to keep the work in memory
+    @param duplicates: the DuplicateIndex to reuse and record letters with, None to generate every letter
+    @return: the batch summary
+    """
+    start = time.perf_counter()
+    summary = BatchSummary()
+    details = load_details(details_path)
+    jobs = list_html(job_path)
+    summary.pairs = len(jobs) * len(resume_paths)
+    config = inference.get_config()
+    headers = config.job.headers if config is not None else None
+    tags = config.resume.tags if config is not None else None
+    os.makedirs(output_path, exist_ok=True)
+
+    work = queue.PriorityQueue()
+    done = object()
+    lock = threading.Lock()
+    job_queue = JobQueue(queue_path) if queue_path else None
+    # with batching, one thread per batch slot feeds the micro-batcher
+    batcher = MicroBatcher(inference, batch_size) if batch_size > 1 and job_queue is None else None
+    generate = batcher.generate if batcher is not None else inference.generate
+
+    def reuse(job_file: str, job: str, resume: str, name: str) -> bool:
+        duplicate = duplicates.find_letter(job, resume, exclude=job_file)
+        if duplicate is None:
+            return False
+        cover_letter = duplicate.adapt(details_for_job(details, file_stem(job_file)))
+        with open(os.path.join(output_path, name), "w") as f:
+            f.write(cover_letter)
+        with lock:
+            summary.reused += 1
+        log(f"Reused the letter of {duplicate.job} ({duplicate.similarity:.0%} similar) for {name}")
+        return True
+
+    def generate_pair(item: tuple) -> None:
+        job_file, job, resume_file, resume = item
+        name = output_name(job_file, resume_file)
+        job_details = details_for_job(details, file_stem(job_file))
+        generate_start = time.perf_counter()
+        try:
+            prompt, trimmed = fit_prompt(job, resume, job_details, inference)
+            if trimmed:
+                log(f"Left out {len(trimmed)} items of {name} to fit the model's context")
+            cover_letter = generate(prompt)
+        except Exception as e:
+            with lock:
+                summary.failed.append((job_file, resume_file, str(e)))
+            log(f"Failed {name}: {e}")
+            return
+        finally:
+            if batcher is None:
+                summary.generate_seconds += time.perf_counter() - generate_start
+        with open(os.path.join(output_path, name), "w") as f:
+            f.write(cover_letter)
+        if duplicates is not None:
+            duplicates.save_letter(job_file, resume, job_details, cover_letter)
+        with lock:
+            summary.generated += 1
+            summary.output_chars += len(cover_letter)
+        log(f"Saved {name}")
+
+    def generate_worker():
+        while True:
+            _, _, item = work.get()
+            if item is done:
+                # let the other workers see it too
+                work.put((len(resume_paths), sequence + 1, done))
+                return
+            generate_pair(item)
+
+    def queue_pair(item: tuple, order: int) -> None:
+        job_file, job, resume_file, resume = item
+        name = output_name(job_file, resume_file)
+        job_details = details_for_job(details, file_stem(job_file))
+        queued[name] = (job_file, resume_file, resume, job_details)
+        if not job_queue.add(name, job, resume, job_details, os.path.join(output_path, name), order):
+            summary.skipped += 1
+
+    def drain_queue() -> None:
+        generate_start = time.perf_counter()
+        for path in run_queue(inference, job_queue, log=log):
+            summary.generated += 1
+            summary.output_chars += os.path.getsize(path)
+            if duplicates is not None and os.path.basename(path) in queued:
+                job_file, _, resume, job_details = queued[os.path.basename(path)]
+                with open(path, "r") as f:
+                    duplicates.save_letter(job_file, resume, job_details, f.read())
+        summary.generate_seconds += time.perf_counter() - generate_start
+
+    generators = [] if job_queue is not None else [threading.Thread(target=generate_worker, daemon=True) for _ in range(max(1, batch_size))]
+    for generator in generators:
+        generator.start()
+
+    resumes = {}
+    # output name -> (job file, resume file, resume, details) of the queued pairs
+    queued = {}
+    # resume file -> absolute job files going to the model in this run
+    scheduled = {}
+    # pairs whose job is a near-duplicate of a scheduled one, they wait for its letter
+    deferred = []
+    sequence = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        decompose_start = time.perf_counter()
+        resume_futures = {pool.submit(decompose_file, path, "resume", tags): path for path in resume_paths}
+        job_futures = {pool.submit(decompose_file, path, "job", headers): path for path in jobs}
+        # resumes are few and every pair needs one, so wait for them first
+        for future in as_completed(resume_futures):
+            path = resume_futures[future]
+            try:
+                resume = future.result()
+            except Exception as e:
+                resume = None
+                log(f"Could not decompose resume {path}: {e}")
+            if resume is None or resume == "{}":
+                for job_file in jobs:
+                    summary.failed.append((job_file, path, "could not decompose resume"))
+                continue
+            resumes[path] = resume
+        for future in as_completed(job_futures):
+            job_file = job_futures[future]
+            try:
+                job = future.result()
+            except Exception as e:
+                job = None
+                log(f"Could not decompose job description {job_file}: {e}")
+            if job is None or job == "{}":
+                for resume_file in resumes:
+                    summary.failed.append((job_file, resume_file, "could not decompose job description"))
+                continue
+            similar = set()
+            if duplicates is not None:
+                duplicates.add(job_file, job)
+                similar = {key for key, _ in duplicates.duplicates(job, exclude=job_file)}
+            for index, resume_file in enumerate(resume_paths):
+                if resume_file not in resumes:
+                    continue
+                sequence += 1
+                item = (job_file, job, resume_file, resumes[resume_file])
+                if duplicates is not None:
+                    if similar and reuse(job_file, job, resumes[resume_file], output_name(job_file, resume_file)):
+                        continue
+                    if similar & scheduled.get(resume_file, set()):
+                        deferred.append(item)
+                        continue
+                    # absolute like the index's keys
+                    scheduled.setdefault(resume_file, set()).add(os.path.abspath(job_file))
+                if job_queue is not None:
+                    # resume first, like the work queue
+                    queue_pair(item, index * summary.pairs + sequence)
+                    continue
+                work.put((index, sequence, item))
+        summary.decompose_seconds = time.perf_counter() - decompose_start
+
+    if job_queue is not None:
+        if summary.skipped:
+            log(f"{summary.skipped} cover letters are already done")
+        drain_queue()
+        left = [item for item in deferred if not reuse(item[0], item[1], item[3], output_name(item[0], item[2]))]
+        if left:
+            # the letter they waited for failed
+            for item in left:
+                sequence += 1
+                queue_pair(item, summary.pairs * len(resume_paths) + sequence)
+            drain_queue()
+        # jobs of earlier runs that aren't part of this one stay out of the summary
+        failed = [(key, error) for key, error in job_queue.failed() if key in queued]
+        job_queue.close()
+        for key, error in failed:
+            summary.failed.append((queued[key][0], queued[key][1], error))
+        if failed:
+            log(f"{len(failed)} cover letters failed {MAX_ATTEMPTS} times, see {queue_path}")
+    work.put((len(resume_paths), sequence + 1, done))
+    for generator in generators:
+        generator.join()
+    if job_queue is None:
+        for item in deferred:
+            if not reuse(item[0], item[1], item[3], output_name(item[0], item[2])):
+                generate_pair(item)
+    if batcher is not None:
+        batcher.close()
+        summary.generate_seconds = batcher.busy_seconds
+    summary.total_seconds = time.perf_counter() - start
+    return summary
@@ -0,0 +1,84 @@
+import json
+from utils.inference import Inference, build_prompt
+
+# sections trimmed first to last when the prompt doesn't fit, with how many items to keep
+#   job sections not listed here are trimmed along with "Responsibilities"
+TRIM_ORDER = [
+    ("job", "Optional Requirements", 0),
+    ("resume", "Projects", 0),
+    ("job", None, 1),
+    ("job", "Responsibilities", 1),
+    ("resume", "Experience/Activities", 1),
+    ("resume", "Skills", 0),
+    ("job", "Qualifications", 1),
+    ("job", "Requirements", 1),
+]
+
+def trim_steps(job: dict, resume: dict) -> list:
+    """
+    List the sections to trim in order
+    @param job: the job sections
+    @param resume: the resume sections
+    @return: (kind, sections, section name, items to keep) tuples
+    """
+    listed = set(section for kind, section, _ in TRIM_ORDER if kind == "job")
+    steps = []
+    for kind, section, keep in TRIM_ORDER:
+        data = job if kind == "job" else resume
+        if section is None:
+            steps += [(kind, data, name, keep) for name in data if name not in listed]
+        elif section in data:
+            steps.append((kind, data, section, keep))
+    return steps
+
+def fit_prompt(job_description: str, resume: str, details: dict, inference: Inference, encoding: str = None) -> tuple:
+    """
+    Build the prompt and make it fit the model's context with room for max_new_tokens
+        Items are removed from the end of the lowest priority sections
+        first (see TRIM_ORDER) until the prompt fits. The removed item's own
+        token count is subtracted from the running total, and the prompt is
+        only tokenized again once that estimate fits. With relevance_top_k
+        or relevance_threshold set, the resume entries least relevant to
+        the job are left out before any of that.
+    @param job_description: the decomposed job description
+    @param resume: the decomposed resume
+    @param details: the user's details
+    @param inference: the backend whose tokenizer and context length to use
+    @param encoding: one of ENCODINGS, defaults to the config's prompt_encoding
+    @return: (prompt, descriptions of the pruned and trimmed items)
+    """
+    settings = inference.get_config().settings
+    encoding = encoding if encoding is not None else settings.prompt_encoding
+    budget = inference.context_length() - settings.max_new_tokens
+    if settings.relevance_top_k is not None or settings.relevance_threshold is not None:
+        from utils.relevance import prune_resume
+        resume, pruned = prune_resume(resume, job_description, settings.relevance_top_k, settings.relevance_threshold)
+    else:
+        pruned = []
+    prompt = build_prompt(job_description, resume, details, encoding)
+    count = inference.count_tokens(prompt)
+    # entries left out for relevance are reported like the trimmed ones
+    trimmed = [f"resume (not relevant): {title}" for title in pruned]
+    if count <= budget:
+        return prompt, trimmed
+    job = json.loads(job_description)
+    resume = json.loads(resume)
+    estimate = count
+    for kind, data, section, keep in trim_steps(job, resume):
+        while count > budget and section in data and len(data[section]) > keep:
+            item = data[section].pop()
+            trimmed.append(f"{kind} {section}: {item['title'] if isinstance(item, dict) else item}".strip())
+            estimate -= inference.count_tokens(json.dumps(item, ensure_ascii=False))
+            if not data[section]:
+                del data[section]
+            if estimate <= budget:
+                prompt = build_prompt(job, resume, details, encoding)
+                count = estimate = inference.count_tokens(prompt)
+        if count <= budget:
+            return prompt, trimmed
+    # the estimate can be off, check what is left
+    prompt = build_prompt(job, resume, details, encoding)
+    count = inference.count_tokens(prompt)
+    if count <= budget:
+        return prompt, trimmed
+    raise Exception(f"The prompt needs {count} tokens but only {budget} fit next to {settings.max_new_tokens} new tokens, even after trimming")
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.decompose import DECOMPOSER_VERSION, decompose_job, decompose_resume
+
+JOB_PATH = "assets/jobs/"
+RESUME_PATH = "assets/resumes/"
+MANIFEST_PATH = "assets/cache/decompose_manifest.json"
+
+def config_hash(kind: str, patterns: list = None) -> str:
+    """
+    Hash what besides the HTML decides the decomposed output
+    @param kind: "job" or "resume"
+    @param patterns: the headers (job) or tags (resume)
+    @return: the hex digest
+    """
+    return hashlib.sha256(json.dumps([DECOMPOSER_VERSION, kind, patterns]).encode("utf-8")).hexdigest()
+
+def write_atomic(path: str, text: str) -> None:
+    """
+    Write a file so readers never see it half written
+    @param path: the path
+    @param text: the content
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def decompose_to_file(path: str, kind: str, patterns: list = None) -> str:
+    """
+    Decompose an HTML file into the .json next to it, run inside the process pool
+    @param path: the HTML file
+    @param kind: "job" or "resume"
+    @param patterns: the headers (job) or tags (resume)
+    @return: the hash of the HTML
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    html = content.decode("utf-8")
+    data = decompose_job(html, patterns) if kind == "job" else decompose_resume(html, patterns)
+    if data is None or data == "{}":
+        raise Exception("empty decompose")
+    write_atomic(os.path.splitext(path)[0] + ".json", data)
+    return hashlib.sha256(content).hexdigest()
+
+def index_job(duplicates, path: str) -> None:
+    with open(os.path.splitext(path)[0] + ".json", "r") as f:
+        duplicates.add(path, f.read())
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class Manifest:
+    """
+    What every HTML file looked like when it was last decomposed
+        A file whose size and mtime haven't changed is skipped without
+        being read. A file that was touched but has the same content hash
+        is skipped after hashing it.
+    """
+    def __init__(self, path: str = MANIFEST_PATH) -> None:
+        self.path = path
+        self.files = {}
+        try:
+            with open(path, "r") as f:
+                self.files = json.load(f).get("files", {})
+        except (FileNotFoundError, ValueError):
+            pass
+    def unchanged(self, path: str, stat: os.stat_result, config: str) -> bool:
+        """
+        Check if a file still matches its last decompose
+        @param path: the HTML file
+        @param stat: its stat
+        @param config: its config_hash
+        @return: True when it can be skipped
+        """
+        entry = self.files.get(path)
+        if entry is None or entry["config"] != config or not os.path.exists(os.path.splitext(path)[0] + ".json"):
+            return False
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if entry["size"] != stat.st_size or file_hash(path) != entry["hash"]:
+            return False
+        # touched, not changed
+        self.record(path, stat, config, entry["hash"])
+        return True
+    def record(self, path: str, stat: os.stat_result, config: str, digest: str) -> None:
+        self.files[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest, "config": config}
+    def prune(self, paths: set) -> None:
+        """
+        Forget files that no longer exist
+        @param paths: the files found this run
+        """
+        for path in list(self.files):
+            if path not in paths:
+                del self.files[path]
+    def save(self) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_atomic(self.path, json.dumps({"version": DECOMPOSER_VERSION, "files": self.files}))
+
+class BulkSummary:
+    """
+    Result of a bulk decompose
+    """
+    def __init__(self) -> None:
+        self.decomposed = 0
+        self.skipped = 0
+        self.failed = []
+        self.seconds = 0.0
+    def __str__(self) -> str:
+        lines = [f"Decomposed {self.decomposed} files, {self.skipped} unchanged, {len(self.failed)} failed in {self.seconds:.2f}s"]
+        for path, error in self.failed:
+            lines.append(f"  failed: {path}: {error}")
+        return "\n".join(lines)
+
+def decompose_all(headers: list = None, tags: list = None, job_path: str = JOB_PATH, resume_path: str = RESUME_PATH, manifest_path: str = MANIFEST_PATH, workers: int = None, log=None,
+                  duplicates=None) -> BulkSummary:
+    """
+    Decompose every job and resume HTML file that changed since the last run
+        With a DuplicateIndex, every decomposed job is indexed, and so are
+        unchanged ones the index doesn't have yet
+    @param headers: the job headers to look for
+    @param tags: the resume skill tags to look for
+    @param job_path: the job description directory
+    @param resume_path: the resume directory
+    @param manifest_path: where the manifest is kept
+    @param workers: the number of decompose processes, defaults to the CPU count
+    @param log: called with a line for every decomposed or failed file
+    @param duplicates: the DuplicateIndex to keep up to date, None to not index
+    @return: the summary
+    """
+    start = time.perf_counter()
+    summary = BulkSummary()
+    manifest = Manifest(manifest_path)
+    found = set()
+    todo = []
+    for directory, kind, patterns in [(job_path, "job", headers), (resume_path, "resume", tags)]:
+        config = config_hash(kind, patterns)
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".html") or not entry.is_file():
+                    continue
+                path = os.path.join(directory, entry.name)
+                stat = entry.stat()
+                found.add(path)
+                if manifest.unchanged(path, stat, config):
+                    summary.skipped += 1
+                    if kind == "job" and duplicates is not None and path not in duplicates:
+                        index_job(duplicates, path)
+                else:
+                    todo.append((path, kind, patterns, stat, config))
+    if duplicates is not None:
+        for path in set(manifest.files) - found:
+            duplicates.remove(path)
+    manifest.prune(found)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(decompose_to_file, path, kind, patterns): (path, kind, stat, config) for path, kind, patterns, stat, config in todo}
+            for future in as_completed(futures):
+                path, kind, stat, config = futures[future]
+                try:
+                    digest = future.result()
+                except Exception as e:
+                    summary.failed.append((path, str(e)))
+                    manifest.files.pop(path, None)
+                    if kind == "job" and duplicates is not None:
+                        duplicates.remove(path)
+                    if log is not None:
+                        log(f"Failed {path}: {e}")
+                    continue
+                manifest.record(path, stat, config, digest)
+                summary.decomposed += 1
+                if kind == "job" and duplicates is not None:
+                    index_job(duplicates, path)
+                if log is not None:
+                    log(f"Decomposed {path}")
+    manifest.save()
+    summary.seconds = time.perf_counter() - start
+    return summary
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from utils.decompose import DECOMPOSER_VERSION, decompose_job, decompose_resume
+
+CACHE_PATH = "assets/cache/decompose/"
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+decompose_cache = None
+
+def cache_key(kind: str, html: str, patterns: list = None) -> str:
+    """
+    Build the content address for a decompose result
+    @param kind: "job" or "resume"
+    @param html: the HTML text
+    @param patterns: the headers (job) or tags (resume) passed to the decomposer
+    @return: the hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{DECOMPOSER_VERSION}\0{kind}\0".encode("utf-8"))
+    digest.update(json.dumps(patterns).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(html.encode("utf-8"))
+    return digest.hexdigest()
+
+class DecomposeCache:
+    """
+    Persistent cache of decompose_job / decompose_resume results
+        One file per result, named by the hash of the HTML, the header/tag
+        list and DECOMPOSER_VERSION. The file mtime is the LRU clock, and
+        the least recently used files are removed once the cache grows
+        past max_bytes.
+    """
+    def __init__(self, path: str = CACHE_PATH, max_bytes: int = MAX_CACHE_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self.entries = OrderedDict()
+        # threads share the LRU bookkeeping
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        found = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.endswith(".json") and entry.is_file():
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".json")
+    def get(self, key: str) -> str:
+        """
+        Get a cached result and mark it as recently used
+        @param key: the cache key
+        @return: the cached JSON, None on a miss
+        """
+        try:
+            with open(self._file(key), "r") as f:
+                value = f.read()
+            os.utime(self._file(key))
+        except FileNotFoundError:
+            # evicted by another process
+            with self.lock:
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)
+                self.misses += 1
+            return None
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = len(value.encode("utf-8"))
+                self.size += self.entries[key]
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return value
+    def put(self, key: str, value: str) -> None:
+        """
+        Store a result and evict the least recently used ones over the size bound
+        @param key: the cache key
+        @param value: the decomposed JSON
+        """
+        tmp = self._file(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(value)
+        os.replace(tmp, self._file(key))
+        evicted = []
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)
+            self.entries[key] = len(value.encode("utf-8"))
+            self.size += self.entries[key]
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._file(old_key))
+            except FileNotFoundError:
+                pass
+    def decompose(self, kind: str, html: str, patterns: list = None) -> str:
+        """
+        Decompose through the cache
+        @param kind: "job" or "resume"
+        @param html: the HTML text
+        @param patterns: the headers (job) or tags (resume)
+        @return: the decomposed JSON
+        """
+        key = cache_key(kind, html, patterns)
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = decompose_job(html, patterns) if kind == "job" else decompose_resume(html, patterns)
+        if value is not None and value != "{}":
+            self.put(key, value)
+        return value
+    def decompose_job(self, text: str, headers: list = None) -> str:
+        """
+        Cached decompose_job
+        @param text: the HTML text
+        @param headers: the headers to look for
+        @return: the JSON file
+        """
+        return self.decompose("job", text, headers)
+    def decompose_resume(self, text: str, tags: list = None) -> str:
+        """
+        Cached decompose_resume
+        @param text: the HTML text
+        @param tags: the skill tags to look for
+        @return: the JSON file
+        """
+        return self.decompose("resume", text, tags)
+    def stats(self) -> dict:
+        """
+        Get the cache counters
+        @return: the counters
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "bytes": self.size}
+
+def get_decompose_cache() -> DecomposeCache:
+    """
+    Get the shared decompose cache, creating it on first use
+    @return: the decompose cache
+    """
+    global decompose_cache
+    if decompose_cache is None:
+        decompose_cache = DecomposeCache()
+    return decompose_cache
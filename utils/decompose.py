@@ -1,22 +1,59 @@
 import json
-from bs4 import BeautifulSoup, NavigableString
-
-def get_text(element) -> str:
+from bs4 import BeautifulSoup, CData, NavigableString
+from utils.html_stream import stream_ul_tags, skill_sections
+from utils.matcher import compile_matcher
+from utils.text import TEXT_TABLE, ITEM_TABLE, TITLE_TABLE
+
+# bump when a change to this module changes the decomposed output
+DECOMPOSER_VERSION = 2
+# "stream" parses in a single pass, "soup" builds the BeautifulSoup tree and walks it with find_ul_tags
+ENGINES = ["stream", "soup"]
+DEFAULT_ENGINE = "stream"
+
+DEFAULT_HEADERS = ["responsibilities:", "qualifications:", "requirements:", "skills:", "opportunity", "you have", "nice to have", "experience"]
+DEFAULT_TAGS = ["docker", "rust", "java", "golang", "rust", "ghidra", "python", "mysql", "redis", "sqlite", "json", "pytorch","c/c++","c++/c", "orm"]
+# the only strings get_text keeps, comments and scripts are left out
+PLAIN_STRINGS = (NavigableString, CData)
+TRANSLATE_HEADERS = {
+    "responsibilities:": "Responsibilities",
+    "qualifications:": "Qualifications",
+    "requirements:": "Requirements",
+    "skills:": "Requirements",
+    "opportunity": "Responsibilities",
+    "you have": "Qualifications",
+    "nice to have": "Optional Requirements",
+    "experience": "Requirements"
+}
+
+def get_text(element, table: dict = TEXT_TABLE) -> str:
     """
     Get and concatenate only the strings from inside an element
+        Walks the descendants iteratively, so deeply nested spans can't hit
+        the recursion limit, and normalizes the joined text in one pass.
     @param element: the element to get the text from
+    @param table: the str.translate table to normalize the text with
     @return: the text from the element
     """
-    if isinstance(element, NavigableString):
-        return element.text.replace('\xa0', ' ').replace('\u2019',"'")
-    if isinstance(element, str):
-        return element.replace('\xa0', ' ').replace('\u2019',"'")
     if element is None:
         return ""
-    text = ""
-    for child in element.children:
-        text += get_text(child)
-    return text
+    if isinstance(element, NavigableString):
+        return element.text.translate(table)
+    if isinstance(element, str):
+        return element.translate(table)
+    return "".join([child for child in element.descendants if type(child) in PLAIN_STRINGS]).translate(table)
+
+def get_texts(elements, table: dict = TEXT_TABLE, strip: bool = False) -> list:
+    """
+    Get the text of many elements at once
+    @param elements: the elements to get the text from
+    @param table: the str.translate table to normalize the text with
+    @param strip: strip the surrounding whitespace of every text
+    @return: the text of every element, in order
+    """
+    texts = [get_text(element, table) for element in elements]
+    if strip:
+        return [text.strip() for text in texts]
+    return texts
 
 def find_ul_tags(element, tags: list = None) -> list:
     """
@@ -29,33 +66,22 @@ def find_ul_tags(element, tags: list = None) -> list:
         return []
 
     ul_tags_with_siblings = []
+    matcher = compile_matcher([tag.lower() for tag in tags]) if tags is not None else None
 
     for child in element.children:
-        if tags is not None:
-            for tag in tags:
-                if tag in child.text.lower():
-                    if tag == "c++/c" or tag == "c/c++":
-                        ul_tags_with_siblings.append(("Skills", "c"))
-                        ul_tags_with_siblings.append(("Skills", "c++"))
-                    else:
-                        ul_tags_with_siblings.append(("Skills", tag))
+        if matcher is not None:
+            ul_tags_with_siblings += skill_sections(tags, matcher.matches(child.text.lower()))
         if isinstance(child, NavigableString):
             continue
         if child.name == 'ul':
             # loop through ul tag children and add them to a list called ul_list
-            ul_list = []
+            items = []
             for ul_child in child.children:
                 if ul_child.name == 'ul':
-                    for ul_ul_child in ul_child.children:
-                        if isinstance(ul_ul_child, NavigableString):
-                            continue
-                        text = get_text(ul_ul_child).replace('\xa0', ' ').replace('\u2019',"'").replace('\u201c', '"').replace('\u201d', '"').strip()
-                        ul_list.append(text)
-                    continue
-                if isinstance(ul_child, NavigableString):
-                    continue
-                text = get_text(ul_child).replace('\xa0', ' ').replace('\u2019',"'").replace('\u201c', '"').replace('\u201d', '"').strip()
-                ul_list.append(text)
+                    items.extend(ul_ul_child for ul_ul_child in ul_child.children if not isinstance(ul_ul_child, NavigableString))
+                elif not isinstance(ul_child, NavigableString):
+                    items.append(ul_child)
+            ul_list = get_texts(items, ITEM_TABLE, strip=True)
             # reduce the sibling to a single string
             sibling = get_text(child.previous_sibling)
             ul_tags_with_siblings.append((sibling, ul_list))
@@ -65,59 +91,66 @@ def find_ul_tags(element, tags: list = None) -> list:
 
     return ul_tags_with_siblings
 
-def decompose_job(text: str, headers: list = None) -> str:
+def find_sections(text: str, tags: list = None, engine: str = DEFAULT_ENGINE) -> list:
+    """
+    Find the ul tags in the body of the HTML
+    @param text: the HTML text
+    @param tags: the skill tags to find
+    @param engine: one of ENGINES
+    @return: a list of ul tags, the same for every engine
+    """
+    text = text.strip().replace('\n', '')
+    if engine == "soup":
+        body = BeautifulSoup(text, 'html.parser').find("body")
+        # like the stream engine, nothing is found without a body
+        return find_ul_tags(body, tags) if body is not None else []
+    if engine != "stream":
+        raise ValueError(f"Unknown decompose engine {engine}, expected one of {ENGINES}")
+    tags = stream_ul_tags(text, tags)
+    return tags if tags is not None else []
+
+def decompose_job(text: str, headers: list = None, engine: str = DEFAULT_ENGINE) -> str:
     """
     Decompose the HTML into a JSON file
     @param text: the HTML text
+    @param headers: the headers to look for
+    @param engine: the engine used to find the ul tags
     @return: the JSON file
     """
-    key_headers = ["responsibilities:", "qualifications:", "requirements:", "skills:", "opportunity", "you have", "nice to have", "experience"] if headers is None else headers
-    translate_headers = {
-        "responsibilities:": "Responsibilities",
-        "qualifications:": "Qualifications",
-        "requirements:": "Requirements",
-        "skills:": "Requirements",
-        "opportunity": "Responsibilities",
-        "you have": "Qualifications",
-        "nice to have": "Optional Requirements",
-        "experience": "Requirements"
-    }
-    soup = BeautifulSoup(text.strip().replace('\n', ''), 'html.parser')
-
-    body = soup.find("body")
-
+    key_headers = [header.lower() for header in (DEFAULT_HEADERS if headers is None else headers)]
+    # headers from a config that have no translation keep their own name
+    translate_headers = [TRANSLATE_HEADERS.get(header, header.strip().rstrip(":").strip().title()) for header in key_headers]
+    matcher = compile_matcher(key_headers)
     # find the ul tags
-    tags = find_ul_tags(body)
+    tags = find_sections(text, engine=engine)
 
     data = {}
 
     for tag in tags:
         if tag[0] is None:
             continue
-        # check if tag[0] contains any of the key headers
-        for key_header in key_headers:
-            if key_header in tag[0].lower():
-                if data.get(translate_headers[key_header]) is None:
-                    data[translate_headers[key_header]] = tag[1]
-                else:
-                    data[translate_headers[key_header]] += tag[1]
-                break
+        # check if tag[0] contains any of the key headers, the first listed one wins
+        key_header = matcher.first(tag[0].lower())
+        if key_header is not None:
+            if data.get(translate_headers[key_header]) is None:
+                data[translate_headers[key_header]] = tag[1]
+            else:
+                data[translate_headers[key_header]] += tag[1]
     json_data = json.dumps(data, indent=4)
 
     return json_data
 
-def decompose_resume(text: str, tags: list = None) -> str:
+def decompose_resume(text: str, tags: list = None, engine: str = DEFAULT_ENGINE) -> str:
     """
     Decompose the HTML into a JSON file
     @param text: the HTML text
+    @param tags: the skill tags to look for
+    @param engine: the engine used to find the ul tags
     @return: the JSON file
     """
-    skills_tags = ["docker", "rust", "java", "golang", "rust", "ghidra", "python", "mysql", "redis", "sqlite", "json", "pytorch","c/c++","c++/c", "orm"] if tags is None else tags
-    soup = BeautifulSoup(text.strip().replace('\n', ''), 'html.parser')
-    # go through the body and find tags that contain the key headers
-    body = soup.find("body")
+    skills_tags = DEFAULT_TAGS if tags is None else tags
     # find the ul tags
-    tags = find_ul_tags(body, skills_tags)
+    tags = find_sections(text, skills_tags, engine)
 
     data = {}
 
@@ -130,7 +163,7 @@ def decompose_resume(text: str, tags: list = None) -> str:
             if data.get("Projects") is None:
                 data["Projects"] = []
             data["Projects"].append({
-                "title": tag[0].replace('\u2013', '-').replace('\u2022', '*'),
+                "title": tag[0].translate(TITLE_TABLE),
                 "description": tag[1]
             })
         elif tag[0] == "Skills":
@@ -145,7 +178,7 @@ def decompose_resume(text: str, tags: list = None) -> str:
             if data.get("Experience/Activities") is None:
                 data["Experience/Activities"] = []
             data["Experience/Activities"].append({
-                "title": tag[0].replace('\u2013', '-').replace('\u2022', '*'),
+                "title": tag[0].translate(TITLE_TABLE),
                 "description": tag[1]
             })
     json_data = json.dumps(data, indent=4)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from utils.ranker import words
+
+DEDUPE_PATH = "assets/cache/dedupe.sqlite"
+# minhash permutations, split into BANDS bands of NUM_PERM / BANDS rows
+NUM_PERM = 128
+BANDS = 32
+# words per shingle
+SHINGLE = 3
+# the multiply-shift hash family, fixed so stored signatures stay comparable
+SEED = 1
+# jobs at least this similar are the same posting
+DUPLICATE_THRESHOLD = 0.8
+# details that differ between reposts of a posting, longest replaced first
+ADAPT_KEYS = ["company_address_1", "company_address_2", "job_title", "company"]
+
+generator = np.random.default_rng(SEED)
+MULTIPLIERS = generator.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+INCREMENTS = generator.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+def job_words(job: str) -> list:
+    """
+    Normalize a decomposed job description for comparison
+        Section names and formatting are left out, only the lowercase
+        words of the items are kept in order
+    @param job: the decomposed job description JSON
+    @return: the words
+    """
+    data = json.loads(job)
+    found = []
+    for items in data.values():
+        for item in items if isinstance(items, list) else [items]:
+            if isinstance(item, dict):
+                item = " ".join([item.get("title", "")] + item.get("description", []))
+            found += words(str(item))
+    return found
+
+def signature(job: str) -> np.ndarray:
+    """
+    MinHash a job description's word shingles
+    @param job: the decomposed job description JSON
+    @return: NUM_PERM uint32 minimums
+    """
+    found = job_words(job)
+    shingles = {" ".join(found[i:i + SHINGLE]) for i in range(max(len(found) - SHINGLE + 1, 1))}
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+    # (a * x + b) >> 32 wraps around in uint64, the high half is a universal hash of x
+    return ((hashes[:, None] * MULTIPLIERS + INCREMENTS) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Estimate the Jaccard similarity of two signatures
+    """
+    return float(np.mean(a == b))
+
+def band_buckets(sig: np.ndarray, bands: int = BANDS) -> list:
+    """
+    Hash every band of a signature, jobs sharing a bucket in any band are candidates
+    @param sig: the signature
+    @param bands: the number of bands
+    @return: a signed 64 bit bucket per band
+    """
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "big", signed=True) for band in np.split(sig, bands)]
+
+def job_key(path: str) -> str:
+    """
+    Key a job by its absolute HTML path
+        The menu, --decompose_all and --batch may spell the same file differently
+    @param path: the job's HTML path
+    @return: the key
+    """
+    return os.path.abspath(path)
+
+def resume_key(resume: str) -> str:
+    return hashlib.sha256(resume.encode("utf-8")).hexdigest()
+
+class Duplicate:
+    """
+    A letter written for a near-duplicate of a job
+    """
+    def __init__(self, job: str, similarity: float, details: dict, text: str) -> None:
+        self.job = job
+        self.similarity = similarity
+        self.details = details
+        self.text = text
+    def adapt(self, details: dict) -> str:
+        """
+        Adapt the letter to another posting of the same job
+        @param details: the details of this posting
+        @return: the letter with the company, its address and the job title replaced
+        """
+        text = self.text
+        replacements = [(self.details.get(key, "").strip(), details.get(key, "").strip()) for key in ADAPT_KEYS]
+        for before, after in sorted(replacements, key=lambda pair: -len(pair[0])):
+            if before and after and before != after:
+                text = text.replace(before, after)
+        return text
+
+class DuplicateIndex:
+    """
+    Persistent MinHash/LSH index of decomposed job descriptions
+        Every job's signature is split into bands, and each band is hashed
+        into an indexed bucket. A lookup only compares the signatures of
+        jobs sharing a bucket with it, so it stays sub-linear in the number
+        of jobs. Jobs are keyed by their absolute HTML path and only hashed
+        again when their decomposed content changes. The letters generated
+        for a job are kept per resume so a near-duplicate can reuse them.
+    """
+    def __init__(self, path: str = DEDUPE_PATH, threshold: float = DUPLICATE_THRESHOLD, bands: int = BANDS) -> None:
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, digest TEXT NOT NULL, signature BLOB NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, key TEXT NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (band, bucket)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (key)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS letters (job TEXT NOT NULL, resume TEXT NOT NULL, details TEXT NOT NULL, text TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (job, resume))")
+        self.db.commit()
+    def __contains__(self, key: str) -> bool:
+        key = job_key(key)
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM jobs WHERE key = ?", (key,)).fetchone() is not None
+    def add(self, key: str, job: str) -> bool:
+        """
+        Index a job, or index it again when its content changed
+            The letters of a changed job are forgotten
+        @param key: the job's HTML path
+        @param job: the decomposed job description JSON
+        @return: False when it is indexed with the same content
+        """
+        key = job_key(key)
+        digest = hashlib.sha256(job.encode("utf-8")).hexdigest()
+        with self.lock:
+            row = self.db.execute("SELECT digest FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] == digest:
+                return False
+        sig = signature(job)
+        with self.lock, self.db:
+            self.forget(key)
+            self.db.execute("INSERT INTO jobs (key, digest, signature) VALUES (?, ?, ?)", (key, digest, sig.tobytes()))
+            self.db.executemany("INSERT INTO buckets (band, bucket, key) VALUES (?, ?, ?)", [(band, bucket, key) for band, bucket in enumerate(band_buckets(sig, self.bands))])
+        return True
+    def forget(self, key: str) -> None:
+        for table, column in [("jobs", "key"), ("buckets", "key"), ("letters", "job")]:
+            self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+    def remove(self, key: str) -> None:
+        """
+        Remove a job and its letters
+        @param key: the job's HTML path
+        """
+        with self.lock, self.db:
+            self.forget(job_key(key))
+    def duplicates(self, job: str, threshold: float = None, exclude: str = None) -> list:
+        """
+        Find the indexed jobs similar to a job
+        @param job: the decomposed job description JSON
+        @param threshold: the least estimated Jaccard similarity of their word shingles, defaults to the index's
+        @param exclude: a key to leave out, usually the job's own
+        @return: (key, similarity) pairs, most similar first, keys are absolute paths
+        """
+        threshold = self.threshold if threshold is None else threshold
+        sig = signature(job)
+        with self.lock:
+            candidates = set()
+            for band, bucket in enumerate(band_buckets(sig, self.bands)):
+                candidates.update(key for key, in self.db.execute("SELECT key FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+            if exclude is not None:
+                candidates.discard(job_key(exclude))
+            rows = [self.db.execute("SELECT key, signature FROM jobs WHERE key = ?", (key,)).fetchone() for key in candidates]
+        found = [(key, similarity(sig, np.frombuffer(blob, dtype=np.uint32))) for key, blob in filter(None, rows)]
+        return sorted([pair for pair in found if pair[1] >= threshold], key=lambda pair: -pair[1])
+    def save_letter(self, job: str, resume: str, details: dict, text: str) -> None:
+        """
+        Keep the letter generated for a job and resume
+        @param job: the job's HTML path
+        @param resume: the decomposed resume JSON
+        @param details: the details the letter was written with
+        @param text: the letter
+        """
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO letters (job, resume, details, text, updated) VALUES (?, ?, ?, ?, ?)",
+                            (job_key(job), resume_key(resume), json.dumps(details), text, time.time()))
+    def find_letter(self, job: str, resume: str, threshold: float = None, exclude: str = None) -> Duplicate:
+        """
+        Find a letter for the same resume written for a near-duplicate of a job
+        @param job: the decomposed job description JSON
+        @param resume: the decomposed resume JSON
+        @param threshold: the least similarity, see duplicates
+        @param exclude: the job's own key
+        @return: the letter of the most similar job that has one, None when there is none
+        """
+        key = resume_key(resume)
+        for other, score in self.duplicates(job, threshold, exclude):
+            with self.lock:
+                row = self.db.execute("SELECT details, text FROM letters WHERE job = ? AND resume = ?", (other, key)).fetchone()
+            if row is not None:
+                return Duplicate(other, score, json.loads(row[0]), row[1])
+        return None
+    def close(self) -> None:
+        self.db.close()
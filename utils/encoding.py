@@ -0,0 +1,50 @@
+import json
+
+# how the decomposed job and resume are written into the prompt
+#   json: the indented JSON the decomposers return
+#   minified: the same JSON without the whitespace
+#   lines: one line per section, entry and bullet
+ENCODINGS = ["json", "minified", "lines"]
+DEFAULT_ENCODING = "json"
+
+def encode_lines(data: dict) -> str:
+    """
+    Write decomposed sections as indented lines
+        Lists of strings become bullets, lists of entries become a title
+        line with the description bullets under it. Short string lists
+        (skills) stay on one line.
+    @param data: the decomposed sections
+    @return: the text
+    """
+    lines = []
+    for section, values in data.items():
+        if all(isinstance(value, str) and len(value) <= 24 and "," not in value for value in values):
+            lines.append(f"{section}: {', '.join(values)}")
+            continue
+        lines.append(f"{section}:")
+        for value in values:
+            if isinstance(value, dict):
+                lines.append(f"- {value.get('title', '').strip()}")
+                lines += [f"  * {item}" for item in value.get("description", [])]
+            else:
+                lines.append(f"- {value}")
+    return "\n".join(lines)
+
+def encode(data, encoding: str = DEFAULT_ENCODING) -> str:
+    """
+    Encode decomposed sections for the prompt
+    @param data: the decomposed JSON, or the sections it holds
+    @param encoding: one of ENCODINGS
+    @return: the encoded text
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown prompt encoding {encoding}, expected one of {ENCODINGS}")
+    if encoding == "json" and isinstance(data, str):
+        return data
+    if isinstance(data, str):
+        data = json.loads(data)
+    if encoding == "json":
+        return json.dumps(data, indent=4)
+    if encoding == "minified":
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+    return encode_lines(data)
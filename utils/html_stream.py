@@ -0,0 +1,291 @@
+import re
+from html.parser import HTMLParser
+from bs4.builder import HTMLTreeBuilder
+from bs4.dammit import EntitySubstitution, UnicodeDammit
+from utils.matcher import compile_matcher
+from utils.text import TEXT_TABLE, ITEM_TABLE
+
+# mirror the tree BeautifulSoup builds with 'html.parser' so both engines agree
+EMPTY_ELEMENT_TAGS = HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS
+PRESERVE_WHITESPACE_TAGS = HTMLTreeBuilder.DEFAULT_PRESERVE_WHITESPACE_TAGS
+STRING_CONTAINERS = set(HTMLTreeBuilder.DEFAULT_STRING_CONTAINERS)
+ASCII_SPACES = " \n\t\x0c\r"
+# plain strings, the only ones get_text and Tag.text look at
+TEXT = "text"
+
+DECIMAL_REFERENCE = re.compile("^([0-9]+)(.*)")
+HEX_REFERENCE = re.compile("^([0-9a-f]+)(.*)")
+
+class _Node:
+    """
+    An open element, only the bookkeeping the sections need
+    """
+    __slots__ = ("name", "parent", "in_body", "container", "preserve", "start", "last", "items", "slot", "sibling")
+    def __init__(self, name: str, parent) -> None:
+        self.name = name
+        self.parent = parent
+        self.in_body = False
+        self.container = parent.container if parent is not None else None
+        if name in STRING_CONTAINERS:
+            self.container = name
+        self.preserve = (parent is not None and parent.preserve) or name in PRESERVE_WHITESPACE_TAGS
+        # index of the first text chunk inside this element
+        self.start = 0
+        # the text (or chunk span) of the last closed child
+        self.last = None
+        self.items = None
+        self.slot = None
+        self.sibling = None
+
+def skill_sections(tags: list, found: list) -> list:
+    """
+    Turn matched skill tags into ("Skills", tag) sections
+    @param tags: the skill tags
+    @param found: the sorted indices of the tags that matched
+    @return: the sections
+    """
+    skills = []
+    for i in found:
+        tag = tags[i]
+        if tag.lower() == "c++/c" or tag.lower() == "c/c++":
+            skills.append(("Skills", "c"))
+            skills.append(("Skills", "c++"))
+        else:
+            skills.append(("Skills", tag))
+    return skills
+
+class SectionParser(HTMLParser):
+    """
+    Single pass replacement for find_ul_tags
+        Listens to the parser events and builds the (sibling, ul_list)
+        sections of the first body element without building a tree. Text
+        is only kept while an open element or a possible ul sibling still
+        needs it, so memory is bounded by the largest top level block of
+        the body rather than the document.
+    """
+    def __init__(self, tags: list = None) -> None:
+        super().__init__(convert_charrefs=False)
+        self.tags = tags
+        self.matcher = compile_matcher([tag.lower() for tag in tags]) if tags is not None else None
+        self.root = _Node("[document]", None)
+        self.stack = [self.root]
+        self.open_names = {}
+        self.closed_empty = []
+        self.data = []
+        self.body = None
+        self.finished = False
+        # text chunks inside the body, chunk i is self.chunks[i - self.base]
+        self.chunks = []
+        self.base = 0
+        self.trim_at = 1024
+        # sections in find_ul_tags order, filled in when their element closes
+        self.sections = []
+        self.scanner = None
+        self.scan_slot = None
+        self.scan_label = None
+    def text(self, start: int, end: int) -> str:
+        return "".join(self.chunks[start - self.base:end - self.base])
+    def position(self) -> int:
+        return self.base + len(self.chunks)
+    def trim(self) -> None:
+        """
+        Drop the chunks no open element or sibling can reference any more
+        """
+        keep = self.position()
+        for node in self.stack:
+            if node is self.body or node.in_body:
+                if node is not self.body:
+                    keep = min(keep, node.start)
+                if node.last is not None and node.last[0] == "span":
+                    keep = min(keep, node.last[1])
+        del self.chunks[:keep - self.base]
+        self.base = keep
+        self.trim_at = max(1024, 2 * len(self.chunks))
+    def flush(self, kind: str = None) -> None:
+        """
+        End the current string, the same way BeautifulSoup.endData does
+        @param kind: "cdata", "other" for comments and declarations, None
+            for character data
+        """
+        if not self.data:
+            return
+        text = "".join(self.data)
+        self.data = []
+        parent = self.stack[-1]
+        if not parent.preserve and text.strip(ASCII_SPACES) == "":
+            text = "\n" if "\n" in text else " "
+        if kind is None:
+            label = parent.container if parent.container is not None else TEXT
+        else:
+            label = TEXT if kind == "cdata" else None
+        if self.finished or not (parent is self.body or parent.in_body):
+            return
+        plain = text if label == TEXT else ""
+        if plain:
+            self.chunks.append(plain)
+            if len(self.chunks) > self.trim_at:
+                self.trim()
+        parent.last = ("text", plain)
+        if parent is self.body:
+            # a string directly inside the body is a child of its own
+            if self.matcher is not None:
+                scanner = self.matcher.scanner()
+                if label == TEXT:
+                    scanner.feed(text.lower())
+                self.sections.append(skill_sections(self.tags, scanner.matches()))
+        elif self.scanner is not None and label == self.scan_label:
+            self.scanner.feed(text.lower())
+    def start(self, name: str) -> _Node:
+        self.flush()
+        parent = self.stack[-1]
+        node = _Node(name, parent)
+        self.stack.append(node)
+        self.open_names[name] = self.open_names.get(name, 0) + 1
+        if self.finished:
+            return node
+        if self.body is None and name == "body":
+            self.body = node
+            return node
+        if parent is self.body or parent.in_body:
+            node.in_body = True
+            node.start = self.position()
+            if parent is self.body and self.matcher is not None:
+                self.scanner = self.matcher.scanner()
+                self.scan_slot = len(self.sections)
+                self.scan_label = name if name in STRING_CONTAINERS else TEXT
+                self.sections.append(None)
+            if name == "ul":
+                node.items = []
+                node.slot = len(self.sections)
+                self.sections.append(None)
+                if parent.last is None:
+                    node.sibling = ""
+                elif parent.last[0] == "span":
+                    node.sibling = self.text(parent.last[1], parent.last[2]).translate(TEXT_TABLE)
+                else:
+                    node.sibling = parent.last[1].translate(TEXT_TABLE)
+        return node
+    def close_node(self, node: _Node) -> None:
+        if node is self.body:
+            self.finished = True
+            self.chunks = []
+            return
+        if self.finished or not node.in_body:
+            return
+        parent = node.parent
+        end = self.position()
+        parent.last = ("span", node.start, end)
+        if parent.items is not None:
+            text = None
+            if node.name != "ul":
+                text = self.text(node.start, end).translate(ITEM_TABLE).strip()
+                parent.items.append(text)
+            if parent.parent.items is not None:
+                # items of a ul directly inside a ul belong to the outer list too
+                if text is None:
+                    text = self.text(node.start, end).translate(ITEM_TABLE).strip()
+                parent.parent.items.append(text)
+        if node.items is not None:
+            self.sections[node.slot] = (node.sibling, node.items)
+        if parent is self.body and self.scanner is not None:
+            self.sections[self.scan_slot] = skill_sections(self.tags, self.scanner.matches())
+            self.scanner = None
+    def end(self, name: str) -> None:
+        self.flush()
+        if not self.open_names.get(name):
+            return
+        while len(self.stack) > 1:
+            node = self.stack.pop()
+            self.open_names[node.name] -= 1
+            self.close_node(node)
+            if node.name == name:
+                break
+    def handle_starttag(self, tag, attrs) -> None:
+        self.start(tag)
+        if tag in EMPTY_ELEMENT_TAGS:
+            self.end(tag)
+            self.closed_empty.append(tag)
+    def handle_startendtag(self, tag, attrs) -> None:
+        self.start(tag)
+        self.end(tag)
+    def handle_endtag(self, tag) -> None:
+        if tag in self.closed_empty:
+            self.closed_empty.remove(tag)
+        else:
+            self.end(tag)
+    def handle_data(self, data) -> None:
+        self.data.append(data)
+    def handle_charref(self, name) -> None:
+        dereferenced = ""
+        extra_data = ""
+        base = 10
+        reg = DECIMAL_REFERENCE
+        if name.startswith("x") or name.startswith("X"):
+            name = name[1:]
+            base = 16
+            reg = HEX_REFERENCE
+        real_name = None
+        try:
+            real_name = int(name, base)
+        except ValueError:
+            match = reg.search(name)
+            if match is not None:
+                real_name = int(match.groups()[0], base)
+                extra_data = match.groups()[1]
+        if real_name is None:
+            extra_data = name
+        else:
+            dereferenced = UnicodeDammit.numeric_character_reference(real_name)[0]
+        self.data.append(dereferenced)
+        self.data.append(extra_data)
+    def handle_entityref(self, name) -> None:
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.data.append(character if character is not None else "&%s" % name)
+    def handle_comment(self, data) -> None:
+        self.flush()
+        self.data.append(data)
+        self.flush("other")
+    def handle_decl(self, decl) -> None:
+        self.flush()
+        self.data.append(decl[len("DOCTYPE "):])
+        self.flush("other")
+    def unknown_decl(self, data) -> None:
+        self.flush()
+        if data.upper().startswith("CDATA["):
+            self.data.append(data[len("CDATA["):])
+            self.flush("cdata")
+        else:
+            self.data.append(data)
+            self.flush("other")
+    def handle_pi(self, data) -> None:
+        self.flush()
+        self.data.append(data)
+        self.flush("other")
+    def close(self) -> None:
+        super().close()
+        self.flush()
+        while len(self.stack) > 1:
+            node = self.stack.pop()
+            self.close_node(node)
+
+def stream_ul_tags(text: str, tags: list = None) -> list:
+    """
+    Find the ul tags of the body in a single pass
+        Produces the same list as find_ul_tags(soup.find("body"), tags)
+    @param text: the HTML text
+    @param tags: the skill tags to find in the top level elements
+    @return: a list of ul tags, None if there is no body
+    """
+    parser = SectionParser(tags)
+    # fed whole, html.parser splits malformed markup differently across feeds
+    parser.feed(text)
+    parser.close()
+    if parser.body is None:
+        return None
+    ul_tags_with_siblings = []
+    for section in parser.sections:
+        if isinstance(section, list):
+            ul_tags_with_siblings += section
+        else:
+            ul_tags_with_siblings.append(section)
+    return ul_tags_with_siblings
@@ -1,24 +1,57 @@
-from ctransformers import AutoModelForCausalLM
+import asyncio
 import json
+import time
 import types as t
+from typing import AsyncIterator, Iterator
+from utils.decompose import DEFAULT_HEADERS, DEFAULT_TAGS
+from utils.encoding import DEFAULT_ENCODING, encode
+from utils.stopping import Stopper
 
-MODEL_ID = 'TheBloke/Llama-2-13B-chat-GGML'
-MODEL_FILE = 'llama-2-13b-chat.ggmlv3.q6_K.bin'
 CONFIG_PATH = "assets/configs/"
+# Llama 2, used when a backend can't tell its own context size
+DEFAULT_CONTEXT_LENGTH = 4096
 
 class BasicSettings:
     """
     Basic settings for the model
+        prompt_encoding is how the job and resume are written into the
+        prompt, one of ENCODINGS. context_length overrides the backend's
+        context size for the prompt budget. seed makes sampling
+        reproducible, None leaves it random. candidates is the number of
+        letters to generate from one prompt evaluation and rank. The letter
+        ends before the first of the stop sequences, and with
+        stop_at_signoff after the sign-off with the user's name. deadline
+        is the most seconds a generation may take, None for no limit.
+        relevance_top_k and relevance_threshold leave out the resume's
+        projects and experience least relevant to the job, see
+        utils/relevance.py, None keeps them all. duplicate_threshold is how
+        similar a job must be to one with a letter for the same resume for
+        that letter to be reused, see utils/dedupe.py, None never reuses.
     """
-    def __init__(self, max_new_tokens: int, repetition_penalty: float) -> None:
+    def __init__(self, max_new_tokens: int, repetition_penalty: float, prompt_encoding: str = DEFAULT_ENCODING, context_length: int = None, seed: int = None, candidates: int = 1,
+                 stop: list = None, stop_at_signoff: bool = True, deadline: float = None,
+                 relevance_top_k: int = None, relevance_threshold: float = None, duplicate_threshold: float = None) -> None:
         self.max_new_tokens = max_new_tokens
         self.repetition_penalty = repetition_penalty
+        self.prompt_encoding = prompt_encoding
+        self.context_length = context_length
+        self.seed = seed
+        self.candidates = candidates
+        self.stop = [] if stop is None else stop
+        self.stop_at_signoff = stop_at_signoff
+        self.deadline = deadline
+        self.relevance_top_k = relevance_top_k
+        self.relevance_threshold = relevance_threshold
+        self.duplicate_threshold = duplicate_threshold
     def to_dict(self) -> dict:
         """
         Convert the settings to a dict
         @return: the dict
         """
-        return {"max_new_tokens": self.max_new_tokens, "repetition_penalty": self.repetition_penalty}
+        return {"max_new_tokens": self.max_new_tokens, "repetition_penalty": self.repetition_penalty, "prompt_encoding": self.prompt_encoding, "context_length": self.context_length, "seed": self.seed, "candidates": self.candidates,
+                "stop": self.stop, "stop_at_signoff": self.stop_at_signoff, "deadline": self.deadline,
+                "relevance_top_k": self.relevance_top_k, "relevance_threshold": self.relevance_threshold,
+                "duplicate_threshold": self.duplicate_threshold}
 
 class JobConfig:
     """
@@ -46,22 +79,74 @@ class ResumeConfig:
         """
         return {"tags": self.tags}
 
+class SpeculativeConfig:
+    """
+    Config for speculative decoding
+        draft_file is the path of a small GGML model with the same
+        vocabulary as the main model, None turns speculative decoding off.
+        k is the number of tokens the draft proposes per verification.
+    """
+    def __init__(self, draft_file: str = None, k: int = 4) -> None:
+        self.draft_file = draft_file
+        self.k = k
+    def to_dict(self) -> dict:
+        """
+        Convert the config to a dict
+        @return: the dict
+        """
+        return {"draft_file": self.draft_file, "k": self.k}
+
+class RuntimeConfig:
+    """
+    How the GGML backend loads its model, applied at load time
+        model_file picks another quantization of the model, None keeps the
+        default. threads, batch_size and gpu_layers are passed to llama.cpp
+        as they are, None leaves its default. See utils/tuner.py to find
+        the fastest values for a host.
+    """
+    def __init__(self, model_file: str = None, threads: int = None, batch_size: int = None, context_length: int = None, mmap: bool = True, mlock: bool = False, gpu_layers: int = None) -> None:
+        self.model_file = model_file
+        self.threads = threads
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.mmap = mmap
+        self.mlock = mlock
+        self.gpu_layers = gpu_layers
+    def to_dict(self) -> dict:
+        """
+        Convert the config to a dict
+        @return: the dict
+        """
+        return {"model_file": self.model_file, "threads": self.threads, "batch_size": self.batch_size, "context_length": self.context_length,
+                "mmap": self.mmap, "mlock": self.mlock, "gpu_layers": self.gpu_layers}
+
 class BasicConfig:
     """
     Basic config for the model
     """
-    def __init__(self, config_name: str, settings: BasicSettings, job: JobConfig, resume: ResumeConfig, max_memory: dict = None) -> None:
+    def __init__(self, config_name: str, settings: BasicSettings, job: JobConfig, resume: ResumeConfig, max_memory: dict = None, speculative: SpeculativeConfig = None,
+                 runtime: RuntimeConfig = None) -> None:
         self.settings = settings
         self.job = job
         self.resume = resume
         self.max_memory = max_memory
+        self.speculative = SpeculativeConfig() if speculative is None else speculative
+        self.runtime = RuntimeConfig() if runtime is None else runtime
         self.config_name = config_name
     def to_dict(self) -> dict:
         """
         Convert the config to a dict
         @return: the dict
         """
-        return {"settings": self.settings.to_dict(), "job": self.job.to_dict(), "resume": self.resume.to_dict(), "max_memory": self.max_memory}
+        return {"settings": self.settings.to_dict(), "job": self.job.to_dict(), "resume": self.resume.to_dict(), "max_memory": self.max_memory, "speculative": self.speculative.to_dict(),
+                "runtime": self.runtime.to_dict()}
+
+def default_config() -> BasicConfig:
+    """
+    Build the config backends start with when none is given
+    @return: the default config
+    """
+    return BasicConfig("default", BasicSettings(1200, 1.2), JobConfig(list(DEFAULT_HEADERS)), ResumeConfig(list(DEFAULT_TAGS)))
 
 def load_config(config_name: str) -> BasicConfig:
     """
@@ -71,24 +156,104 @@ def load_config(config_name: str) -> BasicConfig:
     """
     with open(f"{CONFIG_PATH}/{config_name}.json", "r") as f:
         config = json.load(f)
-    return BasicConfig(config_name, BasicSettings(config["settings"]["max_new_tokens"], config["settings"]["repetition_penalty"]), JobConfig(config["job"]["headers"]), ResumeConfig(config["resume"]["tags"]))
+    return config_from_dict(config_name, config)
 
-def build_prompt(job_description: str, resume: str, details: dict) -> str:
+def config_from_dict(config_name: str, config: dict) -> BasicConfig:
     """
-    Build the prompt for the model
+    Build a config from its dict form, the inverse of BasicConfig.to_dict
+    @param config_name: the config name
+    @param config: the dict
+    @return: the config
+    """
+    max_memory = config.get("max_memory")
+    if max_memory is not None:
+        # JSON object keys are strings, device indices are ints
+        max_memory = {int(k) if str(k).isdigit() else k: v for k, v in max_memory.items()}
+    speculative = config.get("speculative", {})
+    runtime = config.get("runtime", {})
+    return BasicConfig(config_name, settings_from_dict(config["settings"]), JobConfig(config["job"]["headers"]), ResumeConfig(config["resume"]["tags"]), max_memory,
+                       SpeculativeConfig(speculative.get("draft_file"), speculative.get("k", 4)),
+                       RuntimeConfig(runtime.get("model_file"), runtime.get("threads"), runtime.get("batch_size"), runtime.get("context_length"),
+                                     runtime.get("mmap", True), runtime.get("mlock", False), runtime.get("gpu_layers")))
+
+def settings_from_dict(settings: dict) -> BasicSettings:
+    """
+    Build the settings from their dict form, settings added later are optional
+    @param settings: the dict
+    @return: the settings
+    """
+    return BasicSettings(settings["max_new_tokens"],
+                         settings["repetition_penalty"],
+                         settings.get("prompt_encoding", DEFAULT_ENCODING),
+                         settings.get("context_length"),
+                         settings.get("seed"),
+                         settings.get("candidates", 1),
+                         settings.get("stop"),
+                         settings.get("stop_at_signoff", True),
+                         settings.get("deadline"),
+                         settings.get("relevance_top_k"),
+                         settings.get("relevance_threshold"),
+                         settings.get("duplicate_threshold"))
+
+class Prompt(str):
+    """
+    Prompt text that remembers the part of it shared between jobs
+        prefix is the leading text that only depends on the resume and the
+        user's details, backends can keep the model state for it. signer is
+        the name the letter is signed with, generation can stop after it.
+    """
+    def __new__(cls, text: str, prefix: str = "", signer: str = "") -> "Prompt":
+        prompt = super().__new__(cls, text)
+        prompt.prefix = prefix
+        prompt.signer = signer
+        return prompt
+
+def prompt_format(encoding: str) -> tuple:
+    """
+    Get how the prompt names and fences the encoded sections
+    @param encoding: one of ENCODINGS
+    @return: (description, code fence language)
+    """
+    return ("as a list", "") if encoding == "lines" else ("as a JSON", "json")
+
+def build_prompt_prefix(resume: str, details: dict, encoding: str = DEFAULT_ENCODING) -> str:
+    """
+    Build the stable start of the prompt, everything before the job specific part
+    @param resume: the decomposed resume
+    @param details: the user's details
+    @param encoding: how to write the resume, one of ENCODINGS
+    @return: the prompt prefix
     """
+    described, fence = prompt_format(encoding)
+    resume = encode(resume, encoding)
     return f"""[INST] <<SYS>>
-You are an assistant in generating cover letters. You are given the user's name, job description as a JSON, and the user's background information via their resume as a JSON. Your job is to interpret this data and create a professional cover letter. You can only respond in markdown. Do not over-embelish the user's experiences.
+You are an assistant in generating cover letters. You are given the user's name, job description {described}, and the user's background information via their resume {described}. Your job is to interpret this data and create a professional cover letter. You can only respond in markdown. Do not over-embelish the user's experiences.
 <</SYS>>
 
 My name is {details["name"]}. I live at {details["address"]}. My phone number is {details["phone_number"]}. My email is {details["email"]}.
-My resume as a JSON is:
-```json
+My resume {described} is:
+```{fence}
 {resume}
 ```
-I am applying to {details['company']} as a {details["job_title"]}.
-The job description as a JSON is:
-```json
+"""
+
+def build_prompt(job_description: str, resume: str, details: dict, encoding: str = DEFAULT_ENCODING) -> Prompt:
+    """
+    Build the prompt for the model
+        The system prompt, the user's details and the resume come first so
+        prompts for the same resume share their prefix.
+    @param job_description: the decomposed job description
+    @param resume: the decomposed resume
+    @param details: the user's details
+    @param encoding: how to write the job and resume, one of ENCODINGS
+    @return: the prompt
+    """
+    described, fence = prompt_format(encoding)
+    prefix = build_prompt_prefix(resume, details, encoding)
+    job_description = encode(job_description, encoding)
+    return Prompt(prefix + f"""I am applying to {details['company']} as a {details["job_title"]}.
+The job description {described} is:
+```{fence}
 {job_description}
 ```
 Please help me generate a cover letter customized to my credentials.
@@ -102,12 +267,24 @@ Please help me generate a cover letter customized to my credentials.
 {details['company_address_2']}<br>
 
 Dear hiring manager,
-"""
+""", prefix, details["name"])
+
+def letter_head(prompt: str) -> str:
+    """
+    Get the start of the letter the prompt writes after [/INST]
+        Backends only return generated tokens, the head comes from the prompt
+    @param prompt: the prompt
+    @return: the letter head, empty without [/INST]
+    """
+    inst_end = prompt.find("[/INST]")
+    return prompt[inst_end+8:].lstrip() if inst_end != -1 else ""
 
 class Inference:
     """
     Hollow class for polymorphism
     """
+    # a RunMetrics to record tokenizing, prefill and decoded tokens in, set by the caller
+    metrics = None
     def __init__(self) -> None:
         pass
     def set_max_new_tokens(self, max_new_tokens: int) -> None:
@@ -120,116 +297,93 @@ class Inference:
         pass
     def generate(self, prompt: str) -> str:
         pass
-
-class InferenceGGML(Inference):
-    """
-    Inference class for generating cover letters using GGML
-    """
-    def __init__(self, gpu_layers: int = 0, config: BasicConfig = None) -> None:
-        self.model = AutoModelForCausalLM.from_pretrained(MODEL_ID, model_file=MODEL_FILE, model_type="llama", gpu_layers=gpu_layers)
-        self.model.config.max_new_tokens = 1200
-        self.config = BasicConfig("default",BasicSettings(1200, 1.2), JobConfig(["Responsibilities:", "Qualifications:", "Requirements:", "Skills:"]), ResumeConfig(["docker", "rust", "java", "golang", "rust", "ghidra", "python", "mysql", "redis", "sqlite", "json", "pytorch","c/c++","c++/c", "orm"])) if config is None else config
-    def set_max_new_tokens(self, max_new_tokens: int) -> None:
-        """
-        Set the max new tokens for the model
-        @param max_new_tokens: the max new tokens
+    def stopper(self, prompt: str) -> Stopper:
         """
-        self.model.config.max_new_tokens = max_new_tokens
-        self.config.settings.max_new_tokens = max_new_tokens
-    def set_repetition_penalty(self, repetition_penalty: float) -> None:
-        """
-        Set the repetition penalty for the model
-        @param repetition_penalty: the repetition penalty
-        """
-        self.model.config.repetition_penalty = repetition_penalty
-        self.config.settings.repetition_penalty = repetition_penalty
-    def set_config(self, config: BasicConfig) -> None:
+        Build the stopper for a generation from the settings, its deadline counts from now
+        @param prompt: the prompt, a Prompt carries the signer's name
+        @return: the stopper
         """
-        Set the config for the model
-        @param config: the config
+        settings = self.get_config().settings
+        deadline = time.monotonic() + settings.deadline if settings.deadline else None
+        return Stopper(settings.stop, getattr(prompt, "signer", "") if settings.stop_at_signoff else "", deadline)
+    def model_id(self) -> str:
         """
-        self.config = config
-        self.set_max_new_tokens(config.settings.max_new_tokens)
-        self.set_repetition_penalty(config.settings.repetition_penalty)
-    def get_config(self) -> BasicConfig:
+        Identify the loaded model weights, part of the result cache key
+        @return: the model id
         """
-        Get the config for the model
-        @return: the config
+        return type(self).__name__
+    def count_tokens(self, text: str) -> int:
         """
-        return self.config
-    def generate(self, prompt: str) -> str:
+        Count the tokens the backend's tokenizer makes of the text
+            Backends without a tokenizer estimate 4 characters per token
+        @param text: the text
+        @return: the number of tokens
         """
-        Generate the cover letter
-        @param prompt: the prompt for the model
-        @return: the generated cover letter
-        """
-        input_ids = self.model.tokenize(prompt)
-        output = ""
-        for i in self.model.generate(input_ids):
-            p_output = self.model.detokenize(i)
-            output += p_output
-        return output
-
-from transformers import AutoTokenizer
-from auto_gptq import AutoGPTQForCausalLM
-
-MODEL_ID = "TheBloke/Llama-2-13B-chat-GPTQ"
-MODEL_REVISION = "gptq-8bit-64g-actorder_True"
-MODEL_FILE = "model"
-
-class InferenceGPTQ(Inference):
-    """
-    Inference class for generating cover letters using AutoGPTQ
-    """
-    def __init__(self, max_memory: dict, config: BasicConfig = None) -> None:
-        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, use_fast=True)
-        self.model = AutoGPTQForCausalLM.from_quantized(MODEL_ID,
-                                                        model_basename=MODEL_FILE,
-                                                        use_safetensors=True,
-                                                        trust_remote_code=True,
-                                                        device_map="auto",
-                                                        max_memory=max_memory,
-                                                        use_triton=False,
-                                                        revision=MODEL_REVISION)
-        self.config = BasicConfig("default",BasicSettings(1200, 1.2), JobConfig(["Responsibilities:", "Qualifications:", "Requirements:", "Skills:"]), ResumeConfig(["docker", "rust", "java", "golang", "rust", "ghidra", "python", "mysql", "redis", "sqlite", "json", "pytorch","c/c++","c++/c", "orm"])) if config is None else config
-    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        return len(text) // 4 + 1
+    def context_length(self) -> int:
         """
-        Set the max new tokens for the model
-        @param max_new_tokens: the max new tokens
+        Get the number of tokens the model can attend to, prompt and generated tokens together
+        @return: the context length
         """
-        self.config.settings.max_new_tokens = max_new_tokens
-    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        config = self.get_config()
+        if config is not None and config.settings.context_length:
+            return config.settings.context_length
+        return DEFAULT_CONTEXT_LENGTH
+    def generate_batch(self, prompts: list) -> list:
         """
-        Set the repetition penalty for the model
-        @param repetition_penalty: the repetition penalty
+        Generate a cover letter for each prompt
+            Backends that can't batch run the prompts one after another
+        @param prompts: the prompts for the model
+        @return: the generated cover letters, in prompt order
         """
-        self.config.settings.repetition_penalty = repetition_penalty
-    def set_config(self, config: BasicConfig) -> None:
+        return [self.generate(prompt) for prompt in prompts]
+    def generate_candidates(self, prompt: str, n: int) -> list:
         """
-        Set the config for the model
-        @param config: the config
+        Generate several cover letters for the same prompt
+            Backends that can't share the prompt evaluation generate them
+            one after another, differently seeded when a seed is set
+        @param prompt: the prompt for the model
+        @param n: the number of letters
+        @return: the generated cover letters
         """
-        if config.max_memory is None:
-            config.max_memory = self.config.max_memory
-        self.config = config
-    def get_config(self) -> BasicConfig:
+        config = self.get_config()
+        seed = config.settings.seed if config is not None else None
+        letters = []
+        try:
+            for i in range(n):
+                if seed is not None:
+                    config.settings.seed = seed + i
+                letters.append(self.generate(prompt))
+        finally:
+            if seed is not None:
+                config.settings.seed = seed
+        return letters
+    def stream(self, prompt: str) -> Iterator[str]:
         """
-        Get the config for the model
-        @return: the config
+        Generate the cover letter as chunks of text as soon as they are decoded
+            Backends that can't stream yield the whole letter at once
+        @param prompt: the prompt for the model
+        @return: an iterator over the text chunks
         """
-        return self.config
-    def generate(self, prompt: str) -> str:
+        yield self.generate(prompt)
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
         """
-        Generate the cover letter
+        Async version of stream, decoding runs in a worker thread
         @param prompt: the prompt for the model
-        @return: the generated cover letter
-        """
-        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to('cuda')
-        output = self.model.generate(inputs=input_ids, max_new_tokens=self.config.settings.max_new_tokens, repetition_penalty=self.config.settings.repetition_penalty)
-        output = self.tokenizer.decode(output[0])
-        inst_end = output.find("[/INST]")
-        # remove prompt
-        output = output[inst_end+8:]
-        # remove trailing whitespace
-        output = output.strip()
-        return output
\ No newline at end of file
+        @return: an async iterator over the text chunks
+        """
+        chunks = iter(self.stream(prompt))
+        done = object()
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+def __getattr__(name: str):
+    # the backends moved to utils.backends, keep the old imports working without loading every backend
+    from utils.backends import BACKENDS, backend_class
+    for backend in BACKENDS:
+        if BACKENDS[backend].endswith(":" + name):
+            return backend_class(backend)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
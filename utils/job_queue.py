@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from utils.budget import fit_prompt
+from utils.inference import Inference, Prompt, letter_head
+from utils.stopping import timed_out, watch_deadlines
+
+QUEUE_PATH = "assets/cache/queue.sqlite"
+# how long a claimed job stays with its worker without a checkpoint
+LEASE_SECONDS = 300.0
+# how often the streamed text of a running job is saved
+CHECKPOINT_SECONDS = 10.0
+# a job that failed this many times isn't tried again
+MAX_ATTEMPTS = 3
+STATES = ["pending", "running", "done", "failed"]
+
+def worker_id() -> str:
+    """
+    Name this process as a queue worker
+    @return: "host:pid"
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def worker_alive(worker: str) -> bool:
+    """
+    Check if a worker is still running, only known for workers on this host
+    @param worker: the worker id
+    @return: False when it is a process of this host that is gone
+    """
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def input_hash(job: str, resume: str, details: dict) -> str:
+    """
+    Hash what the letter of a job is generated from
+    @param job: the decomposed job description
+    @param resume: the decomposed resume
+    @param details: the user's details
+    @return: the hex digest
+    """
+    return hashlib.sha256(json.dumps([job, resume, details], sort_keys=True).encode("utf-8")).hexdigest()
+
+class QueuedJob:
+    """
+    A claimed job, partial is the text saved by the last checkpoint
+    """
+    def __init__(self, key: str, job: str, resume: str, details: dict, output: str, partial: str, attempts: int) -> None:
+        self.key = key
+        self.job = job
+        self.resume = resume
+        self.details = details
+        self.output = output
+        self.partial = partial
+        self.attempts = attempts
+
+class JobQueue:
+    """
+    SQLite queue of cover letters to generate that survives restarts
+        A job is pending until a worker claims it. The worker holds a lease
+        on it, renewed by every checkpoint of its streamed text. A job whose
+        lease ran out, or whose worker on this host is gone, can be claimed
+        again and continues from its last checkpoint. Adding a job that is
+        done with the same inputs does nothing, so a restarted batch only
+        generates what is missing.
+    """
+    def __init__(self, path: str = QUEUE_PATH, lease_seconds: float = LEASE_SECONDS) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        # autocommit, claims take their own write lock with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY, inputs TEXT NOT NULL, job TEXT NOT NULL, resume TEXT NOT NULL, details TEXT NOT NULL, output TEXT NOT NULL,
+            state TEXT NOT NULL, worker TEXT, lease REAL, attempts INTEGER NOT NULL DEFAULT 0, partial TEXT NOT NULL DEFAULT '', error TEXT,
+            sequence INTEGER NOT NULL, updated REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, sequence)")
+    def add(self, key: str, job: str, resume: str, details: dict, output: str, sequence: int = 0) -> bool:
+        """
+        Queue a letter unless it is done with the same inputs
+            A job already queued with the same inputs keeps its saved text,
+            a failed one gets its attempts back
+        @param key: the job key, the output file name
+        @param job: the decomposed job description
+        @param resume: the decomposed resume
+        @param details: the user's details for this job
+        @param output: the path to write the letter to
+        @param sequence: jobs are claimed in sequence order
+        @return: False when the letter is already done
+        """
+        inputs = input_hash(job, resume, details)
+        with self.lock:
+            row = self.db.execute("SELECT inputs, state FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] == inputs:
+                if row[1] == "done" and os.path.exists(output):
+                    return False
+                if row[1] != "running":
+                    self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0, sequence = ?, updated = ? WHERE key = ?", (sequence, time.time(), key))
+                return True
+            self.db.execute("INSERT OR REPLACE INTO jobs (key, inputs, job, resume, details, output, state, sequence, updated) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+                            (key, inputs, job, resume, json.dumps(details), output, sequence, time.time()))
+            return True
+    def claim(self, worker: str) -> QueuedJob:
+        """
+        Take the next pending job, or a running one its worker lost
+            A lost job counts as an attempt, after MAX_ATTEMPTS it fails
+        @param worker: the claiming worker
+        @return: the job, None when there is nothing left to do
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = None
+                # interrupted jobs first, they have text to continue
+                for key, owner, lease, attempts in self.db.execute("SELECT key, worker, lease, attempts FROM jobs WHERE state = 'running' ORDER BY sequence").fetchall():
+                    if lease >= now and worker_alive(owner):
+                        continue
+                    if attempts >= MAX_ATTEMPTS:
+                        # lost by a worker every time, like a job that keeps failing
+                        self.db.execute("UPDATE jobs SET state = 'failed', lease = NULL, error = ?, updated = ? WHERE key = ?",
+                                        (f"lost by its worker {attempts} times", now, key))
+                        continue
+                    row = (key,)
+                    break
+                if row is None:
+                    row = self.db.execute("SELECT key FROM jobs WHERE state = 'pending' AND attempts < ? ORDER BY sequence LIMIT 1", (MAX_ATTEMPTS,)).fetchone()
+                if row is None:
+                    self.db.execute("COMMIT")
+                    return None
+                self.db.execute("UPDATE jobs SET state = 'running', worker = ?, lease = ?, attempts = attempts + 1, updated = ? WHERE key = ?",
+                                (worker, now + self.lease_seconds, now, row[0]))
+                job = self.db.execute("SELECT key, job, resume, details, output, partial, attempts FROM jobs WHERE key = ?", row).fetchone()
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return QueuedJob(job[0], job[1], job[2], json.loads(job[3]), job[4], job[5], job[6])
+    def checkpoint(self, key: str, worker: str, partial: str) -> bool:
+        """
+        Save the text generated so far and renew the lease
+        @param key: the job key
+        @param worker: the worker holding the job
+        @param partial: the text so far
+        @return: False when the job was claimed by another worker
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute("UPDATE jobs SET partial = ?, lease = ?, updated = ? WHERE key = ? AND worker = ? AND state = 'running'",
+                                     (partial, now + self.lease_seconds, now, key, worker))
+            return cursor.rowcount == 1
+    def complete(self, key: str, worker: str) -> bool:
+        """
+        Mark a job done, once its letter is written
+        @param key: the job key
+        @param worker: the worker holding the job
+        @return: False when the job was claimed by another worker
+        """
+        with self.lock:
+            cursor = self.db.execute("UPDATE jobs SET state = 'done', partial = '', lease = NULL, error = NULL, updated = ? WHERE key = ? AND worker = ? AND state = 'running'",
+                                     (time.time(), key, worker))
+            return cursor.rowcount == 1
+    def fail(self, key: str, worker: str, error: str) -> None:
+        """
+        Give a job back after an error, it fails for good after MAX_ATTEMPTS
+        @param key: the job key
+        @param worker: the worker holding the job
+        @param error: the error
+        """
+        with self.lock:
+            self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, lease = NULL, error = ?, updated = ? WHERE key = ? AND worker = ?",
+                            (MAX_ATTEMPTS, error, time.time(), key, worker))
+    def counts(self) -> dict:
+        """
+        Count the jobs in each state
+        @return: state -> count
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {state: 0 for state in STATES}
+        counts.update(dict(rows))
+        return counts
+    def failed(self) -> list:
+        """
+        Get the jobs that failed for good
+        @return: (key, error) per job, in sequence order
+        """
+        with self.lock:
+            return self.db.execute("SELECT key, error FROM jobs WHERE state = 'failed' ORDER BY sequence").fetchall()
+    def close(self) -> None:
+        self.db.close()
+
+def resume_prompt(prompt: Prompt, partial: str) -> Prompt:
+    """
+    Build the prompt that continues a partial letter
+    @param prompt: the prompt of the letter
+    @param partial: the text generated before the interruption
+    @return: the prompt ending with the partial letter
+    """
+    head = letter_head(prompt)
+    # backends that return the letter head stream it first, the model only wrote the rest
+    written = partial[len(head):] if head and partial.startswith(head) else partial
+    return Prompt(str(prompt) + written, getattr(prompt, "prefix", ""), getattr(prompt, "signer", ""))
+
+def run_queue(inference: Inference, job_queue: JobQueue, worker: str = None, checkpoint_seconds: float = CHECKPOINT_SECONDS, log=print) -> list:
+    """
+    Generate queued letters until the queue is empty
+        Every letter is streamed and its text saved at most every
+        checkpoint_seconds. A job with saved text continues after it, so an
+        interruption only costs the text since its last checkpoint, and
+        only generates the max_new_tokens the saved text left. A letter
+        cut at the settings' deadline is saved and given back like a failed
+        one, to be continued by the next attempt.
+    @param inference: the loaded inference object
+    @param job_queue: the queue
+    @param worker: this worker's id, defaults to worker_id()
+    @param checkpoint_seconds: how often to save the streamed text
+    @param log: called with a line for every letter
+    @return: the paths of the letters written
+    """
+    worker = worker_id() if worker is None else worker
+    written = []
+    while True:
+        job = job_queue.claim(worker)
+        if job is None:
+            return written
+        name = os.path.basename(job.output)
+        try:
+            prompt, trimmed = fit_prompt(job.job, job.resume, job.details, inference)
+            if trimmed:
+                log(f"Left out {len(trimmed)} items of {name} to fit the model's context")
+            text = job.partial
+            max_new_tokens = inference.get_config().settings.max_new_tokens
+            left = max_new_tokens
+            if text:
+                log(f"Continuing {name} after {len(text)} saved characters")
+                resumed = resume_prompt(prompt, text)
+                # the budget kept max_new_tokens free, the saved text already used part of them
+                left = max_new_tokens - (inference.count_tokens(resumed) - inference.count_tokens(prompt))
+                prompt = resumed
+            head = letter_head(prompt) if text else None
+            saved = time.monotonic()
+            lost = False
+            inference.set_max_new_tokens(max(left, 1))
+            try:
+                with watch_deadlines() as stoppers:
+                    # a letter saved at its token limit is complete
+                    for chunk in inference.stream(prompt) if left > 0 else []:
+                        if chunk == head:
+                            # the head of a continued prompt holds the saved text again
+                            head = None
+                            continue
+                        head = None
+                        text += chunk
+                        if time.monotonic() - saved >= checkpoint_seconds:
+                            saved = time.monotonic()
+                            if not job_queue.checkpoint(job.key, worker, text):
+                                lost = True
+                                break
+            finally:
+                inference.set_max_new_tokens(max_new_tokens)
+            if lost:
+                log(f"Lost {name} to another worker")
+                continue
+            if timed_out(stoppers):
+                # not a letter yet, the next attempt continues from the text so far
+                if job_queue.checkpoint(job.key, worker, text):
+                    job_queue.fail(job.key, worker, "stopped at the deadline")
+                log(f"Stopped {name} at the deadline after {len(text)} characters")
+                continue
+        except Exception as e:
+            job_queue.fail(job.key, worker, str(e))
+            log(f"Failed {name}: {e}")
+            continue
+        os.makedirs(os.path.dirname(job.output) or ".", exist_ok=True)
+        tmp = f"{job.output}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text.strip())
+        os.replace(tmp, job.output)
+        if job_queue.complete(job.key, worker):
+            written.append(job.output)
+            log(f"Saved {name}")
@@ -0,0 +1,107 @@
+from collections import deque
+from functools import lru_cache
+
+class MatchScanner:
+    """
+    Incremental scan state for a Matcher, text can be fed in chunks
+    """
+    def __init__(self, matcher) -> None:
+        self.matcher = matcher
+        self.state = 0
+        self.found = set(matcher.outputs[0])
+    def feed(self, text: str) -> None:
+        """
+        Scan the next chunk of text
+        @param text: the text
+        """
+        goto = self.matcher.goto
+        fail = self.matcher.fail
+        outputs = self.matcher.outputs
+        found = self.found
+        state = self.state
+        total = len(self.matcher.patterns)
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+                if len(found) == total:
+                    break
+        self.state = state
+    def matches(self) -> list:
+        """
+        Get the patterns found so far
+        @return: the sorted pattern indices
+        """
+        return sorted(self.found)
+
+class Matcher:
+    """
+    Aho-Corasick automaton over a list of patterns
+        Finds every pattern contained in a text in a single scan, instead
+        of one substring test per pattern. Build it with compile_matcher so
+        the automaton is shared between calls.
+    """
+    def __init__(self, patterns: list) -> None:
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(index)
+        # breadth first so the failure target is always finished first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+        self.outputs = [tuple(output) for output in self.outputs]
+    def scanner(self) -> MatchScanner:
+        """
+        Start an incremental scan
+        @return: the scanner
+        """
+        return MatchScanner(self)
+    def matches(self, text: str) -> list:
+        """
+        Find every pattern contained in the text
+        @param text: the text
+        @return: the sorted indices of the patterns found
+        """
+        scanner = MatchScanner(self)
+        scanner.feed(text)
+        return scanner.matches()
+    def first(self, text: str) -> int:
+        """
+        Find the earliest listed pattern contained in the text
+        @param text: the text
+        @return: the pattern index, None if no pattern is found
+        """
+        found = self.matches(text)
+        return found[0] if found else None
+
+@lru_cache(maxsize=32)
+def _compile(patterns: tuple) -> Matcher:
+    return Matcher(patterns)
+
+def compile_matcher(patterns: list) -> Matcher:
+    """
+    Get the matcher for a list of patterns, compiled once per list
+    @param patterns: the patterns
+    @return: the matcher
+    """
+    return _compile(tuple(patterns))
@@ -0,0 +1,213 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+METRICS_LOG = "output/metrics.jsonl"
+# upper bounds of the per token decode latency histogram, in seconds
+DECODE_BUCKETS = [0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0]
+
+def peak_rss() -> int:
+    """
+    Get the peak resident set size of this process
+    @return: the peak RSS in bytes, None when it can't be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+class RunMetrics:
+    """
+    Timings of one cover letter generation
+        The caller times its own stages (reading, decomposing, building the
+        prompt). A backend with metrics set times tokenizing and records each
+        decoded token, which gives prefill, time to first token and decode
+        latencies. Chunks are recorded by whoever consumes the stream, and
+        stand in for tokens when the backend doesn't record them.
+    """
+    def __init__(self) -> None:
+        self.labels = {}
+        self.stages = {}
+        self.request_time = None
+        self.prefill_time = None
+        self.token_times = []
+        self.chunk_times = []
+        self.peak_rss = None
+        # backend specific counters, like the draft acceptance of speculative decoding
+        self.counters = {}
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage, repeated stages add up
+        @param name: the stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+    def request(self) -> None:
+        """
+        Mark the start of a generation request, time to first token counts from here
+        """
+        self.request_time = time.perf_counter()
+    def prefill(self) -> None:
+        """
+        Mark the start of the prompt evaluation, after tokenizing
+        """
+        self.prefill_time = time.perf_counter()
+        if self.request_time is None:
+            self.request_time = self.prefill_time
+    def token(self) -> None:
+        """
+        Record a decoded token
+        """
+        self.token_times.append(time.perf_counter())
+    def chunk(self) -> None:
+        """
+        Record a chunk of streamed text
+        """
+        self.chunk_times.append(time.perf_counter())
+        if self.request_time is None:
+            self.request_time = self.chunk_times[0]
+    def finish(self) -> None:
+        """
+        Record the end of the run
+        """
+        self.peak_rss = peak_rss()
+    def times(self) -> list:
+        return self.token_times if self.token_times else self.chunk_times
+    def decode_latencies(self) -> list:
+        """
+        Get the time between consecutive tokens
+        @return: the latencies in seconds
+        """
+        times = self.times()
+        return [b - a for a, b in zip(times, times[1:])]
+    def histogram(self) -> list:
+        """
+        Bucket the decode latencies, cumulative like a Prometheus histogram
+        @return: (upper bound, count) pairs, the last bound is inf
+        """
+        latencies = self.decode_latencies()
+        return [(bound, sum(1 for latency in latencies if latency <= bound)) for bound in DECODE_BUCKETS + [float("inf")]]
+    def to_dict(self) -> dict:
+        """
+        Convert the metrics to a dict
+        @return: the dict
+        """
+        times = self.times()
+        first = times[0] if times else None
+        decode_seconds = times[-1] - times[0] if len(times) > 1 else None
+        return {
+            "time": time.time(),
+            "labels": self.labels,
+            "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            "unit": "token" if self.token_times else "chunk",
+            "tokens": len(times),
+            "prefill_seconds": round(first - self.prefill_time, 6) if first is not None and self.prefill_time is not None else None,
+            "time_to_first_token": round(first - self.request_time, 6) if first is not None and self.request_time is not None else None,
+            "tokens_per_second": round((len(times) - 1) / decode_seconds, 3) if decode_seconds else None,
+            "decode_histogram": [[bound if bound != float("inf") else "+Inf", count] for bound, count in self.histogram()],
+            "peak_rss_bytes": self.peak_rss,
+            "counters": self.counters,
+        }
+    def summary(self) -> list:
+        """
+        Format the metrics for the TUI
+        @return: the lines
+        """
+        metrics = self.to_dict()
+        lines = ["  ".join(f"{name}: {seconds * 1000:.1f}ms" for name, seconds in metrics["stages"].items())]
+        line = f"{metrics['tokens']} {metrics['unit']}s"
+        if metrics["time_to_first_token"] is not None:
+            line += f", first after {metrics['time_to_first_token']:.2f}s"
+        if metrics["prefill_seconds"] is not None:
+            line += f" (prefill {metrics['prefill_seconds']:.2f}s)"
+        if metrics["tokens_per_second"] is not None:
+            line += f", {metrics['tokens_per_second']:.1f} {metrics['unit']}s/s"
+        lines.append(line)
+        latencies = sorted(self.decode_latencies())
+        if latencies:
+            lines.append(f"decode latency p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+        if self.counters.get("draft_acceptance_rate") is not None:
+            lines.append(f"draft acceptance {self.counters['draft_acceptance_rate'] * 100:.0f}% ({self.counters['draft_accepted']}/{self.counters['draft_proposed']}), {self.counters['tokens_per_round']} tokens per pass")
+        if metrics["peak_rss_bytes"] is not None:
+            lines.append(f"peak RSS {metrics['peak_rss_bytes'] / 1024 / 1024:.0f}MiB")
+        return lines
+    def prometheus(self, prefix: str = "covergen") -> str:
+        """
+        Format the metrics in the Prometheus text exposition format
+        @param prefix: the metric name prefix
+        @return: the text
+        """
+        labels = ",".join(f'{key}="{value}"' for key, value in sorted(self.labels.items()))
+        def name(metric: str, extra: str = "") -> str:
+            joined = ",".join(label for label in [labels, extra] if label)
+            return f"{prefix}_{metric}{{{joined}}}" if joined else f"{prefix}_{metric}"
+        metrics = self.to_dict()
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each stage of the last generation", f"# TYPE {prefix}_stage_seconds gauge"]
+        for stage, seconds in metrics["stages"].items():
+            label = f'stage="{stage}"'
+            lines.append(f"{name('stage_seconds', label)} {seconds}")
+        lines += [f"# HELP {prefix}_decode_token_seconds Time between decoded tokens", f"# TYPE {prefix}_decode_token_seconds histogram"]
+        for bound, count in self.histogram():
+            label = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+            lines.append(f"{name('decode_token_seconds_bucket', label)} {count}")
+        latencies = self.decode_latencies()
+        lines.append(f"{name('decode_token_seconds_sum')} {sum(latencies)}")
+        lines.append(f"{name('decode_token_seconds_count')} {len(latencies)}")
+        for metric, key in [("time_to_first_token_seconds", "time_to_first_token"), ("prefill_seconds", "prefill_seconds"),
+                            ("tokens_per_second", "tokens_per_second"), ("generated_tokens", "tokens"), ("peak_rss_bytes", "peak_rss_bytes")]:
+            if metrics[key] is not None:
+                lines += [f"# TYPE {prefix}_{metric} gauge", f"{name(metric)} {metrics[key]}"]
+        for metric, value in sorted(self.counters.items()):
+            if isinstance(value, (int, float)):
+                lines += [f"# TYPE {prefix}_{metric} gauge", f"{name(metric)} {value}"]
+        return "\n".join(lines) + "\n"
+
+class MetricsLog:
+    """
+    Where finished runs are written
+        Every run is appended to a JSON lines file. The Prometheus file is
+        rewritten with the last run, for a node_exporter textfile collector.
+    """
+    def __init__(self, path: str = METRICS_LOG, prometheus_path: str = None) -> None:
+        self.path = path
+        self.prometheus_path = prometheus_path
+    def write(self, metrics: RunMetrics) -> None:
+        """
+        Record a finished run
+        @param metrics: the run
+        """
+        if self.path:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(metrics.to_dict()) + "\n")
+        if self.prometheus_path:
+            tmp = self.prometheus_path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(metrics.prometheus())
+            os.replace(tmp, self.prometheus_path)
+
+@contextmanager
+def timed(metrics: RunMetrics, name: str):
+    """
+    Time a stage when there are metrics to record it in
+    @param metrics: the run metrics, or None
+    @param name: the stage name
+    """
+    if metrics is None:
+        yield
+    else:
+        with metrics.stage(name):
+            yield
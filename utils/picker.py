@@ -0,0 +1,197 @@
+import bisect
+import curses
+import os
+import time
+from collections import namedtuple
+
+FileEntry = namedtuple("FileEntry", ["name", "path", "mtime", "size"])
+# keys that pick the highlighted file, space is kept for the old menus
+SELECT_KEYS = {ord("\n"), ord("\r"), ord(" "), curses.KEY_ENTER}
+CANCEL_KEY = 27
+BACKSPACE_KEYS = {curses.KEY_BACKSPACE, 127, 8}
+
+class FileIndex:
+    """
+    Searchable listing of a directory, built with one os.scandir
+        Names are kept sorted and lowercased for bisecting prefixes, and
+        each character maps to the set of names containing it, so a fuzzy
+        query only checks names that have all of its characters. Results
+        are kept per query, typing one more character only filters the
+        results of the shorter query and backspace is a lookup.
+    """
+    def __init__(self, path: str, file_extension: str = ".html") -> None:
+        self.path = path
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.endswith(file_extension) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append(FileEntry(entry.name, os.path.join(path, entry.name), stat.st_mtime, stat.st_size))
+        self.entries = sorted(entries, key=lambda entry: entry.name.lower())
+        self.keys = [entry.name.lower() for entry in self.entries]
+        self.chars = {}
+        for i, key in enumerate(self.keys):
+            for char in set(key):
+                self.chars.setdefault(char, set()).add(i)
+        self.results = {"": list(range(len(self.entries)))}
+    def prefix(self, query: str) -> list:
+        """
+        Find the names starting with the query
+        @param query: the lowercased query
+        @return: the entry indices, in name order
+        """
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + "\uffff")
+        return list(range(start, end))
+    def candidates(self, query: str) -> list:
+        """
+        Get the entries that can still match the query
+        @param query: the lowercased query
+        @return: the entry indices, in name order
+        """
+        if query[:-1] in self.results:
+            return sorted(self.results[query[:-1]])
+        sets = [self.chars.get(char, set()) for char in set(query)]
+        return sorted(set.intersection(*sets)) if sets else list(range(len(self.entries)))
+    def search(self, query: str) -> list:
+        """
+        Find the entries matching the query
+            Names starting with the query come first, then names containing
+            it, then names containing its characters in order.
+        @param query: the query
+        @return: the matching entries
+        """
+        query = query.lower()
+        if query not in self.results:
+            prefix = self.prefix(query)
+            first = set(prefix)
+            contains = []
+            fuzzy = []
+            for i in self.candidates(query):
+                if i in first:
+                    continue
+                key = self.keys[i]
+                if query in key:
+                    contains.append(i)
+                elif is_subsequence(query, key):
+                    fuzzy.append(i)
+            # prefix, contains and fuzzy matches are all in name order
+            self.results[query] = prefix + contains + fuzzy
+        return [self.entries[i] for i in self.results[query]]
+
+def is_subsequence(query: str, text: str) -> bool:
+    position = 0
+    for char in query:
+        position = text.find(char, position) + 1
+        if position == 0:
+            return False
+    return True
+
+def format_entry(entry: FileEntry, width: int) -> str:
+    """
+    Format a file for its line, the name is cut before the size and date
+    @param entry: the file
+    @param width: the line width
+    @return: the line
+    """
+    size = f"{entry.size / 1024:.0f}K" if entry.size >= 1024 else f"{entry.size}B"
+    info = f"{size:>6} {time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.mtime))}"
+    space = width - len(info) - 3
+    if space < 8:
+        return f"  {entry.name}"[:width]
+    return f"  {entry.name[:space]:<{space}} {info}"
+
+class Picker:
+    """
+    File picker that only draws the visible part of the list
+        Remembers the text of every screen line and only rewrites the
+        lines that changed, so moving the selection redraws two lines.
+    """
+    def __init__(self, stdscr, title: str, index: FileIndex) -> None:
+        self.stdscr = stdscr
+        self.title = title
+        self.index = index
+        self.query = ""
+        self.matches = index.search("")
+        self.selected = 0
+        self.top = 0
+        self.drawn = {}
+    def set_query(self, query: str) -> None:
+        self.query = query
+        self.matches = self.index.search(query)
+        self.selected = 0
+        self.top = 0
+    def move(self, step: int) -> None:
+        if self.matches:
+            self.selected = min(max(self.selected + step, 0), len(self.matches) - 1)
+    def lines(self, height: int, width: int) -> list:
+        """
+        Build the text and attributes of every screen line
+        @param height: the screen height
+        @param width: the screen width
+        @return: (text, attribute) per line
+        """
+        rows = max(1, height - 3)
+        # scroll just enough to keep the selection visible
+        if self.selected < self.top:
+            self.top = self.selected
+        elif self.selected >= self.top + rows:
+            self.top = self.selected - rows + 1
+        lines = [(self.title, curses.A_BOLD),
+                 (f"Search: {self.query}", 0),
+                 (f"{len(self.matches)}/{len(self.index.entries)} files, type to filter, enter to select, esc to go back", curses.A_DIM)]
+        for i in range(self.top, self.top + rows):
+            if i < len(self.matches):
+                lines.append((format_entry(self.matches[i], width - 1), curses.A_REVERSE if i == self.selected else 0))
+            else:
+                lines.append(("", 0))
+        return lines[:height]
+    def draw(self) -> None:
+        height, width = self.stdscr.getmaxyx()
+        if self.drawn.get("size") != (height, width):
+            self.stdscr.clear()
+            self.drawn = {"size": (height, width)}
+        for row, (text, attribute) in enumerate(self.lines(height, width)):
+            if self.drawn.get(row) == (text, attribute):
+                continue
+            self.stdscr.move(row, 0)
+            self.stdscr.clrtoeol()
+            # never write the last column, curses errors on the bottom right corner
+            self.stdscr.addnstr(row, 0, text, width - 1, attribute)
+            self.drawn[row] = (text, attribute)
+        self.stdscr.refresh()
+    def run(self) -> str:
+        """
+        Let the user pick a file
+        @return: the path of the file, None when cancelled
+        """
+        curses.noecho()
+        height = self.stdscr.getmaxyx()[0]
+        while True:
+            self.draw()
+            key = self.stdscr.getch()
+            if key in SELECT_KEYS:
+                if self.matches:
+                    return self.matches[self.selected].path
+            elif key == CANCEL_KEY:
+                if not self.query:
+                    return None
+                self.set_query("")
+            elif key == curses.KEY_DOWN:
+                self.move(1)
+            elif key == curses.KEY_UP:
+                self.move(-1)
+            elif key == curses.KEY_NPAGE:
+                self.move(height - 3)
+            elif key == curses.KEY_PPAGE:
+                self.move(-(height - 3))
+            elif key == curses.KEY_HOME:
+                self.move(-len(self.matches))
+            elif key == curses.KEY_END:
+                self.move(len(self.matches))
+            elif key in BACKSPACE_KEYS:
+                self.set_query(self.query[:-1])
+            elif key == curses.KEY_RESIZE:
+                height = self.stdscr.getmaxyx()[0]
+            elif 32 < key < 127:
+                self.set_query(self.query + chr(key))
@@ -0,0 +1,74 @@
+import hashlib
+from array import array
+from collections import OrderedDict
+
+def token_hash(tokens) -> str:
+    """
+    Hash a sequence of token ids
+    @param tokens: the token ids
+    @return: the hex digest
+    """
+    return hashlib.blake2b(array("q", tokens).tobytes(), digest_size=16).hexdigest()
+
+def common_prefix(a, b) -> int:
+    """
+    Length of the common prefix of two token sequences
+    @param a: the first sequence
+    @param b: the second sequence
+    @return: the number of leading tokens they share
+    """
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+class PrefixCache:
+    """
+    LRU cache of model state for evaluated prompt prefixes
+        Keyed by the hash of the prefix tokens. The state is whatever the
+        backend needs to continue from the prefix (the KV cache for GPTQ).
+    """
+    def __init__(self, max_entries: int = 2) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+    def lookup(self, tokens) -> tuple:
+        """
+        Find the longest cached prefix of the tokens
+            At least one token is always left to evaluate, the model needs it
+            for the next token logits.
+        @param tokens: the prompt token ids
+        @return: (prefix length, state), (0, None) on a miss
+        """
+        lengths = sorted(set(length for length, _ in self.entries.values()), reverse=True)
+        for length in lengths:
+            if length >= len(tokens):
+                continue
+            key = token_hash(tokens[:length])
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.reused_tokens += length
+                return self.entries[key]
+        self.misses += 1
+        return 0, None
+    def store(self, tokens, state) -> None:
+        """
+        Remember the state after evaluating the tokens
+        @param tokens: the prefix token ids
+        @param state: the backend state for the prefix
+        """
+        key = token_hash(tokens)
+        self.entries[key] = (len(tokens), state)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    def stats(self) -> dict:
+        """
+        Get the cache counters
+        @return: the counters
+        """
+        return {"hits": self.hits, "misses": self.misses, "reused_tokens": self.reused_tokens, "entries": len(self.entries)}
@@ -0,0 +1,55 @@
+import json
+import re
+
+# the job sections whose terms a good letter should mention
+RANKED_SECTIONS = ["Requirements", "Qualifications"]
+# letters inside this many words aren't penalized for their length
+LETTER_WORDS = (250, 450)
+# score lost per 100 words outside LETTER_WORDS
+LENGTH_PENALTY = 0.1
+WORD = re.compile(r"[a-z][a-z0-9+#./-]*[a-z0-9+#]|[a-z]")
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "have", "in", "is", "it", "of", "on", "or", "our",
+             "that", "the", "this", "to", "we", "will", "with", "you", "your", "years", "year", "experience", "ability", "strong",
+             "working", "knowledge", "understanding", "plus", "etc", "including", "related", "skills", "who", "can", "able"}
+
+def words(text: str) -> list:
+    return WORD.findall(text.lower())
+
+def requirement_terms(job_description) -> set:
+    """
+    Collect the terms of the job's requirements and qualifications
+    @param job_description: the decomposed job description, JSON or its sections
+    @return: the lowercased terms
+    """
+    job = json.loads(job_description) if isinstance(job_description, str) else job_description
+    terms = set()
+    for section in RANKED_SECTIONS:
+        for item in job.get(section, []):
+            text = item if isinstance(item, str) else " ".join([item.get("title", "")] + item.get("description", []))
+            terms.update(word for word in words(text) if len(word) > 2 and word not in STOPWORDS)
+    return terms
+
+def score_letter(letter: str, terms: set) -> tuple:
+    """
+    Score a letter by the job terms it covers, minus a penalty for its length
+    @param letter: the cover letter
+    @param terms: the job terms, see requirement_terms
+    @return: (score, coverage, word count)
+    """
+    letter_words = words(letter)
+    coverage = len(terms.intersection(letter_words)) / len(terms) if terms else 0.0
+    count = len(letter_words)
+    outside = max(LETTER_WORDS[0] - count, count - LETTER_WORDS[1], 0)
+    return coverage - LENGTH_PENALTY * outside / 100, coverage, count
+
+def rank_letters(letters: list, job_description) -> list:
+    """
+    Order candidate letters best first
+        Letters with the same score keep their order
+    @param letters: the cover letters
+    @param job_description: the decomposed job description
+    @return: (letter, score, coverage, word count) tuples, best first
+    """
+    terms = requirement_terms(job_description)
+    scored = [(letter,) + score_letter(letter, terms) for letter in letters]
+    return sorted(scored, key=lambda entry: -entry[1])
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.ranker import STOPWORDS, words
+
+# the resume sections whose entries are pruned
+PRUNED_SECTIONS = ["Projects", "Experience/Activities"]
+# the job sections the entries are scored against
+QUERY_SECTIONS = ["Requirements", "Qualifications", "Responsibilities"]
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+# resumes whose index is kept, a batch run reuses one per resume
+MAX_INDEXES = 32
+
+def terms(text: str) -> list:
+    return [word for word in words(text) if len(word) > 1 and word not in STOPWORDS]
+
+def entry_text(entry) -> str:
+    if isinstance(entry, dict):
+        return " ".join([entry.get("title", "")] + entry.get("description", []))
+    return str(entry)
+
+def entry_title(entry) -> str:
+    return entry.get("title", "").strip() if isinstance(entry, dict) else str(entry).strip()
+
+class ResumeIndex:
+    """
+    BM25 weights of every prunable resume entry, built once per resume
+        The resume's vocabulary maps terms to columns. Each entry's row holds
+        its BM25 weight per term, so scoring a job is one bincount of its
+        terms and one matrix product.
+    """
+    def __init__(self, resume: dict) -> None:
+        self.entries = [(section, i) for section in PRUNED_SECTIONS for i in range(len(resume.get(section, [])))]
+        documents = [terms(entry_text(resume[section][i])) for section, i in self.entries]
+        self.vocabulary = {}
+        for document in documents:
+            for term in document:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+        counts = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            if document:
+                counts[row] = np.bincount([self.vocabulary[term] for term in document], minlength=len(self.vocabulary))
+        lengths = counts.sum(axis=1, keepdims=True)
+        average = max(float(lengths.mean()), 1.0) if len(documents) else 1.0
+        frequency = (counts > 0).sum(axis=0)
+        idf = np.log(1.0 + (len(documents) - frequency + 0.5) / (frequency + 0.5)).astype(np.float32)
+        self.weights = idf * counts * (K1 + 1) / (counts + K1 * (1 - B + B * lengths / average))
+    def scores(self, job: dict) -> np.ndarray:
+        """
+        Score every entry against the job
+        @param job: the job sections
+        @return: the BM25 score per entry, in self.entries order
+        """
+        query = [self.vocabulary[term] for section in QUERY_SECTIONS for item in job.get(section, []) for term in terms(entry_text(item)) if term in self.vocabulary]
+        if not query or not self.entries:
+            return np.zeros(len(self.entries), dtype=np.float32)
+        # a term asked for twice counts once, the job repeating itself shouldn't outweigh coverage
+        return self.weights @ (np.bincount(query, minlength=len(self.vocabulary)) > 0).astype(np.float32)
+
+indexes = OrderedDict()
+# batch threads share the indexes
+indexes_lock = threading.Lock()
+
+def resume_index(resume: str) -> ResumeIndex:
+    """
+    Get the index of a resume, building it on first use
+    @param resume: the decomposed resume JSON
+    @return: the index
+    """
+    key = hashlib.sha256(resume.encode("utf-8")).hexdigest()
+    with indexes_lock:
+        if key in indexes:
+            indexes.move_to_end(key)
+            return indexes[key]
+    index = ResumeIndex(json.loads(resume))
+    with indexes_lock:
+        indexes[key] = index
+        while len(indexes) > MAX_INDEXES:
+            indexes.popitem(last=False)
+    return index
+
+def prune_resume(resume: str, job: str, top_k: int = None, threshold: float = None) -> tuple:
+    """
+    Leave out the resume entries least relevant to the job
+        Entries are kept when they are among the top_k of their section
+        and score at least threshold times the best entry of the resume.
+        Every section keeps its best entry, and kept entries stay in order.
+    @param resume: the decomposed resume JSON
+    @param job: the decomposed job description JSON
+    @param top_k: the most entries kept per section, None for no limit
+    @param threshold: the least score relative to the best entry, None for no limit
+    @return: (resume JSON, titles of the entries left out)
+    """
+    if top_k is None and threshold is None:
+        return resume, []
+    index = resume_index(resume)
+    scores = index.scores(json.loads(job))
+    best = float(scores.max()) if len(scores) else 0.0
+    data = json.loads(resume)
+    dropped = []
+    for section in PRUNED_SECTIONS:
+        rows = [row for row, (name, _) in enumerate(index.entries) if name == section]
+        if not rows:
+            continue
+        ranked = sorted(rows, key=lambda row: -scores[row])
+        keep = set(ranked[:top_k] if top_k is not None else ranked)
+        if threshold is not None and best > 0:
+            keep = {row for row in keep if scores[row] >= threshold * best}
+        keep.add(ranked[0])
+        entries = data[section]
+        data[section] = [entries[index.entries[row][1]] for row in rows if row in keep]
+        dropped += [entry_title(entries[index.entries[row][1]]) for row in rows if row not in keep]
+    return json.dumps(data, indent=4), dropped
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator
+from utils.inference import BasicConfig, BasicSettings, Inference
+from utils.stopping import timed_out, watch_deadlines
+
+RESULT_CACHE_PATH = "assets/cache/results.sqlite"
+MAX_RESULT_BYTES = 64 * 1024 * 1024
+
+def result_key(model_id: str, prompt: str, settings: BasicSettings) -> str:
+    """
+    Build the cache key of a generation
+        Only what changes the generated text is part of the key
+    @param model_id: the model weights, see Inference.model_id
+    @param prompt: the prompt
+    @param settings: the settings it is generated with
+    @return: the hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model_id, settings.max_new_tokens, settings.repetition_penalty, settings.seed, settings.stop, settings.stop_at_signoff]).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(str(prompt).encode("utf-8"))
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    SQLite store of generated cover letters
+        Each row keeps the time it was last read, the least recently used
+        rows are deleted once the stored text grows past max_bytes.
+    """
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_bytes: int = MAX_RESULT_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # shared by the server's threads, the lock serializes them
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.db.commit()
+    def get(self, key: str) -> str:
+        """
+        Get a stored result and mark it as recently used
+        @param key: the result key
+        @return: the text, None on a miss
+        """
+        with self.lock:
+            row = self.db.execute("SELECT text FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+            return row[0]
+    def put(self, key: str, text: str) -> None:
+        """
+        Store a result and evict the least recently used ones over the size bound
+        @param key: the result key
+        @param text: the generated text
+        """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO results (key, text, size, used) VALUES (?, ?, ?, ?)", (key, text, len(text.encode("utf-8")), time.time()))
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in self.db.execute("SELECT key, size FROM results WHERE key != ? ORDER BY used", (key,)).fetchall():
+                    self.db.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                    self.evictions += 1
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            self.db.commit()
+    def stats(self) -> dict:
+        """
+        Get the cache counters
+        @return: the counters
+        """
+        with self.lock:
+            entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": entries, "bytes": size}
+    def close(self) -> None:
+        self.db.close()
+
+class CachedInference(Inference):
+    """
+    Inference wrapper that answers repeated generations from a ResultCache
+        A prompt generated again with the same model and settings returns
+        the stored letter. Set a seed in the settings for the stored letter
+        to be the one the model would generate again. With bypass set, the
+        cache is not read but new letters are still stored, to regenerate.
+        Letters cut at the settings' deadline are returned but not stored.
+    """
+    def __init__(self, inference: Inference, cache: ResultCache = None, bypass: bool = False) -> None:
+        self.inference = inference
+        self.cache = ResultCache() if cache is None else cache
+        self.bypass = bypass
+    @property
+    def metrics(self):
+        return self.inference.metrics
+    @metrics.setter
+    def metrics(self, metrics) -> None:
+        self.inference.metrics = metrics
+    def key(self, prompt: str) -> str:
+        return result_key(self.inference.model_id(), prompt, self.inference.get_config().settings)
+    def lookup(self, prompt: str) -> tuple:
+        """
+        Look a prompt up unless bypassed
+        @param prompt: the prompt
+        @return: (key, stored text or None)
+        """
+        key = self.key(prompt)
+        return key, (None if self.bypass else self.cache.get(key))
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        self.inference.set_max_new_tokens(max_new_tokens)
+    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        self.inference.set_repetition_penalty(repetition_penalty)
+    def set_config(self, config: BasicConfig) -> None:
+        self.inference.set_config(config)
+    def get_config(self) -> BasicConfig:
+        return self.inference.get_config()
+    def model_id(self) -> str:
+        return self.inference.model_id()
+    def count_tokens(self, text: str) -> int:
+        return self.inference.count_tokens(text)
+    def context_length(self) -> int:
+        return self.inference.context_length()
+    def generate(self, prompt: str) -> str:
+        """
+        Generate the cover letter, or return the stored one
+        @param prompt: the prompt for the model
+        @return: the cover letter
+        """
+        key, text = self.lookup(prompt)
+        if text is None:
+            with watch_deadlines() as stoppers:
+                text = self.inference.generate(prompt)
+            if not timed_out(stoppers):
+                self.cache.put(key, text)
+        return text
+    def generate_batch(self, prompts: list) -> list:
+        """
+        Generate the cover letters that aren't stored in one batch
+        @param prompts: the prompts for the model
+        @return: the cover letters, in prompt order
+        """
+        lookups = [self.lookup(prompt) for prompt in prompts]
+        missing = [i for i, (_, text) in enumerate(lookups) if text is None]
+        letters = [text for _, text in lookups]
+        if missing:
+            with watch_deadlines() as stoppers:
+                texts = self.inference.generate_batch([prompts[i] for i in missing])
+            for i, text in zip(missing, texts):
+                letters[i] = text
+            # backends may order the rows, a batch cut at the deadline isn't stored at all
+            if not timed_out(stoppers):
+                for i in missing:
+                    self.cache.put(lookups[i][0], letters[i])
+        return letters
+    def generate_candidates(self, prompt: str, n: int) -> list:
+        """
+        Generate several cover letters, never from the cache
+            Candidates are there to be different, they aren't stored
+        @param prompt: the prompt for the model
+        @param n: the number of letters
+        @return: the generated cover letters
+        """
+        return self.inference.generate_candidates(prompt, n)
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Stream the cover letter, a stored one comes as a single chunk
+            A stream that isn't read to the end or was cut at the deadline isn't stored
+        @param prompt: the prompt for the model
+        @return: an iterator over the text chunks
+        """
+        key, text = self.lookup(prompt)
+        if text is not None:
+            yield text
+            return
+        chunks = []
+        with watch_deadlines() as stoppers:
+            for chunk in self.inference.stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+        if not timed_out(stoppers):
+            self.cache.put(key, "".join(chunks))
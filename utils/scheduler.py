@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from utils.inference import Inference
+
+class MicroBatcher:
+    """
+    Groups generate requests from many threads into generate_batch calls
+        The first waiting request opens a window. Requests that arrive
+        within it join the same batch, up to max_batch. Callers block on
+        generate as if they had the model to themselves.
+    """
+    def __init__(self, inference: Inference, max_batch: int = 4, window: float = 0.05) -> None:
+        self.inference = inference
+        self.max_batch = max_batch
+        self.window = window
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.prompts = 0
+        # seconds spent inside generate_batch
+        self.busy_seconds = 0.0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+    def submit(self, prompt: str) -> Future:
+        """
+        Queue a prompt
+        @param prompt: the prompt for the model
+        @return: a future for the generated cover letter
+        """
+        future = Future()
+        self.requests.put((prompt, future))
+        return future
+    def generate(self, prompt: str) -> str:
+        """
+        Generate a cover letter as part of the next batch
+        @param prompt: the prompt for the model
+        @return: the generated cover letter
+        """
+        return self.submit(prompt).result()
+    def collect(self) -> list:
+        """
+        Wait for a request, then gather more until the window closes or the batch is full
+        @return: the (prompt, future) pairs, None once closed
+        """
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, then stop
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+    def run(self) -> None:
+        while True:
+            batch = self.collect()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                letters = self.inference.generate_batch([prompt for prompt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.prompts += len(batch)
+            for (_, future), letter in zip(batch, letters):
+                future.set_result(letter)
+    def close(self) -> None:
+        """
+        Stop once the queued requests are done
+        """
+        self.requests.put(None)
+        self.worker.join()
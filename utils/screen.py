@@ -1,6 +1,13 @@
 import curses
-from utils.decompose import decompose_job, decompose_resume
-from utils.inference import Inference, build_prompt, load_config
+from utils.cache import get_decompose_cache
+from utils.budget import fit_prompt
+from utils.bulk import decompose_all
+from utils.encoding import ENCODINGS
+from utils.inference import Inference, load_config
+from utils.metrics import MetricsLog, RunMetrics
+from utils.picker import FileIndex, Picker
+from utils.ranker import rank_letters
+from utils.worker import GenerationWorker
 import os
 
 RESUME_PATH = "assets/resumes/"
@@ -8,53 +15,29 @@ JOB_PATH = "assets/jobs/"
 CONFIG_PATH = "assets/configs/"
 OUTPUT_FILE = "output/cover-letter.md"
 DEFAULT_CONFIG = "default.json"
+# keys that stop a generation, escape or c
+CANCEL_KEYS = {27, ord("c")}
+# how runs that didn't finish are reported
+FINISHED = {"cancelled": "Cancelled", "timeout": "Stopped at the deadline"}
 
 def select_file(stdscr, title: str, path: str, file_extension=".html") -> str:
     """
     Select a file from the given path
+        Type to filter the list, escape clears the filter or goes back
     @param stdscr: the curses screen
     @param title: the title of the file selection
     @param path: the path to select the file from
     @param file_extension: the file extension to select
-    @return: the selected file
+    @return: the selected file, None when the user goes back
     """
-    stdscr.clear()
-    stdscr.addstr(title + "\n")
-    stdscr.addstr("Select a file:\n")
-
-    files = [f for f in os.listdir(path) if file_extension in f]
+    return Picker(stdscr, title, FileIndex(path, file_extension)).run()
 
-    selected_index = 0
-    
-    while True:
-        stdscr.clear()
-        stdscr.addstr(title + "\n")
-        stdscr.addstr("Select a file:\n")
-        
-        for index, file in enumerate(files):
-            if index == selected_index:
-                stdscr.addstr(f"> {file}\n")
-            else:
-                stdscr.addstr(f"  {file}\n")
-        
-        stdscr.refresh()
-        
-        key = stdscr.getch()
-        
-        if key == curses.KEY_DOWN:
-            selected_index = (selected_index + 1) % len(files)
-        elif key == curses.KEY_UP:
-            selected_index = (selected_index - 1) % len(files)
-        elif key == ord(' ') or key == ord('\n') or key == curses.KEY_Enter:  # Spacebar to select
-            return os.path.join(path, files[selected_index])
-        else:
-            pass
-        
-def generate_cover_letter(stdscr, inference: Inference):
+def generate_cover_letter(stdscr, inference: Inference, metrics_log: MetricsLog = None):
     """
     Generate the cover letter
     @param stdscr: the curses screen
     @param inference: the inference object
+    @param metrics_log: where to record the stage timings, not recorded when None
     """
     curses.echo()
     details = {}
@@ -88,11 +71,19 @@ def generate_cover_letter(stdscr, inference: Inference):
     curses.noecho()
     
     job_path = select_file(stdscr, "Job Description", JOB_PATH)
+    if job_path is None:
+        return
 
-    with open(job_path, "r") as f:
-        html_content = f.read()
+    config = inference.get_config()
+    metrics = RunMetrics()
+    metrics.labels = {"model": inference.model_id(), "config": config.config_name}
+    with metrics.stage("read_job"):
+        with open(job_path, "r") as f:
+            html_content = f.read()
 
-    job = decompose_job(html_content)
+    # parsing happens inside decompose, and not at all on a cache hit
+    with metrics.stage("decompose_job"):
+        job = get_decompose_cache().decompose_job(html_content, config.job.headers)
 
     if job is None or job == "{}":
         stdscr.addstr("Could not decompose job description, exiting...")
@@ -101,11 +92,15 @@ def generate_cover_letter(stdscr, inference: Inference):
         return
 
     resume_path = select_file(stdscr, "Resume", RESUME_PATH)
+    if resume_path is None:
+        return
 
-    with open(resume_path, "r") as f:
-        html_content = f.read()
+    with metrics.stage("read_resume"):
+        with open(resume_path, "r") as f:
+            html_content = f.read()
 
-    resume = decompose_resume(html_content)
+    with metrics.stage("decompose_resume"):
+        resume = get_decompose_cache().decompose_resume(html_content, config.resume.tags)
 
     if resume is None or resume == "{}":
         stdscr.addstr("Could not decompose resume, exiting...")
@@ -113,28 +108,174 @@ def generate_cover_letter(stdscr, inference: Inference):
         stdscr.getch()
         return
 
+    duplicates = None
+    if config.settings.duplicate_threshold is not None:
+        from utils.dedupe import DuplicateIndex
+        duplicates = DuplicateIndex(threshold=config.settings.duplicate_threshold)
+        duplicates.add(job_path, job)
+        duplicate = duplicates.find_letter(job, resume, exclude=job_path)
+        if duplicate is not None:
+            stdscr.addstr(f"{os.path.basename(duplicate.job)} is {duplicate.similarity:.0%} similar to this job and has a cover letter for this resume. Reuse it? (y/n) ")
+            stdscr.refresh()
+            if stdscr.getch() in (ord("y"), ord("Y")):
+                letter = duplicate.adapt(details)
+                with open(OUTPUT_FILE, "w") as f:
+                    f.write(letter)
+                stdscr.clear()
+                stdscr.scrollok(True)
+                stdscr.addstr(letter)
+                stdscr.addstr("\n\nCover letter reused and saved as 'cover-letter.md'. Press any key to exit.")
+                stdscr.refresh()
+                stdscr.getch()
+                return
+            stdscr.addstr("\n")
+
     stdscr.addstr("Generating prompt...\n")
     stdscr.refresh()
-    prompt = build_prompt(job, resume, details)
+    try:
+        with metrics.stage("build_prompt"):
+            prompt, trimmed = fit_prompt(job, resume, details, inference)
+    except Exception as e:
+        stdscr.addstr(f"{e}, exiting...")
+        stdscr.refresh()
+        stdscr.getch()
+        return
+    if trimmed:
+        stdscr.addstr(f"Left out {len(trimmed)} items to fit the model's context, starting with {trimmed[0]}\n")
+    if config.settings.candidates > 1:
+        generate_candidates(stdscr, inference, prompt, job, metrics, metrics_log)
+        if duplicates is not None:
+            with open(OUTPUT_FILE, "r") as f:
+                duplicates.save_letter(job_path, resume, details, f.read())
+        return
     stdscr.addstr("Generating cover letter...\n")
     stdscr.refresh()
-    cover_letter = inference.generate(prompt)
+    inference.metrics = metrics
+    worker = GenerationWorker(inference, prompt, config.settings.deadline)
+    try:
+        with metrics.stage("generate"):
+            letter = show_generation(stdscr, worker, metrics)
+    finally:
+        inference.metrics = None
+    metrics.finish()
+    if metrics_log is not None:
+        metrics_log.write(metrics)
+    if duplicates is not None and worker.status == "done":
+        duplicates.save_letter(job_path, resume, details, worker.text())
+
+    letter.addstr("\n\n" + "\n".join(metrics.summary()))
+    if worker.status == "error":
+        letter.addstr(f"\nGeneration failed: {worker.error}")
+    elif worker.status in FINISHED:
+        letter.addstr(f"\n{FINISHED[worker.status]}, the partial cover letter is saved as 'cover-letter.md'.")
+    else:
+        letter.addstr("\nCover letter generated and saved as 'cover-letter.md'.")
+    letter.addstr(" Press any key to exit.")
+    letter.refresh()
+    stdscr.getch()
 
-    stdscr.addstr("Saving cover letter...\n")
+def show_generation(stdscr, worker: GenerationWorker, metrics: RunMetrics):
+    """
+    Run the worker and show the letter as it is decoded, keeping what we have on disk
+        The bottom line shows the progress, esc or c cancels the generation
+    @param stdscr: the curses screen
+    @param worker: the worker, started here
+    @param metrics: the run metrics, chunks are recorded here
+    @return: the window the letter was written in
+    """
+    height, width = stdscr.getmaxyx()
+    top = stdscr.getyx()[0]
+    # the letter scrolls above the progress line
+    letter = stdscr.derwin(max(height - top - 1, 1), width, top, 0)
+    letter.scrollok(True)
+    stdscr.nodelay(True)
+    worker.start()
+    try:
+        with open(OUTPUT_FILE, "w") as f:
+            while not worker.finished():
+                chunks = worker.take()
+                for chunk in chunks:
+                    metrics.chunk()
+                    f.write(chunk)
+                    letter.addstr(chunk)
+                if chunks:
+                    f.flush()
+                if worker.expired():
+                    worker.cancel("timeout")
+                if stdscr.getch() in CANCEL_KEYS:
+                    worker.cancel()
+                tokens = len(metrics.times())
+                elapsed = worker.elapsed()
+                state = "stopping..." if worker.cancelled.is_set() else "esc to cancel"
+                progress = f" {tokens} {'tokens' if metrics.token_times else 'chunks'}  {elapsed:.1f}s  {tokens / elapsed if elapsed else 0:.1f}/s  {state}"
+                stdscr.addnstr(height - 1, 0, progress.ljust(width - 1), width - 1, curses.A_REVERSE)
+                stdscr.noutrefresh()
+                letter.noutrefresh()
+                curses.doupdate()
+    finally:
+        stdscr.nodelay(False)
+    return letter
+
+def generate_candidates(stdscr, inference: Inference, prompt: str, job: str, metrics: RunMetrics, metrics_log: MetricsLog = None):
+    """
+    Generate several cover letters from one prompt and show them best first
+        Every candidate is saved as cover-letter-<rank>.md and the best one
+        as cover-letter.md, enter keeps the shown one instead
+    @param stdscr: the curses screen
+    @param inference: the inference object
+    @param prompt: the prompt
+    @param job: the decomposed job description, the letters are ranked against it
+    @param metrics: the run metrics
+    @param metrics_log: where to record the stage timings, not recorded when None
+    """
+    n = inference.get_config().settings.candidates
+    stdscr.addstr(f"Generating {n} cover letters...\n")
+    stdscr.refresh()
+    with metrics.stage("generate"):
+        letters = inference.generate_candidates(prompt, n)
+    with metrics.stage("rank"):
+        ranked = rank_letters(letters, job)
+    metrics.finish()
+    if metrics_log is not None:
+        metrics_log.write(metrics)
+    base, extension = os.path.splitext(OUTPUT_FILE)
+    for rank, (letter, _, _, _) in enumerate(ranked, 1):
+        with open(f"{base}-{rank}{extension}", "w") as f:
+            f.write(letter)
     with open(OUTPUT_FILE, "w") as f:
-        f.write(cover_letter)
+        f.write(ranked[0][0])
 
-    stdscr.addstr("Cover letter generated and saved as 'cover-letter.md'. Press any key to exit.")
-    stdscr.refresh()
-    stdscr.getch()
+    stdscr.scrollok(True)
+    shown = 0
+    while True:
+        letter, score, coverage, count = ranked[shown]
+        stdscr.clear()
+        stdscr.addstr(f"Candidate {shown + 1}/{len(ranked)}: score {score:.2f}, covers {coverage * 100:.0f}% of the requirements, {count} words\n\n")
+        stdscr.addstr(letter)
+        stdscr.addstr("\n\n" + "\n".join(metrics.summary()))
+        stdscr.addstr("\nLeft and right to switch, enter to keep this one as 'cover-letter.md', any other key to exit.")
+        stdscr.refresh()
+        key = stdscr.getch()
+        if key == curses.KEY_RIGHT:
+            shown = (shown + 1) % len(ranked)
+        elif key == curses.KEY_LEFT:
+            shown = (shown - 1) % len(ranked)
+        elif key == ord('\n') or key == curses.KEY_ENTER:
+            with open(OUTPUT_FILE, "w") as f:
+                f.write(letter)
+            return
+        else:
+            return
 
-def render_decompose(stdscr):
+def render_decompose(stdscr, inference: Inference):
     '''
     Render the decompose menu
         Up and down arrow keys to select
         Spacebar to select
+    @param stdscr: the curses screen
+    @param inference: the inference object, its config picks the headers and tags
     '''
-    options = ["Resume", "Job Description", "Back"]
+    options = ["Resume", "Job Description", "All", "Back"]
     selected_index = 0
 
     while True:
@@ -160,9 +301,11 @@ def render_decompose(stdscr):
             if selected_index == 0:
                 # decompose resume
                 file = select_file(stdscr, "Resume", RESUME_PATH)
+                if file is None:
+                    continue
                 with open(file, "r") as f:
                     html_content = f.read()
-                resume = decompose_resume(html_content)
+                resume = get_decompose_cache().decompose_resume(html_content, inference.get_config().resume.tags)
                 if resume is None or resume == "{}":
                     stdscr.addstr("Could not decompose resume, exiting...")
                     stdscr.refresh()
@@ -174,9 +317,11 @@ def render_decompose(stdscr):
             elif selected_index == 1:
                 # decompose job description
                 file = select_file(stdscr, "Job Description", JOB_PATH)
+                if file is None:
+                    continue
                 with open(file, "r") as f:
                     html_content = f.read()
-                job = decompose_job(html_content)
+                job = get_decompose_cache().decompose_job(html_content, inference.get_config().job.headers)
                 if job is None or job == "{}":
                     stdscr.addstr(f"Could not decompose job description: {'empty decompose' if job == '{}' else 'decompose is none'}, exiting...")
                     stdscr.refresh()
@@ -186,6 +331,21 @@ def render_decompose(stdscr):
                 with open(file.replace(".html", ".json"), "w") as f:
                     f.write(job)
             elif selected_index == 2:
+                # decompose every file that changed since the last run
+                stdscr.clear()
+                stdscr.scrollok(True)
+                stdscr.addstr("Decomposing all job descriptions and resumes...\n")
+                stdscr.refresh()
+                def log(line: str) -> None:
+                    stdscr.addstr(line + "\n")
+                    stdscr.refresh()
+                config = inference.get_config()
+                from utils.dedupe import DuplicateIndex
+                summary = decompose_all(config.job.headers, config.resume.tags, JOB_PATH, RESUME_PATH, log=log, duplicates=DuplicateIndex())
+                stdscr.addstr(f"{summary}\nPress any key to continue.")
+                stdscr.refresh()
+                stdscr.getch()
+            elif selected_index == 3:
                 break
 
 def render_settings(stdscr, inference: Inference):
@@ -200,7 +360,7 @@ def render_settings(stdscr, inference: Inference):
     config = inference.get_config()
     configs = [f.replace(".json","") for f in os.listdir(CONFIG_PATH) if ".json" in f]
     current_config = config.config_name if config.config_name is not None else DEFAULT_CONFIG
-    options = [("Max New Tokens",config.settings.max_new_tokens), ("Repetition Penalty", config.settings.repetition_penalty), ("Config", current_config), ("Back", None)]
+    options = [("Max New Tokens",config.settings.max_new_tokens), ("Repetition Penalty", config.settings.repetition_penalty), ("Config", current_config), ("Prompt Encoding", config.settings.prompt_encoding), ("Candidates", config.settings.candidates), ("Back", None)]
     selected_index = 0
 
     while True:
@@ -244,6 +404,13 @@ def render_settings(stdscr, inference: Inference):
                 inference.set_config(config)
                 options[0] = (options[0][0], config.settings.max_new_tokens)
                 options[1] = (options[1][0], config.settings.repetition_penalty)
+                options[3] = (options[3][0], config.settings.prompt_encoding)
+                options[4] = (options[4][0], config.settings.candidates)
+            elif selected_index == 3:
+                current_index = ENCODINGS.index(options[selected_index][1])
+                options[selected_index] = (options[selected_index][0], ENCODINGS[(current_index - 1) % len(ENCODINGS)])
+            elif selected_index == 4:
+                options[selected_index] = (options[selected_index][0], max(options[selected_index][1] - 1, 1))
         elif key == curses.KEY_RIGHT:
             if selected_index == 0:
                 options[selected_index] = (options[selected_index][0], options[selected_index][1] + 10)
@@ -260,21 +427,35 @@ def render_settings(stdscr, inference: Inference):
                 inference.set_config(config)
                 options[0] = (options[0][0], config.settings.max_new_tokens)
                 options[1] = (options[1][0], config.settings.repetition_penalty)
+                options[3] = (options[3][0], config.settings.prompt_encoding)
+                options[4] = (options[4][0], config.settings.candidates)
+            elif selected_index == 3:
+                current_index = ENCODINGS.index(options[selected_index][1])
+                options[selected_index] = (options[selected_index][0], ENCODINGS[(current_index + 1) % len(ENCODINGS)])
+            elif selected_index == 4:
+                options[selected_index] = (options[selected_index][0], options[selected_index][1] + 1)
         elif key == ord(' ') or key == key == ord('\n') or key == curses.KEY_ENTER:
-            if selected_index == 3:
+            if selected_index == 5:
                 break
 
+    config = inference.get_config()
+    config.settings.prompt_encoding = options[3][1]
+    config.settings.candidates = options[4][1]
+    inference.set_config(config)
     inference.set_max_new_tokens(options[0][1])
     inference.set_repetition_penalty(options[1][1])
 
-def render_menu(stdscr, inference: Inference):
+def render_menu(stdscr, inference: Inference, metrics_log: MetricsLog = None):
     """
     Render the main menu
         Up and down arrow keys to select
         Spacebar to select
     @param stdscr: the curses screen
     @param inference: the inference object
+    @param metrics_log: where to record the metrics of each generation
     """
+    if metrics_log is None:
+        metrics_log = MetricsLog()
     options = ["Generate", "Decompose", "Settings", "Exit"]
     selected_index = 0
 
@@ -299,9 +480,9 @@ def render_menu(stdscr, inference: Inference):
             selected_index = (selected_index - 1) % len(options)
         elif key == ord(' ') or key == key == ord('\n') or key == curses.KEY_ENTER:
             if selected_index == 0:
-                generate_cover_letter(stdscr, inference)
+                generate_cover_letter(stdscr, inference, metrics_log)
             elif selected_index == 1:
-                render_decompose(stdscr)
+                render_decompose(stdscr, inference)
             elif selected_index == 2:
                 render_settings(stdscr, inference)
             elif selected_index == 3:
@@ -0,0 +1,314 @@
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from typing import Iterator
+from utils.inference import BasicConfig, Inference, Prompt, config_from_dict
+
+SOCKET_PATH = "assets/server.sock"
+# connections waiting to be accepted, socketserver's default of 5 turns away a busy batch's clients
+LISTEN_BACKLOG = 128
+# requests that only read state are answered without waiting for the model
+READ_METHODS = {"get_config", "stats", "model_id"}
+MODEL_METHODS = {"generate", "generate_candidates", "stream", "set_config", "set_max_new_tokens", "set_repetition_penalty", "count_tokens", "context_length"}
+
+def parse_address(address: str):
+    """
+    Turn an address into a socket family and address
+        "host:port" is a TCP address, anything else is a UNIX socket path
+    @param address: the address
+    @return: (family, address)
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+class _Request:
+    """
+    A request waiting for the model worker
+    """
+    def __init__(self, method: str, params: dict) -> None:
+        self.method = method
+        self.params = params
+        # chunks, then a final ("done", result) or ("error", message)
+        self.replies = queue.Queue()
+        self.cancelled = threading.Event()
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    One client connection, JSON lines in both directions
+    """
+    def reply(self, message: dict) -> None:
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+    def handle(self) -> None:
+        server = self.server.model_server
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+                method = message["method"]
+                params = message.get("params", {})
+            except (ValueError, KeyError, TypeError) as e:
+                self.reply({"error": f"Bad request: {e}"})
+                continue
+            if method in READ_METHODS:
+                self.reply({"result": server.read(method)})
+                continue
+            if method not in MODEL_METHODS:
+                self.reply({"error": f"Unknown method {method}"})
+                continue
+            request = server.submit(method, params)
+            try:
+                while True:
+                    kind, value = request.replies.get()
+                    if kind == "chunk":
+                        self.reply({"chunk": value})
+                    elif kind == "done":
+                        self.reply({"result": value})
+                        break
+                    else:
+                        self.reply({"error": value})
+                        break
+            except OSError:
+                # the client went away, stop generating for it
+                request.cancelled.set()
+                return
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # a UNIX socket client with a timeout fails at once when the backlog is full
+    request_queue_size = LISTEN_BACKLOG
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+class ModelServer:
+    """
+    Long lived server that owns one loaded Inference backend
+        Each client connection gets a thread, but every request that touches
+        the model goes through one queue and a single model thread, so
+        clients are served one at a time in arrival order. The config is
+        shared, a client changing it changes it for everyone.
+    """
+    def __init__(self, inference: Inference, address: str = SOCKET_PATH) -> None:
+        self.inference = inference
+        self.address = address
+        self.requests = queue.Queue()
+        self.served = 0
+        self.failed = 0
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.dirname(address):
+                os.makedirs(os.path.dirname(address), exist_ok=True)
+            if os.path.exists(address):
+                # a stale socket left by a server that didn't shut down cleanly
+                os.remove(address)
+            self.server = _UnixServer(bind_address, _Handler)
+        else:
+            self.server = _TCPServer(bind_address, _Handler)
+        self.server.model_server = self
+        self.worker = threading.Thread(target=self.model_worker, daemon=True)
+        self.worker.start()
+    def submit(self, method: str, params: dict) -> _Request:
+        """
+        Queue a request for the model thread
+        @param method: the Inference method
+        @param params: its parameters
+        @return: the queued request
+        """
+        request = _Request(method, params)
+        self.requests.put(request)
+        return request
+    def read(self, method: str):
+        """
+        Answer a request that doesn't need the model thread
+        @param method: the method
+        @return: the result
+        """
+        if method == "get_config":
+            config = self.inference.get_config()
+            return {"name": config.config_name, "config": config.to_dict()} if config is not None else None
+        if method == "model_id":
+            return self.inference.model_id()
+        return {"served": self.served, "failed": self.failed, "queued": self.requests.qsize()}
+    def model_worker(self) -> None:
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            try:
+                result = self.run(request)
+            except Exception as e:
+                self.failed += 1
+                request.replies.put(("error", str(e)))
+                continue
+            self.served += 1
+            request.replies.put(("done", result))
+    def run(self, request: _Request):
+        """
+        Run a request on the model
+        @param request: the request
+        @return: the result sent back to the client
+        """
+        params = request.params
+        if request.method == "set_config":
+            self.inference.set_config(config_from_dict(params["name"], params["config"]))
+        elif request.method == "set_max_new_tokens":
+            self.inference.set_max_new_tokens(params["max_new_tokens"])
+        elif request.method == "set_repetition_penalty":
+            self.inference.set_repetition_penalty(params["repetition_penalty"])
+        elif request.method == "count_tokens":
+            return self.inference.count_tokens(params["text"])
+        elif request.method == "context_length":
+            return self.inference.context_length()
+        else:
+            prompt = Prompt(params["prompt"], params.get("prefix", ""), params.get("signer", ""))
+            if request.method == "generate":
+                return self.inference.generate(prompt)
+            if request.method == "generate_candidates":
+                return self.inference.generate_candidates(prompt, params["n"])
+            chunks = self.inference.stream(prompt)
+            try:
+                for chunk in chunks:
+                    if request.cancelled.is_set():
+                        break
+                    request.replies.put(("chunk", chunk))
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+        return None
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+    def start(self) -> threading.Thread:
+        """
+        Serve from a background thread
+        @return: the thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.requests.put(None)
+        if self.server.address_family == socket.AF_UNIX and os.path.exists(self.address):
+            os.remove(self.address)
+
+class RemoteInference(Inference):
+    """
+    Inference client for a ModelServer
+        Each call opens its own connection, so one client can be shared
+        between threads.
+    """
+    def __init__(self, address: str = SOCKET_PATH, timeout: float = None) -> None:
+        self.address = address
+        self.timeout = timeout
+    def connect(self) -> socket.socket:
+        family, address = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(address)
+        return sock
+    def call(self, method: str, params: dict = None) -> Iterator[dict]:
+        """
+        Send a request and read its replies
+        @param method: the Inference method
+        @param params: its parameters
+        @return: an iterator over the reply messages, the last one has a result
+        """
+        with self.connect() as sock:
+            sock.sendall((json.dumps({"method": method, "params": params or {}}) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as replies:
+                for line in replies:
+                    message = json.loads(line)
+                    if "error" in message:
+                        raise Exception(message["error"])
+                    yield message
+                    if "result" in message:
+                        return
+        raise Exception(f"Connection to {self.address} closed before the reply")
+    def request(self, method: str, params: dict = None):
+        for message in self.call(method, params):
+            if "result" in message:
+                return message["result"]
+    def set_max_new_tokens(self, max_new_tokens: int) -> None:
+        """
+        Set the max new tokens on the server
+        @param max_new_tokens: the max new tokens
+        """
+        self.request("set_max_new_tokens", {"max_new_tokens": max_new_tokens})
+    def set_repetition_penalty(self, repetition_penalty: float) -> None:
+        """
+        Set the repetition penalty on the server
+        @param repetition_penalty: the repetition penalty
+        """
+        self.request("set_repetition_penalty", {"repetition_penalty": repetition_penalty})
+    def set_config(self, config: BasicConfig) -> None:
+        """
+        Set the config on the server
+        @param config: the config
+        """
+        self.request("set_config", {"name": config.config_name, "config": config.to_dict()})
+    def get_config(self) -> BasicConfig:
+        """
+        Get the config from the server
+        @return: the config
+        """
+        result = self.request("get_config")
+        return config_from_dict(result["name"], result["config"]) if result is not None else None
+    def model_id(self) -> str:
+        """
+        Identify the server's model weights
+        @return: the model id
+        """
+        return self.request("model_id")
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of the text with the server's tokenizer
+        @param text: the text
+        @return: the number of tokens
+        """
+        return self.request("count_tokens", {"text": text})
+    def context_length(self) -> int:
+        """
+        Get the server model's context length
+        @return: the context length
+        """
+        return self.request("context_length")
+    def generate(self, prompt: str) -> str:
+        """
+        Generate the cover letter on the server
+        @param prompt: the prompt for the model
+        @return: the generated cover letter
+        """
+        return self.request("generate", {"prompt": str(prompt), "prefix": getattr(prompt, "prefix", ""), "signer": getattr(prompt, "signer", "")})
+    def generate_candidates(self, prompt: str, n: int) -> list:
+        """
+        Generate several cover letters for the same prompt on the server
+        @param prompt: the prompt for the model
+        @param n: the number of letters
+        @return: the generated cover letters
+        """
+        return self.request("generate_candidates", {"prompt": str(prompt), "prefix": getattr(prompt, "prefix", ""), "signer": getattr(prompt, "signer", ""), "n": n})
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Generate the cover letter on the server, yielding text as it arrives
+        @param prompt: the prompt for the model
+        @return: an iterator over the text chunks
+        """
+        for message in self.call("stream", {"prompt": str(prompt), "prefix": getattr(prompt, "prefix", ""), "signer": getattr(prompt, "signer", "")}):
+            if "chunk" in message:
+                yield message["chunk"]
+    def stats(self) -> dict:
+        """
+        Get the server counters
+        @return: the counters
+        """
+        return self.request("stats")
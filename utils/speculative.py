@@ -0,0 +1,141 @@
+from typing import Iterator
+from utils.prefix_cache import common_prefix
+
+# how many of the last tokens the repetition penalty looks at, the ctransformers default
+LAST_N_TOKENS = 64
+
+class SpeculativeStats:
+    """
+    Acceptance counters of speculative decoding
+        proposed counts the drafted tokens, accepted the ones the main model
+        agreed with. Every verification also gives one token of the main
+        model's own, so a round yields accepted + 1 tokens at most.
+    """
+    def __init__(self) -> None:
+        self.rounds = 0
+        self.proposed = 0
+        self.accepted = 0
+        self.tokens = 0
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else None
+    def to_dict(self) -> dict:
+        """
+        Convert the counters to a dict
+        @return: the dict
+        """
+        rate = self.acceptance_rate()
+        return {"draft_rounds": self.rounds, "draft_proposed": self.proposed, "draft_accepted": self.accepted,
+                "draft_acceptance_rate": round(rate, 4) if rate is not None else None,
+                "tokens_per_round": round(self.tokens / self.rounds, 3) if self.rounds else None}
+
+def pick(logits: list, context: list, repetition_penalty: float = 1.0) -> int:
+    """
+    Pick the most likely next token
+        The logits of recently seen tokens are penalized like llama.cpp does
+    @param logits: the next token logits
+    @param context: the tokens so far
+    @param repetition_penalty: the repetition penalty, 1.0 for none
+    @return: the token
+    """
+    if repetition_penalty != 1.0:
+        logits = list(logits)
+        for token in set(context[-LAST_N_TOKENS:]):
+            logits[token] = logits[token] / repetition_penalty if logits[token] > 0 else logits[token] * repetition_penalty
+    return max(range(len(logits)), key=logits.__getitem__)
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding with a small draft model
+        The draft proposes k tokens one at a time, the main model evaluates
+        all of them in one pass. Its choice at every position is compared
+        with the draft's, the matching prefix is kept and the first token
+        it disagrees on is replaced by its own. The output is the letter
+        the main model writes greedily on its own, only faster when the
+        draft guesses well.
+
+        Both models need an evaluate(tokens, count) method returning the
+        next token logits of the last count positions of tokens, reusing
+        whatever prefix of tokens they evaluated before.
+    """
+    def __init__(self, target, draft, k: int = 4, repetition_penalty: float = 1.0) -> None:
+        if k < 1:
+            raise Exception(f"The draft has to propose at least one token, got k={k}")
+        self.target = target
+        self.draft = draft
+        self.k = k
+        self.repetition_penalty = repetition_penalty
+    def propose(self, context: list, k: int, eos_token_id: int = None) -> list:
+        """
+        Let the draft guess the next tokens
+        @param context: the tokens so far
+        @param k: the number of tokens to guess
+        @param eos_token_id: the end of sequence token, the draft stops after it
+        @return: the guessed tokens
+        """
+        proposal = []
+        for _ in range(k):
+            logits = self.draft.evaluate(context + proposal, 1)[0]
+            token = pick(logits, context + proposal, self.repetition_penalty)
+            proposal.append(token)
+            if token == eos_token_id:
+                break
+        return proposal
+    def generate(self, input_ids: list, max_new_tokens: int, eos_token_id: int = None, stats: SpeculativeStats = None) -> Iterator[int]:
+        """
+        Generate tokens, verifying up to k drafted tokens per pass of the main model
+        @param input_ids: the prompt tokens
+        @param max_new_tokens: the most tokens to generate
+        @param eos_token_id: the end of sequence token, generation stops after it
+        @param stats: the counters to add this generation to
+        @return: an iterator over the generated tokens
+        """
+        stats = SpeculativeStats() if stats is None else stats
+        context = list(input_ids)
+        generated = 0
+        while generated < max_new_tokens:
+            # the main model adds a token of its own, don't draft past the limit
+            proposal = self.propose(context, min(self.k, max_new_tokens - generated - 1), eos_token_id)
+            rows = self.target.evaluate(context + proposal, len(proposal) + 1)
+            stats.rounds += 1
+            stats.proposed += len(proposal)
+            for i, logits in enumerate(rows):
+                token = pick(logits, context, self.repetition_penalty)
+                context.append(token)
+                generated += 1
+                stats.tokens += 1
+                agreed = i < len(proposal) and token == proposal[i]
+                if agreed:
+                    stats.accepted += 1
+                yield token
+                if token == eos_token_id or generated >= max_new_tokens:
+                    return
+                if not agreed:
+                    break
+
+class LlamaCppModel:
+    """
+    GGML model loaded with llama.cpp, for speculative decoding
+        ctransformers only exposes the logits of the last evaluated token,
+        verifying drafted tokens needs the logits of every position. Needs
+        llama-cpp-python 0.1.78 or older, the last to read GGML v3 files.
+    """
+    def __init__(self, path: str, gpu_layers: int = 0, context_length: int = 4096) -> None:
+        from llama_cpp import Llama
+        self.llm = Llama(model_path=path, n_ctx=context_length, n_gpu_layers=gpu_layers, logits_all=True, verbose=False)
+    def vocab_size(self) -> int:
+        return self.llm.n_vocab()
+    def evaluate(self, tokens: list, count: int) -> list:
+        """
+        Get the next token logits of the last positions of tokens
+            Positions already evaluated are reused, anything evaluated
+            after the shared prefix (rejected draft tokens) is dropped
+        @param tokens: the context
+        @param count: the number of positions
+        @return: the logits of the last count positions, rows of llm.scores
+        """
+        keep = common_prefix(self.llm.input_ids[:self.llm.n_tokens].tolist(), tokens)
+        # eval_tokens and eval_logits are copies built on every access, the next eval writes from n_tokens
+        self.llm.n_tokens = keep
+        if keep < len(tokens):
+            self.llm.eval(tokens[keep:])
+        return self.llm.scores[len(tokens) - count:len(tokens)]
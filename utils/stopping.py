@@ -0,0 +1,135 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# words a letter is closed with before the signature
+SIGNOFFS = ["sincerely", "regards", "respectfully", "best", "thank you", "thanks", "cheers", "yours truly", "warmly"]
+# how far back a sign-off can start before the newest text
+SIGNOFF_WINDOW = 80
+# the lists watch_deadlines collects this thread's stoppers in
+watched = threading.local()
+
+@contextmanager
+def watch_deadlines():
+    """
+    Collect the stoppers built on this thread until the block ends
+        A letter cut at the deadline ends like a complete one, callers that
+        must tell them apart check the collected stoppers' timed_out
+    @return: the list the stoppers are added to
+    """
+    stoppers = []
+    watchers = watched.__dict__.setdefault("watchers", [])
+    watchers.append(stoppers)
+    try:
+        yield stoppers
+    finally:
+        # by identity, a generator's block can end out of order
+        watchers[:] = [watcher for watcher in watchers if watcher is not stoppers]
+
+def timed_out(stoppers: list) -> bool:
+    return any(stopper.timed_out for stopper in stoppers)
+
+class Stopper:
+    """
+    Finds where a generated letter is complete
+        The letter ends before the first stop sequence, or at the end of
+        the line with the signer's name under a sign-off like "Sincerely,".
+        Text is fed as it is decoded and only the part that is certainly
+        in the letter is returned, the end of the text that could still
+        become a stop sequence is held back. Past the deadline the letter
+        ends with whatever was generated.
+    """
+    def __init__(self, stop: list = None, signer: str = "", deadline: float = None) -> None:
+        self.stop = [sequence for sequence in (stop or []) if sequence]
+        self.signoff = None
+        if signer.strip():
+            self.signoff = re.compile(rf"\b(?:{'|'.join(SIGNOFFS)})\b[^\n]{{0,30}}\n[\s*_#>]*{re.escape(signer.strip())}", re.IGNORECASE)
+        self.window = SIGNOFF_WINDOW + len(signer)
+        self.text = ""
+        self.emitted = 0
+        self.stopped = False
+        # a time.monotonic() value
+        self.deadline = deadline
+        self.timed_out = False
+        for watcher in getattr(watched, "watchers", []):
+            watcher.append(self)
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+    def end(self, text: str, start: int = 0) -> int:
+        """
+        Find where the letter ends
+        @param text: the generated text
+        @param start: where to start looking for stop sequences
+        @return: the length of the letter, None when it isn't complete yet
+        """
+        ends = [index for index in (text.find(sequence, start) for sequence in self.stop) if index != -1]
+        if self.signoff is not None:
+            match = self.signoff.search(text, max(0, start - self.window))
+            if match is not None:
+                # keep the rest of the signature line, it ends once a newline comes
+                newline = text.find("\n", match.end())
+                if newline != -1:
+                    ends.append(newline)
+        return min(ends) if ends else None
+    def holdback(self) -> int:
+        """
+        Length of the end of the text that could be the start of a stop sequence
+        """
+        longest = 0
+        for sequence in self.stop:
+            for length in range(min(len(sequence) - 1, len(self.text)), longest, -1):
+                if self.text.endswith(sequence[:length]):
+                    longest = length
+                    break
+        return longest
+    def feed(self, text: str) -> str:
+        """
+        Add newly decoded text
+        @param text: the new text
+        @return: the text to show, empty once stopped
+        """
+        if self.stopped:
+            return ""
+        self.text += text
+        end = self.end(self.text, self.emitted)
+        if end is not None:
+            self.stopped = True
+            out = self.text[self.emitted:end]
+            self.emitted = end
+            return out
+        if self.expired():
+            self.stopped = True
+            self.timed_out = True
+            safe = len(self.text)
+        else:
+            safe = max(len(self.text) - self.holdback(), self.emitted)
+        out = self.text[self.emitted:safe]
+        self.emitted = safe
+        return out
+    def flush(self) -> str:
+        """
+        Get the held back text once generation ended without stopping
+            Past the deadline the letter counts as timed out
+        @return: the rest of the text
+        """
+        if self.stopped:
+            return ""
+        # backends also stop on expired() themselves, between two feeds
+        self.timed_out = self.expired()
+        out = self.text[self.emitted:]
+        self.emitted = len(self.text)
+        return out
+    def trim(self, text: str) -> str:
+        """
+        Cut a whole generated text where the letter ends
+            A text without an end past the deadline counts as timed out
+        @param text: the generated text
+        @return: the letter
+        """
+        end = self.end(text)
+        if end is None:
+            # an unfinished letter past the deadline was cut by it
+            self.timed_out = self.expired()
+            return text
+        return text[:end]
@@ -0,0 +1,117 @@
+import random
+from utils.decompose import DEFAULT_TAGS
+
+# synthetic HTML shaped like a Google Docs "Download as HTML" export
+HEAD = """<html><head><meta content="text/html; charset=UTF-8" http-equiv="content-type"><style type="text/css">ul.lst-kix_a-0{list-style-type:none}.c0{color:#000000;font-weight:400}.c1{padding-top:0pt;padding-bottom:0pt}.c2{margin-left:36pt;padding-left:0pt}</style></head><body class="c5 doc-content">"""
+TAIL = "</body></html>"
+
+WORDS = ["built", "designed", "maintained", "a", "service", "for", "the", "team", "with", "scalable", "pipelines",
+         "data", "api", "tests", "deployment", "reduced", "latency", "by", "customers", "platform", "tools", "and"]
+RESUME_SECTIONS = ["Experience", "Projects", "Activities", "Education"]
+JOB_SECTIONS = ["Responsibilities:", "Qualifications:", "Requirements:", "Nice to have", "About us"]
+COMPANY = "Example Corp"
+
+def sentence(rng: random.Random, words: int, nbsp: float) -> str:
+    """
+    Build a sentence of filler words
+    @param rng: the random generator
+    @param words: the number of words
+    @param nbsp: the chance a space is a non-breaking space
+    @return: the sentence
+    """
+    text = ""
+    for i in range(words):
+        if i:
+            text += "&nbsp;" if rng.random() < nbsp else " "
+        text += rng.choice(WORDS)
+    return text
+
+def spans(rng: random.Random, text: str, nbsp: float) -> str:
+    """
+    Split text over styled spans, the way Google Docs breaks up formatting runs
+    @param rng: the random generator
+    @param text: the text
+    @param nbsp: the chance of an extra span holding only a non-breaking space
+    @return: the HTML
+    """
+    html = ""
+    for part in text.split(" "):
+        html += f'<span class="c0">{part} </span>'
+        if rng.random() < nbsp:
+            html += '<span class="c0">&nbsp;</span>'
+    return html
+
+def bullet_list(rng: random.Random, items: int, depth: int, nbsp: float) -> str:
+    """
+    Build a ul, nesting a ul directly inside it depth times
+    @param rng: the random generator
+    @param items: the number of items per level
+    @param depth: the number of nested lists
+    @param nbsp: the share of non-breaking spaces
+    @return: the HTML
+    """
+    html = '<ul class="c2 lst-kix_a-0 start">'
+    for _ in range(items):
+        html += f'<li class="c1 li-bullet-0">{spans(rng, sentence(rng, rng.randint(6, 16), nbsp), nbsp)}</li>'
+    if depth > 0:
+        html += bullet_list(rng, max(1, items // 2), depth - 1, nbsp)
+    return html + "</ul>"
+
+def paragraph(rng: random.Random, text: str, nbsp: float) -> str:
+    return f'<p class="c1">{spans(rng, text, nbsp)}</p>'
+
+def synthetic_resume(entries: int = 4, items: int = 4, depth: int = 0, skills: int = 8, nbsp: float = 0.1, seed: int = 0) -> str:
+    """
+    Generate a resume
+    @param entries: the number of entries (a heading line and a ul) per section
+    @param items: the number of bullets per list
+    @param depth: how many lists are nested inside each list
+    @param skills: the number of skill tags mentioned in the skills line
+    @param nbsp: the share of non-breaking spaces
+    @param seed: the random seed
+    @return: the HTML
+    """
+    rng = random.Random(seed)
+    tags = [tag for tag in DEFAULT_TAGS if "/" not in tag]
+    html = HEAD + '<p class="c1"><span class="c0">Jane Doe</span></p>'
+    html += '<p class="c1"><span class="c0">Skills: ' + ", ".join(rng.choice(tags) for _ in range(skills)) + "</span></p>"
+    for section in RESUME_SECTIONS:
+        html += f'<h2 class="c1"><span class="c0">{section}</span></h2>'
+        for _ in range(entries):
+            html += paragraph(rng, f"{sentence(rng, 3, nbsp).title()} – 2021", nbsp)
+            html += bullet_list(rng, items, depth, nbsp)
+    return html + TAIL
+
+def synthetic_job(items: int = 6, depth: int = 0, nbsp: float = 0.1, seed: int = 0) -> str:
+    """
+    Generate a job description
+    @param items: the number of bullets per list
+    @param depth: how many lists are nested inside each list
+    @param nbsp: the share of non-breaking spaces
+    @param seed: the random seed
+    @return: the HTML
+    """
+    rng = random.Random(seed)
+    html = HEAD + f'<p class="c1"><span class="c0">{COMPANY} is hiring</span></p>'
+    for section in JOB_SECTIONS:
+        html += f'<p class="c1"><span class="c0">{section}</span></p>'
+        html += bullet_list(rng, items, depth, nbsp)
+    return html + TAIL
+
+def synthetic_details(seed: int = 0) -> dict:
+    """
+    Generate the user's details
+    @param seed: the random seed
+    @return: the details
+    """
+    rng = random.Random(seed)
+    return {
+        "name": "Jane Doe",
+        "phone_number": f"555-{rng.randint(1000, 9999)}",
+        "email": "jane@example.com",
+        "address": f"{rng.randint(1, 999)} Main St",
+        "company": COMPANY,
+        "company_address_1": f"{rng.randint(1, 999)} Market St",
+        "company_address_2": "Springfield",
+        "job_title": "Software Engineer",
+    }
@@ -0,0 +1,8 @@
+# character normalization shared by the decomposers
+
+# applied to every string get_text returns
+TEXT_TABLE = str.maketrans({'\xa0': ' ', '’': "'"})
+# applied to list items
+ITEM_TABLE = str.maketrans({'\xa0': ' ', '’': "'", '“': '"', '”': '"'})
+# applied to resume section titles
+TITLE_TABLE = str.maketrans({'–': '-', '•': '*'})
@@ -0,0 +1,179 @@
+import json
+import os
+import time
+from utils.decompose import decompose_job, decompose_resume
+from utils.inference import CONFIG_PATH, DEFAULT_CONTEXT_LENGTH, BasicConfig, RuntimeConfig, build_prompt, default_config
+from utils.synthetic import synthetic_details, synthetic_job, synthetic_resume
+
+# the quantizations of the GGML model, smallest first
+QUANT_FILES = [
+    "llama-2-13b-chat.ggmlv3.q4_0.bin",
+    "llama-2-13b-chat.ggmlv3.q4_K_M.bin",
+    "llama-2-13b-chat.ggmlv3.q5_K_M.bin",
+    "llama-2-13b-chat.ggmlv3.q6_K.bin",
+    "llama-2-13b-chat.ggmlv3.q8_0.bin",
+]
+BATCH_SIZES = [8, 32, 128, 512]
+# tokens decoded per trial
+DECODE_TOKENS = 24
+# a typical letter, weighs prefill against decode speed
+PROMPT_TOKENS = 1500
+LETTER_TOKENS = 450
+TUNED_PROFILE = "tuned"
+
+class TuneResult:
+    """
+    Speed of one model file, thread count and batch size
+    """
+    def __init__(self, model_file: str, threads: int, batch_size: int, prefill_tps: float, decode_tps: float) -> None:
+        self.model_file = model_file
+        self.threads = threads
+        self.batch_size = batch_size
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+    def letter_seconds(self, prompt_tokens: int = PROMPT_TOKENS, letter_tokens: int = LETTER_TOKENS) -> float:
+        """
+        Estimate how long a letter takes with these settings
+        @param prompt_tokens: the prompt length
+        @param letter_tokens: the letter length
+        @return: the seconds
+        """
+        if not self.prefill_tps or not self.decode_tps:
+            return float("inf")
+        return prompt_tokens / self.prefill_tps + letter_tokens / self.decode_tps
+    def to_dict(self) -> dict:
+        """
+        Convert the result to a dict
+        @return: the dict
+        """
+        return {"model_file": self.model_file, "threads": self.threads, "batch_size": self.batch_size,
+                "prefill_tokens_per_second": round(self.prefill_tps, 2), "decode_tokens_per_second": round(self.decode_tps, 2),
+                "letter_seconds": round(self.letter_seconds(), 1)}
+    def __str__(self) -> str:
+        return (f"{self.model_file} threads={self.threads} batch_size={self.batch_size}: "
+                f"prefill {self.prefill_tps:.1f} tok/s, decode {self.decode_tps:.2f} tok/s, ~{self.letter_seconds():.0f}s per letter")
+
+def thread_counts(cpus: int = None) -> list:
+    """
+    List the thread counts worth trying on this host
+    @param cpus: the CPU count, defaults to the CPUs this process may use
+    @return: powers of two up to the CPU count, half of it and all of it
+    """
+    if cpus is None:
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    counts = {cpus, max(cpus // 2, 1)}
+    count = 1
+    while count < cpus:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+def available_files(model_id: str, files: list = QUANT_FILES) -> list:
+    """
+    Find the quantizations that are already downloaded
+    @param model_id: the Hugging Face repository
+    @param files: the files to look for
+    @return: the downloaded files
+    """
+    from huggingface_hub import try_to_load_from_cache
+    return [file for file in files if isinstance(try_to_load_from_cache(model_id, file), str)]
+
+def synthetic_prompt() -> str:
+    """
+    Build the fixed prompt every setting is measured with
+    @return: the prompt
+    """
+    return build_prompt(decompose_job(synthetic_job(seed=0)), decompose_resume(synthetic_resume(seed=0)), synthetic_details(0))
+
+def benchmark(model, tokens: list, model_file: str, threads: int, batch_size: int, decode_tokens: int = DECODE_TOKENS, trial: int = 0) -> TuneResult:
+    """
+    Measure prefill and decode speed of a loaded ctransformers model
+    @param model: the model
+    @param tokens: the prompt tokens
+    @param model_file: the file the model was loaded from
+    @param threads: the threads to use
+    @param batch_size: the prompt tokens evaluated per batch
+    @param decode_tokens: the tokens to decode
+    @param trial: a number that differs for every trial
+    @return: the speeds
+    """
+    # ctransformers skips the part of the prompt it evaluated last time, a different second token makes it evaluate all of it
+    tokens = tokens[:1] + [1000 + trial % 20000] + tokens[1:]
+    start = time.perf_counter()
+    times = []
+    for token in model.generate(tokens, threads=threads, batch_size=batch_size, reset=True):
+        times.append(time.perf_counter())
+        if len(times) > decode_tokens:
+            break
+    # the first token comes after the prompt evaluation
+    prefill_tps = len(tokens) / (times[0] - start) if times else 0.0
+    decode_tps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+    return TuneResult(model_file, threads, batch_size, prefill_tps, decode_tps)
+
+def load_ggml(model_file: str, gpu_layers: int = 0):
+    from ctransformers import AutoModelForCausalLM
+    from utils.backends.ggml import MODEL_ID
+    return AutoModelForCausalLM.from_pretrained(MODEL_ID, model_file=model_file, model_type="llama", gpu_layers=gpu_layers, context_length=DEFAULT_CONTEXT_LENGTH)
+
+def tune(files: list, threads: list = None, batch_sizes: list = BATCH_SIZES, load=load_ggml, decode_tokens: int = DECODE_TOKENS, log=None) -> list:
+    """
+    Find the fastest model file, thread count and batch size on this host
+        Thread counts are tried with the largest batch size first, then
+        the batch sizes with the best thread count. Settings are compared
+        by the time a typical letter would take.
+    @param files: the model files to try
+    @param threads: the thread counts to try, see thread_counts
+    @param batch_sizes: the batch sizes to try
+    @param load: loads a model from a file
+    @param decode_tokens: the tokens to decode per trial
+    @param log: called with every result
+    @return: the results, fastest first
+    """
+    threads = thread_counts() if threads is None else threads
+    prompt = synthetic_prompt()
+    results = []
+    trial = 0
+    for model_file in files:
+        model = load(model_file)
+        tokens = model.tokenize(prompt)
+        # one untimed run to fault in the weights
+        benchmark(model, tokens, model_file, threads[-1], batch_sizes[-1], 1, trial)
+        best = None
+        for count in threads:
+            trial += 1
+            result = benchmark(model, tokens, model_file, count, batch_sizes[-1], decode_tokens, trial)
+            results.append(result)
+            if log is not None:
+                log(str(result))
+            if best is None or result.letter_seconds() < best.letter_seconds():
+                best = result
+        for batch_size in batch_sizes[:-1]:
+            trial += 1
+            result = benchmark(model, tokens, model_file, best.threads, batch_size, decode_tokens, trial)
+            results.append(result)
+            if log is not None:
+                log(str(result))
+        del model
+    return sorted(results, key=lambda result: result.letter_seconds())
+
+def write_profile(best: TuneResult, name: str = TUNED_PROFILE, base: BasicConfig = None, gpu_layers: int = None, results: list = None) -> str:
+    """
+    Write the best settings as a config profile
+    @param best: the fastest result
+    @param name: the profile name
+    @param base: the config to copy the other settings from, defaults to the default config
+    @param gpu_layers: the GPU layers the results were measured with
+    @param results: all the results, kept in the profile for reference
+    @return: the profile path
+    """
+    config = default_config() if base is None else base
+    config.config_name = name
+    config.runtime = RuntimeConfig(best.model_file, best.threads, best.batch_size, DEFAULT_CONTEXT_LENGTH, True, False, gpu_layers)
+    data = config.to_dict()
+    if results:
+        data["tuning"] = {"time": time.time(), "results": [result.to_dict() for result in results]}
+    os.makedirs(CONFIG_PATH, exist_ok=True)
+    path = os.path.join(CONFIG_PATH, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+    return path
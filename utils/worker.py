@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from utils.inference import Inference
+from utils.stopping import timed_out, watch_deadlines
+
+class GenerationWorker:
+    """
+    Streams a cover letter on a background thread
+        The caller takes the chunks as they come and stays free to draw and
+        read keys. cancel stops the stream at the next chunk, which for the
+        backends is the next token. The deadline is also checked here, so a
+        run past it is reported as timed out even while the model is still
+        evaluating the prompt. deadline is in seconds, None for no limit.
+    """
+    def __init__(self, inference: Inference, prompt: str, deadline: float = None) -> None:
+        self.inference = inference
+        self.prompt = prompt
+        self.chunks = queue.Queue()
+        self.parts = []
+        self.cancelled = threading.Event()
+        # running, done, cancelled, timeout or error
+        self.status = "running"
+        self.error = None
+        self.seconds = deadline
+        self.start_time = None
+        self.deadline = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    def start(self) -> "GenerationWorker":
+        """
+        Start generating, the deadline counts from here
+        @return: the worker
+        """
+        self.start_time = time.monotonic()
+        self.deadline = self.start_time + self.seconds if self.seconds else None
+        self.thread.start()
+        return self
+    def run(self) -> None:
+        chunks = self.inference.stream(self.prompt)
+        status = "done"
+        try:
+            with watch_deadlines() as stoppers:
+                for chunk in chunks:
+                    self.chunks.put(chunk)
+                    if self.cancelled.is_set():
+                        status = "cancelled"
+                        break
+                    if self.expired():
+                        status = "timeout"
+                        break
+            # the backend's own stopper may have ended the letter at the settings' deadline
+            if status == "done" and timed_out(stoppers):
+                status = "timeout"
+        except Exception as e:
+            status = "error"
+            self.error = e
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        if self.status == "running":
+            self.status = status
+        self.chunks.put(None)
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+    def cancel(self, status: str = "cancelled") -> None:
+        """
+        Stop the generation at the next token
+        @param status: what to report the run as
+        """
+        if self.status == "running":
+            self.status = status
+        self.cancelled.set()
+    def take(self, timeout: float = 0.05) -> list:
+        """
+        Get the chunks generated since the last call
+        @param timeout: how long to wait for the first one
+        @return: the chunks, possibly none
+        """
+        taken = []
+        try:
+            chunk = self.chunks.get(timeout=timeout)
+            while True:
+                if chunk is None:
+                    # keep the end marker for finished()
+                    self.chunks.put(None)
+                    break
+                taken.append(chunk)
+                chunk = self.chunks.get_nowait()
+        except queue.Empty:
+            pass
+        self.parts += taken
+        return taken
+    def finished(self) -> bool:
+        """
+        Check if the stream ended and every chunk was taken
+        """
+        return not self.thread.is_alive() and self.chunks.qsize() <= 1
+    def text(self) -> str:
+        return "".join(self.parts)
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time